@@ -49,6 +49,9 @@ def CR_limits(spectrum, cr)
         Takes automatically generated borders of the cosmic ray and refines them.
 def CR_search_and_destroy(spectrum, search_intensity='normal') 
         Uses all previous def successively (find, refine and erase).
+def CR_temporal(spectrum, neighbours=4, threshold=6, max_width=5, core=None)
+        Finds and erases cosmic rays by comparing each spectrum to its 
+        neighbours in time (dynamic-SERS series).
 
 """
 
@@ -62,6 +65,7 @@ TO DO : -Change error codes for Asgard exceptions?
 from scipy.signal import find_peaks
 from copy import deepcopy
 from numpy import mean, linspace, ndarray, asarray
+from numpy import median, absolute, arange, clip, zeros, diff, nonzero, split, unique, add
 from bisect import bisect_left
 
 def CR_finder(spectrum, method='pixel', search_intensity=None,
@@ -278,7 +282,7 @@ def CR_limits(spectrum, cr):
                 break
         right = pixel
 
-    elif cr <= 1 :             #for CR on left edge of spectra
+    elif cr <= 2 :             #for CR on left edge of spectra
         right = cr+2
         while normed_spec[right] > 0.01*normed_spec[cr]:
             right+=1
@@ -312,11 +316,17 @@ def CR_search_and_destroy(spectrum, search_intensity='normal') :
         search_intensity : 
             'high', 'normal' or 'low', 'pixel'.  Automaticaly assign find_peaks 
             parameter with increasing forgiveness. (Optionnal)
-            If 'pixel', CR_finder's pixel method is used. If anything else, defaults to 'normal'
+            If 'pixel', CR_finder's pixel method is used. If 'temporal', 
+            CR_temporal is used on the given spectra (neighbours are taken 
+            within the input only). If anything else, defaults to 'normal'
     
     returns :
         spectrum : A corrected version of the input.
     """
+    if search_intensity == 'temporal' :
+        spectrum, cr = CR_temporal(spectrum)
+        return spectrum
+    
     if search_intensity == 'pixel' :
         cr = CR_finder(spectrum, method='pixel')
     else :
@@ -333,5 +343,90 @@ def CR_search_and_destroy(spectrum, search_intensity='normal') :
         i +=1
  
     return spectrum
+
+
+def CR_temporal(spectrum, neighbours=4, threshold=6, max_width=5, core=None):
+    """
+    Temporal cosmic ray finder + eraser.  In a dynamic-SERS series, a cosmic 
+    ray is a single frame, very narrow event while molecule signals either
+    persist over a few frames or have Raman-like widths.  Each spectrum is 
+    compared to the rolling median of its neighbours in time : pixels far 
+    above that median (robust z-score) forming narrow runs are replaced by 
+    the median values, all spectra at once.
     
-        
+    Inputs :
+        spectrum : 
+            2D numpy array of spectra as columns, in acquisition order.
+        neighbours : 
+            Amount of neighbouring spectra (half on each side, the spectrum 
+            itself excluded) used for the rolling median.  Windows are 
+            shifted inward at the series borders.
+        threshold : 
+            Robust z-score (residual over 1.4826*MAD of the spectrum's 
+            residuals) above which a pixel is considered an outlier.
+        max_width : 
+            Widest run of outlier pixels (in pixels) still considered a 
+            cosmic ray.  Wider runs are kept as real signal.
+        core : 
+            Tuple (start, stop) of the columns to correct.  Columns outside
+            of it are only used as neighbours (halo when streaming blocks of
+            a larger series).  If None, all columns are corrected.
+    
+    returns :
+        spectrum : A corrected copy of the input.
+        cr : A list of tuple of the form (spectrum_idx, [list_of_CR_idx]).
+            spectrum_idx are column indexes of the input.
+    """
+    if isinstance(spectrum, ndarray) is False or len(spectrum.shape) != 2 :
+        raise TypeError('input must be a 2D numpy array of spectra as columns')
+    
+    spectrum = spectrum.copy()
+    pixel_nb, spec_nb = spectrum.shape
+    if core is None :
+        core = (0, spec_nb)
+    start, stop = core
+    
+    neighbours = min(neighbours, spec_nb-1)
+    if neighbours < 2 or stop <= start :       #not enough neighbours to vote
+        return spectrum, []
+    
+    #rolling median of the neighbours (spectrum itself excluded), 
+    #window shifted inward on the borders
+    current = arange(start, stop)
+    first = clip(current - neighbours//2, 0, spec_nb-neighbours-1)
+    shift = arange(neighbours)
+    others = first[:,None] + shift + (shift >= (current-first)[:,None])
+    reference = median(spectrum[:, others], axis=2)
+    
+    #robust z-score
+    residual = spectrum[:, start:stop] - reference
+    deviation = absolute(residual - median(residual, axis=0))
+    sigma = 1.4826 * median(deviation, axis=0)
+    sigma[sigma == 0] = 1e-12
+    outlier = (residual / sigma > threshold).T      #(spectrum, pixel)
+    
+    #runs of outlier pixels, only narrow ones are cosmic rays
+    padded = zeros((outlier.shape[0], pixel_nb+2), dtype='int8')
+    padded[:, 1:-1] = outlier
+    edges = diff(padded, axis=1)
+    run_spec, run_start = nonzero(edges == 1)
+    run_end = nonzero(edges == -1)[1]
+    narrow = (run_end - run_start) <= max_width
+    run_spec, run_start, run_end = run_spec[narrow], run_start[narrow], run_end[narrow]
+    if len(run_spec) == 0 :
+        return spectrum, []
+    
+    #repair the runs and one pixel of each tail with the neighbours' median
+    marks = zeros((outlier.shape[0], pixel_nb+1), dtype='int32')
+    add.at(marks, (run_spec, clip(run_start-1, 0, pixel_nb)), 1)
+    add.at(marks, (run_spec, clip(run_end+1, 0, pixel_nb)), -1)
+    repair = (marks.cumsum(axis=1)[:, :pixel_nb] > 0).T
+    core_spec = spectrum[:, start:stop]
+    core_spec[repair] = reference[repair]
+    
+    centers = (run_start + run_end - 1)//2
+    specs, cuts = unique(run_spec, return_index=True)
+    cr = [(int(spec)+start, [int(i) for i in rays]) 
+          for spec, rays in zip(specs, split(centers, cuts[1:]))]
+
+    return spectrum, cr
@@ -28,6 +28,7 @@ SOFTWARE.
 
 Asgard file "codes" and "extra codes" meaning :
     S : Spectra are writen to file
+    X : Spectra are read from their source file (referenced in the heading) instead of being copied
     G : Spectra have been separated by Thor and a list of Good spectra is present
     I : For unknown dataset, Loki has identified the spectra and a list of tag is present
     
@@ -37,7 +38,8 @@ Asgard file "codes" and "extra codes" meaning :
     Trg : All inactive spectra removed by Thor
     Trn : All spectra are inactive removed from a dataset
     Tn : Spectra have been smoothed and normalized by Thor
-    CRn/CRl/CRh/CRp : Cosmic ray removed with search intensity 'normal'/'low'/'high'/'pixel'
+    CRn/CRl/CRh/CRp/CRt : Cosmic ray removed with search intensity 'normal'/'low'/'high'/'pixel'/'temporal'
+    Cm : Cosmic ray repairs were recorded (spectrum, pixel range, original values) and can be undone
 
 Package requirements
 ---------------------
@@ -75,21 +77,24 @@ TO DO :
 
 from . import Exceptions as Exc
 from . import AsgardFileConvert as afc
+from . import AsgardFileExport as afe
+from . import AsgardFileFormat as aff
 
 from ..ThirdParty.AirPLS import AirPLS 
-from ..CRR import CR_search_and_destroy
+from ..CRR import CR_search_and_destroy, CR_temporal
 
 from os.path import isfile, basename
-from os import remove, getcwd
-from shutil import copy
+from os import remove, getcwd, cpu_count
+from shutil import copy, copyfileobj
 from copy import deepcopy
 
 from struct import pack
-from numpy import frombuffer, float32, float64, ndarray, zeros, load, median
-from numpy import save as save_
-from pandas import read_csv, DataFrame
+from numpy import frombuffer, float32, float64, ndarray, zeros, load, median, concatenate
+from numpy import asarray, diff, nonzero, dtype, arange
 from tempfile import TemporaryFile
 from bisect import bisect_right
+from functools import wraps
+from time import sleep, perf_counter
 
 from tkinter import Tk
 from tkinter import Toplevel, BooleanVar, Button, Label, Checkbutton, Frame
@@ -98,6 +103,22 @@ from tkinter.messagebox import askokcancel
 from scipy.signal import savgol_filter as sgfilt #smooths a curve
 from scipy.signal import find_peaks #find peaks in plot
 
+def _writes(method):
+    """
+    Decorates the AsgFile methods writing to the file : while they run, 
+    they hold its write lock (unless lock() was called) and its generation
+    is odd, so readers keep what they read (see AsgFile.refresh).
+    """
+    @wraps(method)
+    def writer(self, *args, **kwargs):
+        self._begin_write()
+        try :
+            return method(self, *args, **kwargs)
+        finally :
+            self._end_write()
+    return writer
+
+
 class AsgFile() :
     """
     create/load/modify Asgard's .asg files
@@ -131,12 +152,38 @@ class AsgFile() :
             indexes of spectra tagged as active by Thor
         identity : list of str
             classes identified by machine learning
+        cr_repairs : dict
+            cosmic ray repairs as {spectrum_idx : [(first_pixel, last_pixel, original_values)]}
+        external : dict
+            reference to spectra left in their source file (see link_data)
         codes : str
             primary code to indicate format and content
         extra_codes : str
             secondary codes to indicate format and content
         spec_byte : int
             file's start byte of spectra
+        version : int
+            format of the file, 1 or 2 (see AsgardFileFormat).  Files are 
+            written as version 2 when saved.
+        storage : str
+            numpy dtype of the spectra on disk ('<f4', '<f2', '<i2' or '<u2').
+            Spectra are always returned as float32.
+        scales : numpy 2D array or None
+            For int16/uint16 storages, (scale, offset) of the file (a row) or 
+            of each spectrum (scale_per_spectrum), value = stored*scale + offset.
+        compression : dict or None
+            If the spectra are compressed in chunks, 'Codec', 'Level', 
+            'Shuffle' and 'Chunk rows' (see AsgardFileFormat.read_chunks).
+        chunks : numpy 2D array or None
+            Index of the compressed chunks, (first spectrum, offset) as rows.
+        crcs : numpy 1D array or None
+            CRC32 of each chunk of stored spectra (see verify), None for files
+            written without them.
+        crc_rows : int or None
+            Spectra per chunk of crcs (None : the compressed chunks).
+        generation : int or None
+            Generation of the file when it was loaded (see changed and 
+            AsgardFileFormat.WriteLock), None for version 1 files.
         name : str
             name of file with extension
         path : path (str)
@@ -153,14 +200,23 @@ class AsgFile() :
             Redirects to self.Asgard_param[]
         __getitem__(idx)
             [] overload, returns requested data if slice or user infos if string.
+        __iter__()
+            Iterates over the spectra, one at a time.
+        iter_blocks(size=1000, start=0, stop=None)
+            Iterates over the spectra as blocks of rows.
         
-        to_numpy(path=None, orient='row')
+        to_numpy(path=None, orient='row', indices=None, ask=True)
             Takes the data and creates a numpy 2D array with it. If path is None
             returns the numpy array as a variable.
-        to_txt(path, orient='row')
+        to_txt(path, orient='row', precision=9, delimiter=',', indices=None)
             Takes the data and writes it to a .txt file as tab separated values.
-        to_excel(path, orient='row')
+        to_excel(path, orient='row', indices=None, sheets=16)
             Takes the data and writes it to an excel file.
+        to_hdf5(path, indices=None, compression=4)
+        to_parquet(path, indices=None, compression=3)
+        to_feather(path, indices=None, compression=None)
+            Takes the data, axis, labels, good flags and identity and writes
+            them to a HDF5, Parquet or Arrow IPC (Feather) file.
         
         Following functions are to store user info in the file.  It was meant 
         to have an interface and automation, but that will remain as a
@@ -179,23 +235,37 @@ class AsgFile() :
             Assigns given axis to internal saved axis for the data.
         axis_first() 
             Removes first spectrum from data and assigns it as the axis internally.
-        convert_data(file_path=None, type_=None)
+        convert_data(file_path=None, type_=None, axis_rmv=False, storage='float32', compression=None, spectrum_length=None)
             Extracts data from the given file path and writes them to the .asg file.
         label(mini, maxi, label, save=None) 
             For known datasets, assign a label to a portion of the data.  
             Used for machine learning training.
-        Narvi_merge(file_path, type_=None, axis_rmv=False)
+        Narvi_merge(file_path, type_=None, axis_rmv=False, spectrum_length=None)
             Used by the Narvi software to append a dataset to this .asg file.
-        CR_removal(search_intensity='normal')
+        append(spectra, storage='float32', compression=None)
+            Appends spectra (numpy array) to the file without rewriting it.
+        compress(compression='zstd', level=None, shuffle=True, chunk_rows=None)
+            Compresses the stored spectra, as they are.
+        CR_removal(search_intensity='normal', neighbours=4, skip_clean=True)
             Searches for cosmic rays in the dataset and removes them automatically.
+        cr_map()
+            Returns the recorded cosmic ray repairs.
+        cr_undo(spectra=None)
+            Restores the original values of repaired cosmic rays.
         save(path=None)
             Saves internal parameter to file by rewriting it. (included 
             automatically in most internal methods)
+        verify(workers=None)
+            Checks the stored spectra against their checksums.
+        lock(timeout=None), unlock()
+            Holds the write lock of the file (single writer).
+        changed(), refresh(timeout=1.)
+            Detects and reads what another program wrote to the file.
         Thor_preprocess()
             Used by Thor software to update Asgard parameters and filter everything
-        write_heading(path)
+        write_heading(path, storage=None)
             Used internally to write the heading of the .asg file before 
-            writing the data as bytes.  Also counts the bytes for the spec_byte attr.
+            writing the data as bytes.  Returns the spec_byte of the file.
 
     """
     
@@ -253,9 +323,24 @@ class AsgFile() :
         self.label_range = []
         self.good = [] #list of good spectra idx
         self.identity = [] #list of str, for all good, name of identified class
+        self.cr_repairs = {} #cosmic ray repairs as {spec idx : [(first pixel, last pixel, original values)]}
+        self.external = {} #if spectra are read from their source file, {'Path','Offset','Dtype','Shape','Checksum'}
         self.codes = '' #Asgard parameter defining content
         self.extra_codes = '' #Asgard parameter to define extra less essential informations
         self.spec_byte = 0 #file's start byte of spectra (to seek())
+        self.version = aff.VERSION #file format version (1 : float32 spec_byte, 2 : binary preamble)
+        self.storage = '<f4' #numpy dtype of the spectra on disk
+        self.scales = None #int16/uint16 storage, (scale, offset) of the file or of each spectrum
+        self.scale_per_spectrum = False #whether scales has a row per spectrum
+        self.compression = None #chunk compression of the spectra, {'Codec','Level','Shuffle','Chunk rows'}
+        self.chunks = None #compressed spectra, (first spectrum, offset) of each chunk
+        self._reader = None #compressed spectra, AsgardFileFormat.ChunkReader (cache of chunks)
+        self.crcs = None #CRC32 of each chunk of stored spectra
+        self.crc_rows = None #spectra per chunk of crcs (None if compressed)
+        self.generation = 0 #generation of the file when loaded, odd while written (see AsgardFileFormat.WriteLock)
+        self._lock = None #AsgardFileFormat.WriteLock held by lock() or by the method writing the file
+        self._writing = 0 #depth of the methods writing the file (see _writes)
+        self._own_lock = False #whether _lock was taken by the method writing the file, not by lock()
         self.name = '' #name of file with extension
         self.path = '' #path to file including name and extension
         
@@ -264,24 +349,7 @@ class AsgFile() :
             """Creates an empty .asg file that can then be filled with data"""
             if path is None :
                 path=self.path
-            with open(path, 'wb') as f:
-                f.write(bytes('Asgard Data File\n','utf-8'))
-                f.write(bytearray(pack('f', 0)))
-                f.write(bytes('\n\n\n\n','utf-8'))
-                f.write(bytes('Experiment infos\n\n','utf-8'))
-                f.write(bytes('Asgard parameters\n','utf-8'))  #insert param here
-                for param in self.Asgard_param.keys():
-                    value = self.Asgard_param[param]
-                    if type(value) is list :
-                        f.write(bytes(param + '\t', 'utf-8'))
-                        for i in value :
-                            f.write(bytearray(pack('f',i)))
-                        f.write(bytes('\n', 'utf-8'))
-                    else :
-                        f.write(bytes('%s\t%s\n'%(param, str(self.Asgard_param[param])), 'utf-8'))
-                f.write(bytes('\n', 'utf-8'))
-                f.write(bytes('Good\n\n\n\n','utf-8'))
-                f.write(bytes('Spectra\n','utf-8'))
+            self.spec_byte = self.write_heading(path)
         
         #Support for names with or without extensions and with full directory or not
         if file_path.endswith('.asg'):
@@ -319,18 +387,9 @@ class AsgFile() :
         #Load instead of create
             else : 
                 with open(self.path, 'rb') as f:
-                    line = f.readline().strip().decode('utf-8')
-                    if line != 'Asgard Data File' :
-                        raise Exc.FileFormatError('%s either is not a Asgard file or has been tempered with.' %(self.name))
-                    
                     try :
-                        #Heading
-                        self.spec_byte = f.read(4)
-                        self.spec_byte = int(frombuffer(self.spec_byte, dtype=float32))
-                        f.readline()
-                        
-                        if self.spec_byte == 0 :
-                            self.spec_byte = None
+                        #Heading (version 1 or 2, see AsgardFileFormat)
+                        self.spec_byte, self.version, preamble = aff.open_heading(f, preamble=True)
                         
                         self.codes = f.readline().strip().decode('utf-8')
                         self.extra_codes = f.readline().strip().decode('utf-8')
@@ -370,6 +429,33 @@ class AsgFile() :
                                 self.label_range.append(i)
                             self.label_range.append(limits[-1])
 
+                        #Cosmic ray repairs
+                        if 'Cm' in self.extra_codes :
+                            line = f.readline().strip().decode('utf-8')
+                            if line != 'Cosmic rays' :
+                                raise Exc.FileFormatError('%s either is not a Asgard file or has been tempered with.' %(self.name))
+                            
+                            line = f.readline()[:-1].decode('utf-8').split('\t')
+                            while line != [''] :
+                                spec_idx = int(line[0])
+                                dash = line[1].index('-')
+                                values = asarray(line[2].split(','), dtype=float32)
+                                repair = (int(line[1][:dash]), int(line[1][dash+1:]), values)
+                                self.cr_repairs.setdefault(spec_idx, []).append(repair)
+                                line = f.readline()[:-1].decode('utf-8').split('\t')
+
+                        #Spectra stored in another file
+                        if 'X' in self.codes :
+                            line = f.readline().strip().decode('utf-8')
+                            if line != 'External data' :
+                                raise Exc.FileFormatError('%s either is not a Asgard file or has been tempered with.' %(self.name))
+                            
+                            line = f.readline()[:-1].decode('utf-8').split('\t')
+                            while line != [''] :
+                                self.external[line[0]] = line[1]
+                                line = f.readline()[:-1].decode('utf-8').split('\t')
+                            self.external['Offset'] = int(self.external['Offset'])
+                            self.external['Shape'] = tuple([int(i) for i in self.external['Shape'].split(',')])
 
                         #User infos
                         line = f.readline().strip().decode('utf-8')
@@ -389,7 +475,7 @@ class AsgFile() :
                                                 
                         line = f.readline()[:-1].split(b'\t')
                         while line != [bytes('','utf-8')] :
-                            value = line[1].decode('utf-8')
+                            value = line[1].decode('utf-8').strip()
                             if line[0].decode('utf-8') == 'Axis' :
                                 if value == 'None' :
                                     self.Asgard_param['Axis'] = None
@@ -438,7 +524,19 @@ class AsgFile() :
                             raise Exc.FileFormatError('%s either is not a Asgard file or has been tempered with.' %(self.name))
                     except Exc.FileFormatError:
                         raise Exc.FileFormatError('%s either is not a Asgard file or has been tempered with.' %(self.name))
-                    
+                
+                    #sections from the preamble checked above, not read again
+                    f.seek(0)
+                    self.storage, self.scales, self.scale_per_spectrum = aff.read_storage(f, preamble)
+                    f.seek(0)
+                    self.compression, self.chunks = aff.read_chunks(f, preamble)
+                    f.seek(0)
+                    self.crcs, self.crc_rows = aff.read_checksums(f, preamble)
+                    f.seek(0)
+                    self.generation = aff.read_generation(f) #last, see refresh
+                
+                if 'X' in self.codes :
+                    self._check_external()
                     
         else :
             create_blank()
@@ -613,44 +711,264 @@ class AsgFile() :
             elif col_end > self*'Spec len' :
                 raise IndexError('index %s is out of bound for axis 1 with size %s' %(col_end, self*'Spec len'))
 
+            #spectra may be stored in this file or in an external source
+            path, spec_byte, data_type = self._data_source()
+            size = data_type.itemsize
+            spec_len = self*'Spec len'
+            
             #column bytes
-            col_offset = col_start*4
-            col_len = (col_end - col_start)*4
+            col_offset = col_start*size
+            col_len = (col_end - col_start)*size
             
             #row bytes
             row_len = row_end-row_start #They see me row_len....
-            row_start = self.spec_byte + (row_start*(self*'Spec len')*4)
+            first = row_start
+            row_start = spec_byte + (row_start*spec_len*size)
                         
+            #compressed spectra : only the chunks holding them are decompressed
+            if self.compression is not None and 'X' not in self.codes :
+                result = self._chunk_reader().rows(first, first+row_len)[:, col_start:col_end]
+                if row_len == 1 or col_len == size :
+                    result = result.ravel()
+            
             #extract in different types for different data lengths
-            if row_len == 1 :
-                with open(self.path, 'rb') as f :
+            elif row_len == 1 :
+                with open(path, 'rb') as f :
                     f.seek(row_start + col_offset)
                     data = f.read(col_len)
-                    result = frombuffer(data,dtype=float32)     #1D numpy.ndarray
+                    result = frombuffer(data,dtype=data_type)     #1D numpy.ndarray
 
             else :
-                if col_len == 4 :
-                    result = zeros(row_len,dtype=float32)
-                    with open(self.path, 'rb') as f :
+                if col_len == size :
+                    result = zeros(row_len,dtype=data_type)
+                    with open(path, 'rb') as f :
                         for row in range(row_len):
-                            f.seek(row_start + col_offset + (row*4*(self*'Spec len')))
-                            data = f.read(4)
-                            result[row] = frombuffer(data, dtype=float32)  #1D numpy.ndarray
-
+                            f.seek(row_start + col_offset + (row*size*spec_len))
+                            data = f.read(size)
+                            result[row] = frombuffer(data, dtype=data_type)  #1D numpy.ndarray
+
+                elif col_len == spec_len*size :     #full spectra are contiguous on disk
+                    result = zeros([row_len,spec_len], dtype=data_type)
+                    with open(path, 'rb') as f :
+                        f.seek(row_start)
+                        if f.readinto(result) != row_len*col_len :    #read in place, result stays writable
+                            raise Exc.FileFormatError('%s is shorter than its heading says.' %(self.name))
+                        
                 else :
-                    result = zeros([row_len,col_len//4], dtype=float32)
-                    with open(self.path, 'rb') as f :
+                    result = zeros([row_len,col_len//size], dtype=data_type)
+                    with open(path, 'rb') as f :
                         for row in range(row_len):
-                            f.seek(row_start + col_offset + (row*4*(self*'Spec len')))
+                            f.seek(row_start + col_offset + (row*size*spec_len))
                             data = f.read(col_len)
-                            result[row,:] = frombuffer(data, dtype=float32) #2D numpy.ndarray
+                            result[row,:] = frombuffer(data, dtype=data_type) #2D numpy.ndarray
+            
+            #stored values to float32 (see AsgardFileFormat.decode)
+            scales = None
+            rows = None
+            if 'X' not in self.codes and self.scales is not None :
+                scales = self.scales
+                if self.scale_per_spectrum is True :
+                    rows = arange(first, first+row_len)
+            result = aff.decode(result, scales, rows)
+            if result.flags.writeable is False : #i.e. views of the cached chunks
+                result = result.copy()
                     
         return result
 
-    def to_numpy(self, path=None,  orient='row'):
+    def __iter__(self):
+        """
+        Iterates over the stored spectra, one 1D numpy array at a time.  
+        Spectra are read from disk in blocks (see iter_blocks).
+        """
+        for start, block in self.iter_blocks():
+            for spectrum in block :
+                yield spectrum
+    
+    def iter_blocks(self, size=1000, start=0, stop=None, workers=None):
+        """
+        Reads the stored spectra sequentially in blocks of rows, keeping at 
+        most one block in RAM.  Compressed spectra are decompressed ahead, 
+        a few chunks at a time, in a pool of threads.
+        
+        inputs
+        -------
+        size : int
+            Amount of spectra per block.
+        start : int
+            Index of the first spectrum to read.
+        stop : int
+            Index after the last spectrum to read.  If None, reads to the end.
+        workers : int or None
+            Threads decompressing compressed spectra (1 : no thread).  If 
+            None, one per processor, up to 4.
+            
+        Yields
+        -------
+        start : int
+            Index of the first spectrum of the block.
+        block : numpy 2D array
+            Spectra as rows.
+        """
+        if stop is None :
+            stop = self*'Spec amount'
+        if self.compression is None or 'X' in self.codes :
+            for first in range(start, stop, size):
+                block = self[first:min(first+size, stop)]
+                yield first, block.reshape([-1, self*'Spec len'])
+            return
+        
+        #chunks are regrouped (or split) in blocks of size spectra
+        if workers is None :
+            workers = min(4, cpu_count() or 1)
+        first = start
+        parts = []
+        amount = 0
+        for chunk_start, stored in self._chunk_reader().blocks(start, stop, workers=workers) :
+            parts.append(stored)
+            amount += stored.shape[0]
+            while amount >= size or (amount > 0 and first + amount == stop) :
+                stored = concatenate(parts)
+                rows = min(size, amount)
+                yield first, self._decode(stored[:rows], first)
+                parts = [stored[rows:]]
+                amount -= rows
+                first += rows
+    
+    def _decode(self, stored, first):
+        """Stored spectra (2D) from spectrum first to float32"""
+        rows = None
+        if self.scale_per_spectrum is True :
+            rows = slice(first, first+stored.shape[0])
+        return aff.decode(stored, self.scales, rows)
+    
+    def _chunk_reader(self):
+        """Reader of the compressed spectra, kept (with its cache) while they are unchanged"""
+        reader = self._reader
+        if (reader is None or reader.index is not self.chunks or reader.path != self.path 
+            or reader.spec_byte != self.spec_byte) :
+            self._reader = aff.ChunkReader(self.path, self.spec_byte, self.compression, self.chunks, 
+                                           self.storage, self*'Spec len', crcs=self.crcs)
+        return self._reader
+    
+    def _data_source(self):
+        """Returns (path, start byte, numpy dtype) of the file where the spectra are stored"""
+        if 'X' in self.codes :
+            return self.external['Path'], self.external['Offset'], dtype(self.external['Dtype'])
+        else :
+            return self.path, self.spec_byte, dtype(self.storage)
+    
+    def _data_size(self, storage=None):
+        """Size of the spectra stored in the file, in bytes"""
+        if 'S' not in self.codes or 'X' in self.codes :
+            return 0
+        if storage is None :
+            if self.compression is not None :
+                return int(self.chunks[-1, 1])
+            storage = self.storage
+        return (self*'Spec amount' or 0)*(self*'Spec len' or 0)*dtype(storage).itemsize
+    
+    def _encoder(self, keep=False, append=False):
+        """
+        Encoder of the storage (and compression) of this file (see 
+        AsgardFileFormat), to append spectra (continuing the checksums if 
+        append is True), or to rewrite the spectra with their own scales if 
+        keep is True.
+        """
+        checksums = None
+        if append is True and self.crcs is not None :
+            rows = 0 if self.compression is not None else self.crc_rows
+            checksums = aff.Checksums(rows, (self*'Spec len')*dtype(self.storage).itemsize, 
+                                      self.crcs, self*'Spec amount')
+        if self.scales is not None and self.scale_per_spectrum is False :
+            return aff.Encoder(self.storage, scale=self.scales[0, 0], offset=self.scales[0, 1], 
+                               compression=self.compression, checksums=checksums)
+        if keep is True and self.scales is not None :
+            return aff.Encoder(self.storage, table=self.scales, compression=self.compression, 
+                               checksums=checksums)
+        return aff.Encoder(self.storage, compression=self.compression, checksums=checksums)
+    
+    def _write_footer(self, path=None):
+        """Writes what follows the spectra (scales, chunk index, checksums) to the file at path (self.path)"""
+        if path is None :
+            path = self.path
+        sections = {}
+        if self.scales is not None and 'X' not in self.codes :
+            sections[b'SCAL'] = aff.pack_scales(self.scales, self.scale_per_spectrum)
+        if self.compression is not None and 'X' not in self.codes :
+            sections[b'CIDX'] = aff.pack_chunks(self.compression, self.chunks)
+        if self.crcs is not None and 'X' not in self.codes :
+            sections[b'CRCS'] = aff.pack_checksums(self.crcs, self.crc_rows)
+        aff.write_footer(path, self._data_size(), sections)
+    
+    def _copy_spectra(self, source, path, start=0):
+        """
+        Appends the uncompressed spectra of this file, read from the file 
+        source at byte start, to the file at path, and computes their 
+        checksums on the way.
+        """
+        checksums = aff.Checksums(row_size=(self*'Spec len')*dtype(self.storage).itemsize)
+        remaining = self._data_size()
+        with open(source, 'rb') as f :
+            with open(path, 'ab') as dst :
+                f.seek(start)
+                while remaining > 0 :
+                    data = f.read(min(remaining, 2**24))
+                    if len(data) == 0 :
+                        break
+                    checksums.update(data)
+                    dst.write(data)
+                    remaining -= len(data)
+        self.crcs, self.crc_rows = checksums.table()
+    
+    def _chunk_ranges(self):
+        """(first spectrum, last spectrum, first byte, last byte) of each chunk of crcs, last excluded"""
+        if self.compression is not None :
+            index = [[int(value) for value in row] for row in self.chunks]
+            return [(index[i][0], index[i+1][0], index[i][1], index[i+1][1]) for i in range(len(index)-1)]
+        
+        row_size = (self*'Spec len')*dtype(self.storage).itemsize
+        amount = self*'Spec amount'
+        rows = self.crc_rows or aff.Checksums(row_size=row_size).rows
+        return [(first, min(first+rows, amount), first*row_size, min(first+rows, amount)*row_size) 
+                for first in range(0, amount, rows)]
+    
+    def _rewrite(self, blocks):
+        """
+        Rewrites the file with the given compressed spectra.  blocks yields 
+        the stored values (2D) of every spectrum, in order.
+        """
+        encoder = aff.Encoder(self.storage, compression=self.compression)
+        temp = TemporaryFile('wb', delete=False)
+        temp.close()
+        self.write_heading(temp.name)
+        try :
+            with open(temp.name, 'ab') as f :
+                for stored in blocks :
+                    f.write(encoder.pack(stored))
+                f.write(encoder.flush())
+        except :
+            remove(temp.name)
+            raise
+        self.chunks = encoder.chunk_index()
+        self.crcs, self.crc_rows = encoder.crc_table()
+        self._write_footer(temp.name)
+        
+        copy(temp.name, self.path)
+        remove(temp.name)
+        self.spec_byte = aff.spec_byte(self.path)
+    
+    def _check_external(self):
+        """Makes sure referenced spectra are still where (and what) they were when linked"""
+        if isfile(self.external['Path']) is False :
+            raise Exc.FileNameError('%s reads its spectra from %s, which can not be found.' %(self.name, self.external['Path']))
+        if afc.source_checksum(self.external) != self.external['Checksum'] :
+            raise Exc.FileFormatError('%s reads its spectra from %s, which has been modified since.' %(self.name, self.external['Path']))
+    
+    def to_numpy(self, path=None,  orient='row', indices=None, ask=True):
         """
         Takes the stored spectra and converts them to a numpy array either on 
-        RAM or on disk.
+        RAM or on disk.  On disk, the array is written block by block (see 
+        AsgardFileExport) and never held in RAM.
 
         inputs
         -------
@@ -660,40 +978,52 @@ class AsgFile() :
         orient : str
             Orientation of the spectra in the resulting file/variable.
             'row' for spectra as row, anything else for spectra as columns.
+        indices : list of int
+            Spectra to export, in order (i.e. self.good).  If None, all of them.
+        ask : bool
+            If path is None, asks the user before bringing the dataset to 
+            RAM.  Use False when there is no user (no tkinter dialog).
 
         Returns
         --------
         array : numpy 2D array
-            array containing all spectra as rows.  Only returned if path is None.
+            array containing the spectra.  Only returned if path is None.
+        report : dict
+            Path, Bytes, Seconds and MB/s of the export.  Only returned if a 
+            path is given.
             
         Yields
         -------
         -A .npy file containing the data.  Only yielded if a valid path is given. 
             
         """
-        answer = askokcancel('Warning!','By exporting to numpy, the whole'+ 
-                             "dataset will be brought to your computer's ram.\n\n"+
-                             'If you do not have enough ram, your computer might freeze\n\n'+
-                             'Proceed?')
-        if answer is True :
-            if orient == 'row' :
-                if path is not None :
-                    save_(path, self[:,:])
-                else :
-                    array = self[:,:]
-                    return array
-            else :
-                if path is not None :
-                    save_(path, self[:,:].T)
-                else :
-                    array = self[:,:].T
-                    return array
+        if path is not None :
+            writer = afe.NpyWriter(path, orient=orient)
+            return afe.export(self, [writer], indices=indices)[0]
+        
+        if ask is True :
+            answer = askokcancel('Warning!','By exporting to numpy, the whole'+ 
+                                 "dataset will be brought to your computer's ram.\n\n"+
+                                 'If you do not have enough ram, your computer might freeze\n\n'+
+                                 'Proceed?')
+            if answer is False :
+                return None
+        
+        blocks = list(afe.read_blocks(self, indices=indices))
+        if len(blocks) == 0 :
+            array = zeros([0, self*'Spec len'], dtype=float32)
+        else :
+            array = concatenate(blocks)
+        if orient != 'row' :
+            array = array.T
+        return array
             
             
-    def to_txt(self, path, orient='row'):
+    def to_txt(self, path, orient='row', precision=9, delimiter=',', indices=None):
         """
         Takes the stored spectra and creates a text file (.txt) with data writen
-        as str separated by \n
+        as str separated by delimiter, one line per spectrum (or per pixel).
+        Spectra are read and formatted by blocks (see AsgardFileExport).
 
         inputs
         -------
@@ -702,68 +1032,130 @@ class AsgFile() :
         orient : str
             Orientation of the spectra in the resulting file/variable.
             'row' for spectra as row, anything else for spectra as columns.
+        precision : int
+            Significant digits written for each value (9 keeps float32 values exact).
+        delimiter : str
+            Separates the values of a line.
+        indices : list of int
+            Spectra to export, in order (i.e. self.good).  If None, all of them.
         
+        Returns
+        --------
+        report : dict
+            Path, Bytes, Seconds and MB/s of the export.
+            
         Yields
         -------
         -A .txt file containing the data.
             
         """     
-        if path.endswith('.txt') is False :
-            path = path+'.txt'
-            
-        with open(path, 'w') as f :
-            if orient == 'row' :
-                for specID in range(self*'Spec amount'):
-                    spec = self[specID]
-                    for idx, pixel in enumerate(spec) :
-                        if idx == len(spec)-1:
-                            f.write(str(pixel)+'\n')
-                        else :
-                            f.write(str(pixel)+',')
-                    f.write('\n')
-            else :
-                for pixel in range(self*'Spec len'):
-                    line = self[:,pixel]
-                    for idx, spec in enumerate(line) :
-                        if idx == len(line)-1 :
-                            f.write(str(spec)+'\n')
-                        else :
-                            f.write(str(spec)+',')
+        writer = afe.TxtWriter(path, orient=orient, precision=precision, delimiter=delimiter)
+        return afe.export(self, [writer], indices=indices)[0]
                             
-    def to_excel(self, path, orient='row'):
+    def to_excel(self, path, orient='row', indices=None, sheets=16):
         """
-        Takes the stored spectra and creates an excel file (.xlsx) with it.
+        Takes the stored spectra and creates an excel file (.xlsx) with it,
+        written by blocks (see AsgardFileExport.XlsxWriter).  Data larger 
+        than an Excel sheet continues on new sheets and workbooks.
 
         inputs
         -------
         path : valid path as str
-            Where the numpy array .txt file should be created.
+            Where the .xlsx file should be created.
         orient : str
             Orientation of the spectra in the resulting file/variable.
             'row' for spectra as row, anything else for spectra as columns.
+        indices : list of int
+            Spectra to export, in order (i.e. self.good).  If None, all of them.
+        sheets : int
+            Maximum amount of sheets in a workbook.
+        
+        Returns
+        --------
+        report : dict
+            Path, Bytes, Seconds and MB/s of the export.
         
         Yields
         -------
-        -A .xlsx file containing the data.
+        -A .xlsx file (or more) containing the data.
             
         """ 
-        if path.endswith('.xlsx') is False :
-            path = path+'.xlsx'
+        writer = afe.XlsxWriter(path, orient=orient, sheets=sheets)
+        return afe.export(self, [writer], indices=indices)[0]
+    
+    def to_hdf5(self, path, indices=None, compression=4):
+        """
+        Writes the spectra (as rows) to a chunked HDF5 .h5 file, with the axis
+        and the label, good flag and identity of each spectrum (requires h5py,
+        see AsgardFileExport.HDF5Writer).
 
-            answer = askokcancel('Warning!','By exporting to excel, the whole'+ 
-                                 "dataset will be brought to your computer's ram for a bit.\n\n"+
-                                 'If you do not have enough ram, your computer might freeze\n\n'+
-                                 'Proceed?')
-            if answer is True :
-                
-                if orient == 'row' :
-                    DF = DataFrame(data=self[:,:])
-                    DF.to_excel(path, index=False)
-                else :
-                    DF = DataFrame(data=self[:,:].T)
-                    DF.to_excel(path, index=False)
-                    
-                del DF
+        inputs
+        -------
+        path : valid path as str
+            Where the .h5 file should be created.
+        indices : list of int
+            Spectra to export, in order (i.e. self.good).  If None, all of them.
+        compression : int
+            gzip level (0-9), None for no compression.
+        
+        Returns
+        --------
+        report : dict
+            Path, Bytes, Seconds and MB/s of the export.
+        """
+        writer = afe.HDF5Writer(path, compression=compression)
+        return afe.export(self, [writer], indices=indices)[0]
+    
+    def to_parquet(self, path, indices=None, compression=3, codec='zstd'):
+        """
+        Writes the spectra (as rows) to a Parquet file, a row group per block,
+        with the axis and the label, good flag and identity of each spectrum 
+        (requires pyarrow, see AsgardFileExport.ParquetWriter).
+
+        inputs
+        -------
+        path : valid path as str
+            Where the .parquet file should be created.
+        indices : list of int
+            Spectra to export, in order (i.e. self.good).  If None, all of them.
+        compression : int
+            Compression level of the codec, None for its default.
+        codec : str
+            'zstd', 'gzip', 'brotli', 'lz4', 'snappy' or 'none'.
+        
+        Returns
+        --------
+        report : dict
+            Path, Bytes, Seconds and MB/s of the export.
+        """
+        writer = afe.ParquetWriter(path, compression=compression, codec=codec)
+        return afe.export(self, [writer], indices=indices)[0]
+    
+    def to_feather(self, path, indices=None, compression=None, codec='zstd'):
+        """
+        Writes the spectra (as rows) to an Arrow IPC (Feather v2) file, with 
+        the axis and the label, good flag and identity of each spectrum 
+        (requires pyarrow, see AsgardFileExport.FeatherWriter).  Uncompressed
+        files can be memory mapped and loaded without copies.
+
+        inputs
+        -------
+        path : valid path as str
+            Where the .feather file should be created.
+        indices : list of int
+            Spectra to export, in order (i.e. self.good).  If None, all of them.
+        compression : int
+            Compression level of the codec, None for no compression.
+        codec : str
+            'zstd' or 'lz4', used if compression is not None.
+        
+        Returns
+        --------
+        report : dict
+            Path, Bytes, Seconds and MB/s of the export.
+        """
+        writer = afe.FeatherWriter(path, compression=compression, codec=codec)
+        return afe.export(self, [writer], indices=indices)[0]
                                
     ## End of AsgardFile ease of use fct
     
@@ -820,6 +1212,7 @@ class AsgFile() :
     
     
     ## Asgard file creation fct
+    @_writes
     def assign_axis(self, axis):
         """
         Assigns a given axis to the internal parameters and on file.  
@@ -853,6 +1246,7 @@ class AsgFile() :
             
             else :
                 try :
+                    from pandas import read_csv
                     ax = read_csv(axis, sep=None, usecols=range(0,1), header=None).to_numpy().reshape(-1)                   
                     new_axis = [float(i) for i in ax]                    
                     self.Asgard_param['Axis'] = new_axis
@@ -894,6 +1288,7 @@ class AsgFile() :
         self.save()
 
 
+    @_writes
     def axis_first(self, keep=True) :
         """
         Extracts the first spectrum from the file, saves it as the axis, 
@@ -916,28 +1311,46 @@ class AsgFile() :
         
         self.Asgard_param['Spec amount'] -=1
         self.shape = (self*'Spec len', self*'Spec amount')
-
+        
+        #cosmic ray repairs follow their spectrum
+        self.cr_repairs = {idx-1 : self.cr_repairs[idx] for idx in self.cr_repairs.keys() if idx > 0}
+        if len(self.cr_repairs) == 0 :
+            self.extra_codes = self.extra_codes.replace('Cm', '')
+
+        #referenced spectra : the reference simply starts one spectrum later
+        if 'X' in self.codes :
+            self.external['Offset'] += self*'Spec len'*dtype(self.external['Dtype']).itemsize
+            self.external['Shape'] = (self.external['Shape'][0]-1, self.external['Shape'][1])
+            self.external['Checksum'] = afc.source_checksum(self.external)
+            self.extra_codes += 'Af'
+            self.save()
+            return
+
+        size = dtype(self.storage).itemsize
+        if self.scale_per_spectrum is True :
+            self.scales = self.scales[1:]
+        if self.compression is not None :
+            #compressed spectra are rechunked, without decoding them
+            reader = self._chunk_reader()
+            self.extra_codes += 'Af'
+            self._rewrite(stored for start, stored in reader.blocks(1, self*'Spec amount'+1))
+            return
         temp = TemporaryFile('wb', delete=False)
         self.write_heading(temp.name)
-        with open(self.path,'rb') as f :
-            with open(temp.name, 'ab') as temp:
-                f.seek(self.spec_byte + (self*'Spec len'*4))
-                for spectrum in range(self*'Spec amount'):
-                    line = f.read(self*'Spec len'*4)
-                    temp.write(line)
+        self._copy_spectra(self.path, temp.name, self.spec_byte + (self*'Spec len'*size))
+        self._write_footer(temp.name)
         
         remove(self.path)
         temp.close()
         copy(temp.name, self.path)
         remove(temp.name)
 
-        with open(self.path,'rb') as f :
-            f.readline()
-            byte = f.read(4)
-            self.spec_byte = int(frombuffer(byte, dtype=float32))
+        self.spec_byte = aff.spec_byte(self.path)
         self.extra_codes += 'Af'
         
-    def convert_data(self, file_path=None, type_=None, axis_rmv=False):
+    @_writes
+    def convert_data(self, file_path=None, type_=None, axis_rmv=False, storage='float32', scale=None, offset=0.,
+                     compression=None, level=None, shuffle=True, chunk_rows=None, spectrum_length=None):
         """
         Extracts data from a file of another format using AsgardFileConvert.py 
         and writes it to the AsgardFile.
@@ -952,6 +1365,28 @@ class AsgFile() :
             Valid Asgard type are stored as keys in Asgard.Configs.ConfigVariables.py.
             If type_ is None, AsgardFileCovnert's sniffing function will be used.
         
+        storage : 'float32', 'float16', 'int16' or 'uint16'
+            How the spectra are stored on disk (see AsgardFileFormat.Encoder).
+            16 bits storages halve the size of the file and of every read.
+        scale, offset : float
+            For int16/uint16, spectra are stored as (value - offset)/scale.
+            If scale is None, each spectrum gets its own scale and offset.
+            Integer counts fit exactly in uint16 with scale=1 and offset=0.
+        compression : 'zlib', 'lz4', 'zstd' or None
+            Compresses the spectra in chunks of spectra (see AsgardFileFormat).
+            lz4 and zstd require the lz4 and zstandard packages.  Reading a 
+            spectrum then decompresses only its chunk.
+        level : int or None
+            Compression level (None : default of the codec).
+        shuffle : bool
+            Groups the bytes of the values by position before compressing
+            (byte-shuffle), which helps slowly varying spectra.
+        chunk_rows : int or None
+            Spectra per chunk.  If None, chunks hold about 1 MB of spectra.
+        spectrum_length : int or None
+            Length of the spectra of Witec files, which are stored back to 
+            back.  If None, it is found from the values (see stream_Witec).
+        
         
         **AsgardFile.save() included**
         
@@ -959,20 +1394,9 @@ class AsgFile() :
         if 'S' in self.codes :
             raise Exc.WrongMethodError('To merge multiple files together, please use Narvi' + 
                                        ' or the Narvi_merge method.')
-            
-        
-        #Automatically detects existing convert function and make a dict
-        convert_fct = {}
-        for key in afc.__dict__.keys() :
-            if key.startswith('convert_'):
-                listy = key.split('_')
-                if len(listy) >2:
-                    name = listy[1]
-                    for i in listy[2:]:
-                        name = name + '_' + i
-                else : name = listy[1]    
-                convert_fct[name] = afc.__dict__[key]
         
+        data_type = self._storage_type(storage)
+        compression = self._compression(compression, level, shuffle, chunk_rows)
         
         #get path
         if file_path is None :
@@ -985,64 +1409,197 @@ class AsgFile() :
             else :
                 file_path = askopenfilename(title='Select a file to convert')
         
-        #Get asgard param
-        if type_ is None :
-            if axis_rmv is True :
-                Asgard_param, type_, axis = afc.type_sniff(file_path, hold=True, axisf=True)
-            else :
-                Asgard_param, type_ = afc.type_sniff(file_path, hold=True)
-        else :
-            try :
-                if axis_rmv is True:
-                    Asgard_param, axis = convert_fct[type_](file_path, hold=True, axisf=True)
-                else :
-                    Asgard_param = convert_fct[type_](file_path, hold=True)
-            except KeyError:
-                raise Exc.FileFormatError(('%s file type is not recognised.\n' + 
-                                          'Following are valid file types :\n' + 
-                                          'Andor\nASCII\nMatlab\nnumpy\nText' )%type_)
+        #Single pass : metadata first, then the spectra by blocks
+        type_, spectra = afc.stream(file_path, type_=type_, axisf=axis_rmv, spectrum_length=spectrum_length)
+        Asgard_param, axis = next(spectra)
         
+        codes = self.codes
+        old_param = dict(self.Asgard_param)
         self.codes +='S'
         for param in Asgard_param.keys() :
             if param == 'Thor' :
-                self.good = Asgard_param.pop('Thor')
+                self.good = Asgard_param['Thor']
                 self.codes += 'G'
-            self.Asgard_param[param] = Asgard_param[param]
+            else :
+                self.Asgard_param[param] = Asgard_param[param]
         if axis_rmv is True :
-            self.Asgard_param['Axis'] = axis
-
+            self.Asgard_param['Axis'] = [float(i) for i in axis]
+        if self*'Spec amount' is None :
+            self.Asgard_param['Spec amount'] = 0    #patched once the spectra are written
+        
+        self.storage = data_type
+        encoder = aff.Encoder(data_type, scale=scale, offset=offset, compression=compression)
         self.write_heading(self.path)
         
         #write data to file
         try :
-            if axis_rmv is True :
-                dst, Asgard_param, axis = convert_fct[type_](file_path, dst=self.path, axisf=True)
-            else :
-                dst, Asgard_param = convert_fct[type_](file_path, dst=self.path)
+            self.spec_byte = aff.spec_byte(self.path)
             
-            with open(self.path,'rb') as f :
-                f.readline()
-                byte = f.read(4)
-                self.spec_byte = int(frombuffer(byte, dtype=float32))
-                    
-                    
-            self.shape = (self*'Spec len', self*'Spec amount')
+            amount = afc.write_stream(spectra, self.path, encoder=encoder)
             
-        except :
+        except Exception as error :
             #error, restore old stuff
-            self.codes = self.codes[:-1]
-            for param in Asgard_param.keys() :
-                if param == 'Thor' :
-                    self.codes = self.codes[:-1]
-                else :
-                    self.Asgard_param.pop(param)
-                
-            raise Exc.FileFormatError(('%s file type is not recognised.\n' + 
-                                          'Following are valid file types :\n' + 
-                                          'Andor\nASCII\nMatlab\nnumpy\nText' )%type_)
+            spectra.close()
+            self.codes = codes
+            self.Asgard_param = old_param
+            self.storage = '<f4'
+            self.write_heading(self.path)
+            self.spec_byte = aff.spec_byte(self.path)
+            
+            if type(error) is Exc.InputError :
+                raise
+            raise Exc.FileFormatError('%s file could not be converted as a %s file' %(file_path, type_))
+        
+        self.scales = encoder.table()
+        self.scale_per_spectrum = encoder.per_spectrum
+        self.compression = encoder.compression
+        self.chunks = encoder.chunk_index()
+        self.crcs, self.crc_rows = encoder.crc_table()
+        self.Asgard_param['Spec amount'] = amount
+        self._patch_param('Spec amount', amount)
+        self._write_footer()
+        self.shape = (self*'Spec len', self*'Spec amount')
+        
+    
+    @staticmethod
+    def _storage_type(storage):
+        """numpy dtype of a storage name of convert_data"""
+        data_type = aff.STORAGES.get(storage, storage)
+        if data_type not in aff.STORAGES.values() :
+            raise Exc.InputError('storage must be one of %s' %(', '.join(aff.STORAGES.keys())))
+        return data_type
+    
+    @staticmethod
+    def _compression(compression, level=None, shuffle=True, chunk_rows=None):
+        """compression attribute from the compression inputs of convert_data (None if not compressed)"""
+        if compression is None :
+            return None
+        if compression not in aff.CODECS :
+            raise Exc.InputError('compression must be one of %s or None' %(', '.join(aff.CODECS)))
+        aff.codec(compression)
+        return {'Codec' : compression, 'Level' : level, 'Shuffle' : shuffle is True, 
+                'Chunk rows' : chunk_rows}
+    
+    def _patch_param(self, key, value):
+        """
+        Rewrites the value of an Asgard parameter in the heading of the file
+        without rewriting the file.  Only integer values of 'Spec amount' and 
+        'Spec len' are padded for it (see write_heading), otherwise the file 
+        is saved.
+        """
+        self.Asgard_param[key] = value
+        value = bytes('%-20s' %value, 'utf-8')
+        with open(self.path, 'r+b') as f :
+            heading = f.read(self.spec_byte)
+            start = heading.find(b'\nAsgard parameters\n')
+            if start != -1 :
+                start = heading.find(bytes('\n%s\t' %key, 'utf-8'), start)
+            if start != -1 :
+                start += len(key) + 2
+                end = heading.find(b'\n', start)
+                if end - start == 20 and len(value) == 20 :
+                    f.seek(start)
+                    f.write(value)
+                    aff.reseal(f, self._data_size())
+                    return
+        self.save()
+            
+            
+    @_writes
+    def link_data(self, file_path=None, type_=None, axis_rmv=False, orient='row'):
+        """
+        Alternative to convert_data for Andor .sif and numpy files : instead 
+        of copying the spectra, the .asg records where they are in the source 
+        file (path, offset, dtype, shape and a checksum) and reads them from 
+        there.  The source file must then stay where it is, unmodified.
+        
+        inputs
+        -------
+        file_path : valid path as str
+            path to the file to be referenced.  If None, a selection menu will 
+            be opened for the user to select it.
+        type_ : 'Andor' or 'numpy'
+            If None, found from the file extension.
+        axis_rmv : bool
+            Uses the first spectrum as the axis.
+        orient : 'row' or 'col'
+            Orientation of the spectra in a numpy file.
+        
+        Raises FileFormatError if the spectra of the file can not be read in 
+        place (other types, non-contiguous spectra), use convert_data instead.
+        
+        **AsgardFile.save() included**
+        
+        """
+        if 'S' in self.codes :
+            raise Exc.WrongMethodError('To merge multiple files together, please use Narvi' + 
+                                       ' or the Narvi_merge method.')
+        
+        if file_path is None :
+            if self.root is None :
+                self.root = Tk()
+                self.root.attributes('-topmost', True)
+                self.root.iconify()
+                file_path = askopenfilename(title='Select a file to reference')
+                self.root.destroy()
+            else :
+                file_path = askopenfilename(title='Select a file to reference')
+        
+        if axis_rmv is True :
+            Asgard_param, reference, axis = afc.external_reference(file_path, type_=type_, orient=orient, axisf=True)
+            Asgard_param['Axis'] = [float(i) for i in axis]
+            self.extra_codes += 'Af'
+        else :
+            Asgard_param, reference = afc.external_reference(file_path, type_=type_, orient=orient)
+        
+        for param in Asgard_param.keys() :
+            self.Asgard_param[param] = Asgard_param[param]
+        self.shape = (self*'Spec len', self*'Spec amount')
+        self.external = reference
+        self.codes += 'SX'
+        self.save()
+        
+    @_writes
+    def materialize(self):
+        """
+        Copies referenced spectra (see link_data) into the .asg file so it no 
+        longer depends on its source file.  Does nothing if the spectra are 
+        already stored in the file.
+        
+        **AsgardFile.save() included**
+        
+        """
+        if 'X' not in self.codes :
+            return
+        
+        temp = TemporaryFile('wb', delete=False)
+        temp.close()
+        try :
+            for first, block in self.iter_blocks() :
+                afc._write_rows(temp.name, block)
             
-                   
+            self.codes = self.codes.replace('X', '')
+            external = self.external
+            self.external = {}
+            temp_head = TemporaryFile('wb', suffix='.asg', delete=False)
+            temp_head.close()
+            self.write_heading(temp_head.name)
+            self._copy_spectra(temp.name, temp_head.name)
+            self._write_footer(temp_head.name)
+        except :
+            remove(temp.name)
+            if 'X' not in self.codes :
+                self.codes += 'X'
+                self.external = external
+            raise
+        
+        copy(temp_head.name, self.path)
+        remove(temp_head.name)
+        remove(temp.name)
+        
+        self.spec_byte = aff.spec_byte(self.path)
         
+    @_writes
     def label(self, mini, maxi, label, save=True):
         """
         Adds a label to the data.  This label will be used for machine learning
@@ -1096,7 +1653,8 @@ class AsgFile() :
         self.label_range.append(limits[-1])
 
 
-    def Narvi_merge(self, file_path, type_=None, axis_rmv=False):
+    @_writes
+    def Narvi_merge(self, file_path, type_=None, axis_rmv=False, spectrum_length=None):
         """
         Appends new data to the current file using AsgardFileConvert functions.
         
@@ -1110,6 +1668,8 @@ class AsgFile() :
             If type_ is None, AsgardFileCovnert's sniffing function will be used.
         axis_rmv : bool
             Whether the first spectrum should be removed before appending data.
+        spectrum_length : int or None
+            Length of the spectra of Witec files (see convert_data).
         
         returns
         --------
@@ -1120,26 +1680,21 @@ class AsgFile() :
         
         """
         if 'S' not in self.codes :
-            self.convert_data(file_path=file_path, type_=type_, axis_rmv=axis_rmv)
+            self.convert_data(file_path=file_path, type_=type_, axis_rmv=axis_rmv, spectrum_length=spectrum_length)
             if axis_rmv is True :
                 return self*'Axis'
             
         else :
+            #new data are appended to this file, it must hold its own spectra
+            if 'X' in self.codes :
+                self.materialize()
             
             #Extract the data & param from source file 
             hits = None
-            axis = None
             
             if file_path.endswith('.asg') or type_ == 'Asgard':
                 type_ = 'Asgard'
-                if axis_rmv is True:
-                    Asgard_param, axis = afc.convert_Asgard(file_path=file_path, hold=True, axisf=True)
-                else :
-                    Asgard_param = afc.convert_Asgard(file_path=file_path, hold=True)
                 asg = AsgFile(file_path, root=self.root)
-                if Asgard_param['Spec len'] != self*'Spec len' :
-                    raise Exc.FileFormatError('File to merge has a different length of spectrum')
-
                 if 'G' in self.codes and 'G' not in asg.codes :
                     raise Exc.FutureImplementationError('We do not currently support merging a preprocessed file with a raw one')
                 elif 'G' not in self.codes and 'G' in asg.codes:
@@ -1161,121 +1716,439 @@ class AsgFile() :
 #                    ident = asg.identity
 #                    
 #                    TO DO : append infos? replace infos? keep infos? root.ask...
-                
-            elif type_ is None :
-                if axis_rmv is True :
-                    Asgard_param, type_, axis = afc.type_sniff(file_path, hold=True, axisf=True)
-                else:
-                    Asgard_param, type_ = afc.type_sniff(file_path, hold=True)
-                
-            else :
-                if axis_rmv is True :
-                    Asgard_param, axis = afc.__dict__['convert_'+type_](file_path=file_path, hold=True, axisf=True)
-                else :
-                    Asgard_param = afc.__dict__['convert_'+type_](file_path=file_path, hold=True)
-                
+            
+            #Single pass : metadata first, then the spectra by blocks
+            type_, spectra = afc.stream(file_path, type_=type_, axisf=axis_rmv, spectrum_length=spectrum_length)
+            Asgard_param, axis = next(spectra)
             
             if Asgard_param['Spec len'] != self*'Spec len' :
+                spectra.close()
                 raise Exc.FileFormatError('File to merge has a different length of spectrum')
             
             if type_ == 'old_Thor' :
                 if 'G' not in self.codes :
+                    spectra.close()
                     raise Exc.FutureImplementationError('We do not currently support merging a raw file with a preprocessed one')
                 else :
                     #is the preprocessing the same?
                     for key in self.Asgard_param.keys():
                         if key != 'Spec amount' and key != 'Axis':
-                            if self*key != asg*key :
+                            if self*key != Asgard_param.get(key) :
+                                spectra.close()
                                 raise Exc.FutureImplementationError('We do not currently support merging files with different preprocessing')
                     #continue if it is
                     hits = Asgard_param.pop('Thor')
+            elif hits is not None :
+                hits = Asgard_param.pop('Thor') #good spectra of the Asgard file, without the axis
             
+            first = self*'Spec amount'
+            self._append(spectra)
             
+            heading = hits is not None or 'Nm' not in self.extra_codes
             if hits is not None :
                 for i in hits:
-                    self.Good.append(i+self*'Spec amount')
-            self.Asgard_param['Spec amount'] += Asgard_param['Spec amount']
-            self.shape = (self*'Spec len', self*'Spec amount')
-            
+                    self.good.append(i+first)
             
             if 'Nm' not in self.extra_codes :
                 self.extra_codes += 'Nm'
             
             if axis is not None :
                 self.assign_axis(axis)
+            elif heading is True :
+                self.save()
             else :
-                self.save
-            
-            if axis_rmv is True :
-                dst, Asgard_param, axis = afc.__dict__['convert_'+type_](file_path=file_path, dst=self.path, axisf=True)
-            else: 
-                dst, Asgard_param = afc.__dict__['convert_'+type_](file_path=file_path, dst=self.path)
+                self._write_footer()
+                self._patch_param('Spec amount', self*'Spec amount')
                             
             try :
                 return Asgard_param['Axis']
             except KeyError :   #If no axis assigned
                 return None
             
-    def CR_removal(self, search_intensity='normal'):
+            
+    @_writes
+    def append(self, spectra, storage='float32', scale=None, offset=0., compression=None, level=None, 
+               shuffle=True, chunk_rows=None):
+        """
+        Appends spectra to the file : they are written after the current 
+        ones, in the storage of the file, then the amount of spectra of the 
+        heading is patched, so the file is never rewritten.  Appending many 
+        spectra at once is faster (and, if compressed, compresses better) 
+        than one at a time.
+        
+        inputs
+        -------
+        spectra : numpy array
+            Spectra as rows (or a single spectrum as 1D array).
+        storage, scale, offset, compression, level, shuffle, chunk_rows :
+            How the spectra are stored, as convert_data.  Only used if the 
+            file holds no spectra yet, otherwise the storage of the file is 
+            kept.
+        
+        **AsgardFile.save() included**
+        
+        """
+        block = asarray(spectra, dtype=float32)
+        if block.ndim == 1 :
+            block = block.reshape([1, -1])
+        if 'X' in self.codes :
+            raise Exc.WrongMethodError('Spectra can not be appended to a file reading them from their source' + 
+                                       ' file, materialize it first.')
+        
+        if 'S' not in self.codes :
+            data_type = self._storage_type(storage)
+            compression = self._compression(compression, level, shuffle, chunk_rows)
+            encoder = aff.Encoder(data_type, scale=scale, offset=offset, compression=compression)
+            self.codes += 'S'
+            self.storage = data_type
+            self.Asgard_param['Spec len'] = block.shape[1]
+            self.Asgard_param['Spec amount'] = 0    #patched once the spectra are written
+            self.write_heading(self.path)
+            self.spec_byte = aff.spec_byte(self.path)
+            amount = afc.write_stream([block], self.path, encoder=encoder)
+            self.scales = encoder.table()
+            self.scale_per_spectrum = encoder.per_spectrum
+            self.compression = encoder.compression
+            self.chunks = encoder.chunk_index()
+            self.crcs, self.crc_rows = encoder.crc_table()
+            self.Asgard_param['Spec amount'] = amount
+            self.shape = (self*'Spec len', self*'Spec amount')
+        
+        else :
+            if block.shape[1] != self*'Spec len' :
+                raise Exc.FileFormatError('Spectra to append have a different length of spectrum')
+            if block.shape[0] == 0 :
+                return
+            self._append([block])
+        
+        #the amount of spectra is patched last, once the spectra are written
+        self._write_footer()
+        self._patch_param('Spec amount', self*'Spec amount')
+    
+    def _append(self, spectra):
+        """
+        Writes the blocks of spectra (2D float arrays) after the ones of this 
+        file, in its storage, and updates the scales, chunk index, checksums
+        and amount of spectra.  The sections after the spectra are truncated :
+        the caller rewrites them, with the heading, once this returns.
+        """
+        #the heading is updated once the spectra are all written
+        end = self.spec_byte + self._data_size()
+        with open(self.path, 'r+b') as f :
+            f.truncate(end)
+        encoder = self._encoder(append=True)
+        try :
+            amount = afc.write_stream(spectra, self.path, encoder=encoder)
+        except :
+            with open(self.path, 'r+b') as f :
+                f.truncate(end)
+            self._write_footer()
+            raise
+        if self.scale_per_spectrum is True :
+            self.scales = concatenate([self.scales, encoder.table()])
+        if self.compression is not None :
+            self.chunks = concatenate([self.chunks[:-1], encoder.chunk_index() + self.chunks[-1]])
+        if self.crcs is not None :
+            self.crcs, self.crc_rows = encoder.crc_table()
+        self.Asgard_param['Spec amount'] += amount
+        self.shape = (self*'Spec len', self*'Spec amount')
+        return amount
+    
+    @_writes
+    def compress(self, compression='zstd', level=None, shuffle=True, chunk_rows=None):
+        """
+        Compresses the spectra of the file in chunks (see convert_data).  The
+        stored values are compressed as they are, so 16 bits storages lose 
+        nothing more.  Does nothing if the file is already compressed.
+        
+        inputs
+        -------
+        compression : 'zlib', 'lz4' or 'zstd'
+        level, shuffle, chunk_rows :
+            As convert_data.
+        
+        **AsgardFile.save() included**
+        
+        """
+        if 'S' not in self.codes or 'X' in self.codes :
+            raise Exc.WrongMethodError('Only the spectra stored in the file can be compressed.')
+        if self.compression is not None :
+            return
+        compression = self._compression(compression, level, shuffle, chunk_rows)
+        if compression is None :
+            return
+        
+        path, start, data_type = self._data_source()
+        spec_len = self*'Spec len'
+        amount = self*'Spec amount'
+        rows = max(1, aff.CHUNK_SIZE // (spec_len*data_type.itemsize))
+        def blocks():
+            with open(path, 'rb') as f :
+                f.seek(start)
+                for first in range(0, amount, rows) :
+                    count = min(rows, amount - first)
+                    raw = f.read(count*spec_len*data_type.itemsize)
+                    yield frombuffer(raw, dtype=data_type).reshape([count, spec_len])
+        
+        self.compression = compression
+        try :
+            self._rewrite(blocks())
+        except :
+            self.compression = None
+            self.chunks = None
+            raise
+    
+    @_writes
+    def CR_removal(self, search_intensity='normal', neighbours=4, skip_clean=True):
         """
         Automatically scan all spectra in batch for cosmic rays and erase them.
+        Every repair is recorded in the file (see cr_map and cr_undo).
         
         Inputs
         --------
-        search_intensity : 'high','low','normal'
+        search_intensity : 'high','low','normal','pixel','temporal'
             Preset sets of parameter to identify CR.  Thor uses 'normal' by default.
             Access to other presets require calling the method yourself with code ;)
+            'temporal' compares each spectrum to the rolling median of its 
+            neighbours in time (see CRR.CR_temporal), which is faster and 
+            more specific for dynamic-SERS series.
             
             Note : There is an alternate CR identification method in 
                     CR_search_and_destroy if you want to code yourself :)
+        neighbours : int
+            Amount of neighbouring spectra used by the 'temporal' search.
+        skip_clean : bool
+            If repairs were recorded by a previous pass, only revisit the 
+            spectra that were repaired.  The other spectra are copied as is.
         
         Return
         -------
         Nothing, the file is rewriten with corrected data.
         """
-        temp = TemporaryFile('wb', suffix='.asg', delete=False)#.name
-        codes = self.extra_codes
-        if search_intensity in ('high','low', 'pixel') :
-            self.extra_codes +='CR'+search_intensity[0]
-        else :
-            self.extra_codes += 'CRn'        
-        self.write_heading(temp.name)
-        temp = AsgFile(temp.name)
-        
+        def runs(mask):
+            """Returns (row, first, last) of every run of True along the rows of a 2D mask"""
+            padded = zeros([mask.shape[0], mask.shape[1]+2], dtype='int8')
+            padded[:, 1:-1] = mask
+            edges = diff(padded, axis=1)
+            row, first = nonzero(edges == 1)
+            last = nonzero(edges == -1)[1]-1
+            return row, first, last
         
+        codes = self.extra_codes
+        primary_codes = self.codes
+        external = self.external
+        repairs = self.cr_repairs
+        scales, chunks = self.scales, self.chunks
+        crcs, crc_rows = self.crcs, self.crc_rows
+        revisit = None
+        if skip_clean is True and 'Cm' in self.extra_codes :
+            revisit = set(repairs.keys())
+        new_repairs = {}
+        
+        encoder = self._encoder(keep=True) #original values must still fit, for cr_undo
+        temp = TemporaryFile('wb', delete=False)
+        temp.close()
+        temp_head = None
         try :
-            batch_amount = self*'Spec amount'//1000
-            if self*'Spec amount'%1000 != 0 :
-                batch_amount += 1
-
-            for i in range(batch_amount) :
-                if i == batch_amount-1 :
-                    batch = self[(i*1000):].T # AsgFile gives spec as rows, CR takes input spec as column --> .T
-                else :
-                    batch = self[(i*1000):((i+1)*1000)].T # AsgFile gives spec as rows, CR takes input spec as column --> .T
-                corrected = CR_search_and_destroy(batch, search_intensity)
-                with open(temp.path, 'ab') as f:
-                    for spec in range(corrected.shape[1]) : 
-                        for pix in list(corrected[:,spec]) : 
-                            f.write(bytearray(pack('f',pix)))
-                            
+            with open(temp.name, 'ab') as f:
+                spec_amount = self*'Spec amount'
+                buffer = zeros([0, self*'Spec len'], dtype=float32)
+                buffer_start = 0
+                for start in range(0, spec_amount, 1000):
+                    stop = min(start+1000, spec_amount)
+                    if search_intensity == 'temporal' :
+                        #sliding buffer : every spectrum is read once, blocks 
+                        #are extended by their neighbours (halo) on both sides
+                        halo_start = max(0, start-neighbours)
+                        halo_stop = min(spec_amount, stop+neighbours)
+                        read_from = buffer_start + buffer.shape[0]
+                        buffer = buffer[halo_start-buffer_start:]
+                        if read_from < halo_stop :
+                            new = self[read_from:halo_stop].reshape([-1, self*'Spec len'])
+                            buffer = concatenate([buffer, new])
+                        buffer_start = halo_start
+                        block = buffer[start-halo_start:stop-halo_start]
+                    else :
+                        block = self[start:stop].reshape([-1, self*'Spec len'])
+                    
+                    #which spectra to (re)visit
+                    if revisit is None :
+                        rows = [i for i in range(stop-start)]
+                    else :
+                        rows = [i-start for i in range(start, stop) if i in revisit]
+                    
+                    corrected = block.copy()
+                    if len(rows) > 0 :
+                        if search_intensity == 'temporal' :
+                            fixed, cr = CR_temporal(buffer.T, neighbours=neighbours,
+                                                    core=(start-halo_start, stop-halo_start))
+                            fixed = fixed[:, start-halo_start:stop-halo_start].T[rows]
+                        else :
+                            # AsgFile gives spec as rows, CR takes input spec as column --> .T
+                            fixed = CR_search_and_destroy(block[rows].T, search_intensity).T
+                        corrected[rows] = fixed
+                        
+                        #compare to the true original values (previous repairs undone)
+                        original = block[rows].copy()
+                        for idx, row in enumerate(rows) :
+                            for first, last, values in repairs.get(start+row, []) :
+                                original[idx, first:last+1] = values
+                        row, first, last = runs(corrected[rows] != original)
+                        for idx, pix_start, pix_end in zip(row, first, last) :
+                            spec_idx = start + rows[idx]
+                            values = original[idx, pix_start:pix_end+1]
+                            new_repairs.setdefault(spec_idx, []).append((int(pix_start), int(pix_end), values))
+                    
+                    f.write(encoder.encode(corrected))
+                f.write(encoder.flush())
+            
+            #spectra that were not revisited keep their previous repairs
+            for spec_idx in repairs.keys() :
+                if revisit is None or spec_idx not in revisit :
+                    new_repairs[spec_idx] = repairs[spec_idx]
+            
+            if search_intensity in ('high','low', 'pixel', 'temporal') :
+                self.extra_codes +='CR'+search_intensity[0]
+            else :
+                self.extra_codes += 'CRn'
+            self.cr_repairs = new_repairs
+            if len(new_repairs) > 0 and 'Cm' not in self.extra_codes :
+                self.extra_codes += 'Cm'
+            
+            #corrected spectra are now stored in the file itself
+            self.codes = self.codes.replace('X', '')
+            self.external = {}
+            self.scales = encoder.table()
+            self.chunks = encoder.chunk_index()
+            self.crcs, self.crc_rows = encoder.crc_table()
+            
+            #heading (with repairs) + corrected spectra
+            temp_head = TemporaryFile('wb', suffix='.asg', delete=False)
+            temp_head.close()
+            self.write_heading(temp_head.name)
+            with open(temp_head.name, 'ab') as f :
+                with open(temp.name, 'rb') as data :
+                    copyfileobj(data, f)
+            self._write_footer(temp_head.name)
                         
             #Copy/replace current file
-            copy(temp.path, self.path)
-            remove(temp.path)
+            copy(temp_head.name, self.path)
+            remove(temp_head.name)
+            remove(temp.name)
             
-            with open(self.path,'rb') as f :
-                f.readline()
-                byte = f.read(4)
-                self.spec_byte = int(frombuffer(byte, dtype=float32))    
+            self.spec_byte = aff.spec_byte(self.path)
                 
         except :
-            remove(temp.path)
+            if isfile(temp.name) is True :
+                remove(temp.name)
+            if temp_head is not None and isfile(temp_head.name) is True :
+                remove(temp_head.name)
             self.extra_codes = codes
+            self.codes = primary_codes
+            self.external = external
+            self.cr_repairs = repairs
+            self.scales, self.chunks = scales, chunks
+            self.crcs, self.crc_rows = crcs, crc_rows
+            raise
+    
+    def cr_map(self):
+        """
+        Returns the cosmic ray repairs recorded by CR_removal.
         
+        Returns
+        --------
+        repairs : dict
+            {spectrum_idx : [(first_pixel, last_pixel, original_values)]} 
+            where pixels are inclusive and original_values is a 1D numpy 
+            array of the values before the repair.
+        """
+        repairs = {}
+        for spec_idx in sorted(self.cr_repairs.keys()) :
+            repairs[spec_idx] = [(first, last, asarray(values, dtype=float32).copy()) 
+                                 for first, last, values in self.cr_repairs[spec_idx]]
+        return repairs
+        
+    @_writes
+    def cr_undo(self, spectra=None):
+        """
+        Restores the original values of the cosmic ray repairs recorded by
+        CR_removal.  Spectra are overwritten in place, then the heading is saved.
+        
+        Inputs
+        --------
+        spectra : list of int
+            Indexes of the spectra to restore.  If None, all repairs are undone
+            and the cosmic ray codes are removed from the file.
         
+        **AsgardFile.save() included**
+        """
+        if 'Cm' not in self.extra_codes :
+            raise Exc.WrongMethodError('No cosmic ray repairs were recorded in this file.')
+        if spectra is None :
+            spectra = list(self.cr_repairs.keys())
+        
+        #original values, as stored
+        restored = {}
+        for spec_idx in spectra :
+            for first, last, values in self.cr_repairs.get(spec_idx, []) :
+                encoder = self._encoder()
+                if self.scale_per_spectrum is True :
+                    encoder = aff.Encoder(self.storage, table=self.scales[spec_idx:spec_idx+1])
+                stored = encoder.store(asarray(values, dtype=float32).reshape([1, -1]))[0]
+                restored.setdefault(spec_idx, []).append((first, stored))
+        
+        #the repairs undone are only dropped from the file written : the 
+        #map is kept as long as the file may still hold the repaired values
+        repairs = self.cr_repairs
+        codes = self.extra_codes
+        chunks, crcs = self.chunks, self.crcs
+        self.cr_repairs = {key : value for key, value in repairs.items() if key not in restored}
+        if len(self.cr_repairs) == 0 :
+            for code in ('CRn', 'CRl', 'CRh', 'CRp', 'CRt', 'Cm') :
+                self.extra_codes = self.extra_codes.replace(code, '')
+        try :
+            self._restore(restored)
+        except :
+            self.cr_repairs = repairs
+            self.extra_codes = codes
+            self.chunks, self.crcs = chunks, crcs
+            raise
+    
+    def _restore(self, restored):
+        """
+        Writes stored values over the spectra (cr_undo), then the heading.
+        restored : {spectrum index : [(first pixel, stored values)]}
+        """
+        if self.compression is not None :
+            #compressed spectra are rewritten, chunk by chunk
+            def blocks():
+                for start, stored in self._chunk_reader().blocks() :
+                    stored = stored.copy()
+                    for spec_idx in range(start, start+stored.shape[0]) :
+                        for first, values in restored.get(spec_idx, []) :
+                            stored[spec_idx-start, first:first+values.shape[0]] = values
+                    yield stored
+            self._rewrite(blocks())
+        else :
+            size = dtype(self.storage).itemsize
+            with open(self.path, 'r+b') as f :
+                for spec_idx in restored :
+                    for first, values in restored[spec_idx] :
+                        f.seek(self.spec_byte + (spec_idx*(self*'Spec len') + first)*size)
+                        f.write(values.tobytes())
+            
+            #checksums of the chunks that were modified
+            if self.crcs is not None :
+                ranges = self._chunk_ranges()
+                numbers = sorted(set(spec_idx // self.crc_rows for spec_idx in restored))
+                self.crcs = self.crcs.copy()
+                crcs = aff.chunk_crcs(self.path, self.spec_byte, [ranges[i][2:] for i in numbers], workers=1)
+                for number, crc in zip(numbers, crcs) :
+                    self.crcs[number] = crc
+            self._patch_heading()
 
     
+    @_writes
     def save(self, path=None):
         """
         Remakes the file's heading.  If a path is provided, saves to new path, 
@@ -1283,7 +2156,8 @@ class AsgFile() :
         
         Note : spectra are copied as is from current file.  When spectra are 
         modified by a Asgard function or software, an automatic save or a 
-        button will be available to save changes.
+        button will be available to save changes.  Spectra referenced in 
+        their source file (see link_data) stay there.
         
         Inputs
         -------
@@ -1296,13 +2170,24 @@ class AsgFile() :
             
         temp = TemporaryFile('wb', delete=False)
         self.write_heading(temp.name)
-        if 'S' in self.codes :
+        if 'S' in self.codes and 'X' not in self.codes and self.crcs is None and self.compression is None :
+            #files written without checksums get them
+            self._copy_spectra(self.path, temp.name, self.spec_byte)
+        elif 'S' in self.codes and 'X' not in self.codes :
+            if self.crcs is None :
+                ranges = [byte_range[2:] for byte_range in self._chunk_ranges()]
+                self.crcs = asarray(aff.chunk_crcs(self.path, self.spec_byte, ranges), dtype='uint32')
             with open(self.path,'rb') as f :
                 with open(temp.name, 'ab') as temp:
                     f.seek(self.spec_byte)
-                    for spectrum in range(self*'Spec amount'):
-                        line = f.read(self*'Spec len'*4)
-                        temp.write(line)
+                    remaining = self._data_size()
+                    while remaining > 0 :
+                        data = f.read(min(remaining, 2**24))
+                        if len(data) == 0 :
+                            break
+                        temp.write(data)
+                        remaining -= len(data)
+        self._write_footer(temp.name)
 
         try :
             remove(path)
@@ -1314,10 +2199,214 @@ class AsgFile() :
         remove(temp.name)
         
         if path == self.path :
-            with open(self.path,'rb') as f :
-                f.readline()
-                byte = f.read(4)
-                self.spec_byte = int(frombuffer(byte, dtype=float32))
+            self.spec_byte = aff.spec_byte(self.path)
+    
+    def lock(self, timeout=None):
+        """
+        Takes the write lock of the file (see AsgardFileFormat.WriteLock) 
+        until unlock() : methods of other objects (and programs) writing 
+        to the file raise FileLockedError meanwhile.  Otherwise, methods 
+        writing to the file take it for their own duration.
+        
+        inputs
+        -------
+        timeout : float or None
+            Seconds to wait for another writer to be done (None : forever).
+        """
+        lock = self._lock
+        if lock is None :
+            lock = aff.WriteLock(self.path)
+        lock.acquire(timeout)
+        self._lock = lock
+    
+    def unlock(self):
+        """Releases the write lock taken by lock()"""
+        if self._lock is not None and self._writing == 0 :
+            self._lock.release()
+            self._lock = None
+    
+    def changed(self):
+        """
+        Whether another program modified the file (or is modifying it) since
+        it was loaded or refreshed.  Only the preamble of the file is read, 
+        so live viewers can poll it.  Version 1 files are always changed.
+        """
+        with open(self.path, 'rb') as f :
+            generation = aff.read_generation(f)
+        return generation is None or generation != self.generation
+    
+    def refresh(self, timeout=1.):
+        """
+        Reads the file again if another program modified it (i.e. appended
+        spectra), so new spectra, labels, etc. become available.  While the 
+        file is being written (odd generation), what was read is kept : rows
+        are never read half written.
+        
+        inputs
+        -------
+        timeout : float
+            Seconds to wait for a writer to be done.
+        
+        returns
+        --------
+        refreshed : bool
+            False if nothing changed or if the writer is not done yet.
+        """
+        if self._writing > 0 :
+            return False #this object is writing
+        #with the lock held by lock(), no other writer can be busy
+        holder = self._lock is not None and self._lock.locked is True
+        start = perf_counter()
+        error = None
+        while True :
+            with open(self.path, 'rb') as f :
+                generation = aff.read_generation(f)
+            if generation is not None and generation == self.generation :
+                return False
+            if generation is None or generation%2 == 0 or holder is True :
+                try :
+                    fresh = AsgFile(self.path, root=self.root)
+                except (Exc.FileFormatError, ValueError, IndexError, OSError) as err :
+                    error = err
+                else :
+                    #the generation is read last : the file did not change while loaded
+                    if fresh.generation == generation :
+                        for key, value in vars(fresh).items() :
+                            if key not in ('root', '_lock', '_writing') :
+                                setattr(self, key, value)
+                        return True
+                    error = None
+            if perf_counter() - start >= timeout :
+                if error is not None :
+                    raise error
+                return False
+            sleep(0.01)
+    
+    def _begin_write(self):
+        """
+        Takes the write lock (see _writes) and makes the generation of the 
+        file odd.  Raises WrongMethodError if another writer modified the 
+        file since this object read it : writing from a stale state would 
+        overwrite what it wrote.
+        """
+        if self._writing == 0 :
+            if self._lock is None or self._lock.locked is False :
+                lock = aff.WriteLock(self.path)
+                lock.acquire(timeout=0)
+                self._lock = lock
+                self._own_lock = True
+            else :
+                self._own_lock = False
+            try :
+                if isfile(self.path) is True :
+                    with open(self.path, 'rb') as f :
+                        generation = aff.read_generation(f)
+                    if generation is not None and generation != self.generation :
+                        raise Exc.WrongMethodError('%s was modified by another program since it was read,' %self.name + 
+                                                   ' refresh() it before writing to it.')
+                self._next_generation(odd=True)
+            except :
+                if self._own_lock is True :
+                    self._lock.release()
+                    self._lock = None
+                raise
+        self._writing += 1
+    
+    def _end_write(self):
+        """Makes the generation of the file even and releases the lock taken by _begin_write"""
+        self._writing -= 1
+        if self._writing == 0 :
+            try :
+                self._next_generation(odd=False)
+            finally :
+                if self._own_lock is True :
+                    self._lock.release()
+                    self._lock = None
+    
+    def _next_generation(self, odd):
+        """Increments the generation of the file (and self.generation) to the next odd or even value"""
+        if isfile(self.path) is False :
+            return
+        with open(self.path, 'r+b') as f :
+            generation = aff.read_generation(f)
+            if generation is None :
+                return
+            if generation%2 != int(odd) :
+                generation += 1
+            aff.reseal(f, generation=generation)
+        self.generation = generation
+    
+    def _replace_file(self, source, path):
+        """
+        Replaces the .asg file path by the .asg file source while holding 
+        the write lock of path.  The new file gets a generation past the one
+        it replaces, so the readers of path see the change (see refresh).
+        """
+        if path == self.path :
+            self._begin_write()
+            try :
+                #odd until _end_write, as any write to this file
+                with open(source, 'r+b') as f :
+                    aff.reseal(f, generation=self.generation)
+                copy(source, path)
+            finally :
+                self._end_write()
+            return
+        
+        lock = aff.WriteLock(path)
+        lock.acquire(timeout=0)
+        try :
+            generation = None
+            if isfile(path) is True :
+                with open(path, 'rb') as f :
+                    generation = aff.read_generation(f)
+            if generation is not None :
+                with open(source, 'r+b') as f :
+                    aff.reseal(f, generation=generation + 2 - generation%2)
+            copy(source, path)
+        finally :
+            lock.release()
+    
+    def verify(self, workers=None):
+        """
+        Checks the stored spectra against the CRC32 of their chunks, written
+        with them.  Chunks are read in parallel and dropped once checked, so
+        the file is never held in RAM.  The heading is checked when the 
+        file is opened.
+        
+        Inputs
+        -------
+        workers : int or None
+            Threads reading the file.  If None, one per processor, up to 8.
+        
+        Return
+        -------
+        bad : list of (first spectrum, last spectrum)
+            Spectra of the damaged chunks, last excluded (adjacent chunks 
+            are merged).  Empty if the file is intact.
+        
+        Raises FileFormatError if the file was written without checksums 
+        (save it to add them).
+        """
+        if 'X' in self.codes :
+            raise Exc.WrongMethodError('%s reads its spectra from %s, there is nothing to verify.' 
+                                       %(self.name, self.external['Path']))
+        if 'S' not in self.codes :
+            return []
+        if self.crcs is None :
+            raise Exc.FileFormatError('%s was written without checksums, save it to add them.' %self.name)
+        
+        ranges = self._chunk_ranges()
+        crcs = aff.chunk_crcs(self.path, self.spec_byte, [byte_range[2:] for byte_range in ranges], workers)
+        bad = []
+        for number, (first, last, start, end) in enumerate(ranges) :
+            if number < len(self.crcs) and crcs[number] == self.crcs[number] :
+                continue
+            if len(bad) > 0 and bad[-1][1] == first :
+                bad[-1] = (bad[-1][0], last)
+            else :
+                bad.append((first, last))
+        return bad
     
     
     def Thor_preprocess(self, dest, param, raw=False, noise=None):
@@ -1513,10 +2602,13 @@ class AsgFile() :
             self.Asgard_param['Axis'] = self.Asgard_param['Axis'][self.Asgard_param['Crop min']:self.Asgard_param['Crop max']]
                            
         temp_dest_head = TemporaryFile('wb', suffix='.asg', delete=False).name
-        self.write_heading(temp_dest_head)
+        self.write_heading(temp_dest_head, storage='<f4') #preprocessed spectra are written as float32
         temp_dest_head = AsgFile(temp_dest_head)
         
-        temp_dest_head.codes+='G'
+        temp_dest_head.codes = temp_dest_head.codes.replace('X', '') + 'G' #preprocessed spectra are stored in dest
+        temp_dest_head.extra_codes = temp_dest_head.extra_codes.replace('Cm', '') #repairs are not carried over
+        temp_dest_head.cr_repairs = {}
+        temp_dest_head.external = {}
         for key in param.keys():
             temp_dest_head.Asgard_param[key] = param[key]
         temp_dest_head.Asgard_param['Spec len'] = length
@@ -1560,10 +2652,13 @@ class AsgFile() :
             #Heading for noise file
             if noise is not None :
                 temp_noise_head = TemporaryFile('wb', suffix='.asg').name
-                self.write_heading(temp_noise_head)
+                self.write_heading(temp_noise_head, storage='<f4')
                 temp_noise_head = AsgFile(temp_noise_head)
 
-                temp_noise_head.codes+='G'
+                temp_noise_head.codes = temp_noise_head.codes.replace('X', '') + 'G'
+                temp_noise_head.extra_codes = temp_noise_head.extra_codes.replace('Cm', '')
+                temp_noise_head.cr_repairs = {}
+                temp_noise_head.external = {}
                 temp_noise_head.extra_codes+='Trn'
                 for key in param.keys():
                     temp_noise_head.Asgard_param[key] = param[key]
@@ -1603,36 +2698,27 @@ class AsgFile() :
                             lab = limit
                             
         temp_dest_head.write_heading(temp_dest_head.path)
-        
-        
-        with open(temp_dest.name,'rb') as f :
-            with open(temp_dest_head.path, 'ab') as temp:
-                for spectrum in range(temp_dest_head*'Spec amount'):
-                    line = f.read(temp_dest_head*'Spec len'*4)
-                    temp.write(line)
-                    
+        temp_dest_head._copy_spectra(temp_dest.name, temp_dest_head.path)
+        temp_dest_head._write_footer()
             
         if noise is not None and noise != dest :
             temp_noise_head.write_heading(temp_noise_head.path)
-        
-            with open(temp_noise.name,'rb') as f :
-                with open(temp_noise_head.path, 'ab') as temp:
-                    for spectrum in range(temp_noise_head*'Spec amount'):
-                        line = f.read(temp_noise_head*'Spec len'*4)
-                        temp.write(line)
+            temp_noise_head._copy_spectra(temp_noise.name, temp_noise_head.path)
+            temp_noise_head._write_footer()
             temp_noise.close()
-            copy(temp_noise_head.path, noise)
+            self._replace_file(temp_noise_head.path, noise)
             remove(temp_noise_head.path)
             remove(temp_noise.name)
 
         temp_dest.close()
-        copy(temp_dest_head.path, dest)
+        self._replace_file(temp_dest_head.path, dest)
         remove(temp_dest_head.path)
         remove(temp_dest.name)
         if raw is False :
             self.Asgard_param['Axis'] = old_axis
         if dest == self.path :
-            self.__init__(self.path, replace=False, root=self.root)
+            self.generation = None #replaced, so read again (keeping the lock taken by lock())
+            self.refresh()
         
         ##################################
         #Ask convert
@@ -1698,62 +2784,34 @@ class AsgFile() :
         def done(*arg):
             """
             Checks which file types were requested and create new files in all
-            of these formats.
+            of these formats.  Each file is read once and feeds all of its 
+            formats at the same time (see AsgardFileExport.export).
             """
+            def writers(requests, path):
+                chosen = []
+                for (wanted, row, Writer) in requests :
+                    if wanted.get() is True :
+                        if row.get() is True :
+                            orient='row'
+                        else :
+                            orient='col'
+                        chosen.append(Writer(path, orient=orient))
+                return chosen
+            
             DestAsg = AsgFile(dest)
-            if noise is not None :
+            DestWriters = writers([(ExcelV, ExcelRowV, afe.XlsxWriter),
+                                   (NumpyV, NumpyRowV, afe.NpyWriter),
+                                   (TxtV, TxtRowV, afe.TxtWriter)], DestAsg.path[:-4])
+            if len(DestWriters) > 0 :
+                afe.export(DestAsg, DestWriters)
+
+            if dest != noise and noise is not None :
                 NoiseAsg = AsgFile(noise)
-            if ExcelV.get() is True :
-                ori = ExcelRowV.get()
-                if ori is True :
-                    orient='row'
-                else :
-                    orient='col'
-                DestAsg.to_excel(DestAsg.path[:-4], orient=orient)
-                
-            if NumpyV.get() is True :
-                ori = NumpyRowV.get()
-                if ori is True :
-                    orient='row'
-                else :
-                    orient='col'
-                DestAsg.to_numpy(DestAsg.path[:-4], orient=orient)
-                
-            if TxtV.get() is True :
-                ori = TxtRowV.get()
-                if ori is True :
-                    orient='row'
-                else :
-                    orient='col'
-                DestAsg.to_txt(DestAsg.path[:-4], orient=orient)
-
-            if dest != noise :
-                if ExcelV2.get() is True :
-                    ori = ExcelRowV2.get()
-                    if ori is True :
-                        orient='row'
-                    else :
-                        orient='col'
-                    if noise is not None :
-                        NoiseAsg.to_excel(NoiseAsg.path[:-3], orient=orient)
-                
-                if NumpyV2.get() is True :
-                    ori = NumpyRowV2.get()
-                    if ori is True :
-                        orient='row'
-                    else :
-                        orient='col'
-                    if noise is not None :
-                        NoiseAsg.to_numpy(NoiseAsg.path[:-3], orient=orient)
-                    
-                if TxtV2.get() is True :  
-                    ori = TxtRowV2.get()
-                    if ori is True :
-                        orient='row'
-                    else :
-                        orient='col'
-                    if noise is not None :
-                        NoiseAsg.to_txt(NoiseAsg.path[:-3], orient=orient)
+                NoiseWriters = writers([(ExcelV2, ExcelRowV2, afe.XlsxWriter),
+                                        (NumpyV2, NumpyRowV2, afe.NpyWriter),
+                                        (TxtV2, TxtRowV2, afe.TxtWriter)], NoiseAsg.path[:-3])
+                if len(NoiseWriters) > 0 :
+                    afe.export(NoiseAsg, NoiseWriters)
                     
             Top.destroy()
                     
@@ -1816,16 +2874,18 @@ class AsgFile() :
                     
         self.root.wait_window(Top)
         
-    def write_heading(self, path) :
+    def write_heading(self, path, storage=None) :
         """
-        Writes the heading of .asg file and counts the amount of byte to the spectra.
-        Returns nothing, writes the heading to the path provided.
+        Writes the heading of .asg file (version 2, see AsgardFileFormat) and 
+        returns the byte at which the spectra start.
         
         
         Inputs
         --------
         path : valid path as str
             path to the file where the heading is to be written
+        storage : str
+            numpy dtype of the spectra that will follow, if not self.storage.
             
             
         N.B. provided path will be overwritten. Do not input a path to a file 
@@ -1833,87 +2893,84 @@ class AsgFile() :
         a TemporaryFile and replace the file with the Temporary once all is done.
         
         """
-        temp = TemporaryFile('r+b')
-        title = bytes('Asgard Data File\n','utf-8')
-        total_byte = len(title) + 5 #+5 bytes for spec_byte\n once calculated
-        
-        line = bytes('%s\n%s\n\n' %(self.codes, self.extra_codes), 'utf-8')
-        temp.write(line)
-        total_byte += len(line)
+        if storage is None :
+            storage = self.storage
+        start = aff.pack_heading(self._heading(), data_size=self._data_size(storage), data_type=storage, 
+                                 generation=self.generation or 0)
+        with open(path,'wb') as f:
+            f.write(start)
+        self.version = aff.VERSION
+        return len(start)
+    
+    def _heading(self):
+        """Text heading of the file, from the codes line to 'Spectra\n' (see write_heading)"""
+        heading = []
+        heading.append(bytes('%s\n%s\n\n' %(self.codes, self.extra_codes), 'utf-8'))
         
         if 'Nl' in self.extra_codes :
-            line = bytes('Labels\n' ,'utf-8')
-            temp.write(line)
-            total_byte += len(line)
+            heading.append(bytes('Labels\n' ,'utf-8'))
             for key in self.labels.keys():
-                line = bytes('%s\t%s\n' %(key, self.labels[key]), 'utf-8')
-                temp.write(line)
-                total_byte += len(line)
-                
-            temp.write(bytes('\n','utf-8'))
-            total_byte +=1
+                heading.append(bytes('%s\t%s\n' %(key, self.labels[key]), 'utf-8'))
+            heading.append(bytes('\n','utf-8'))
+        
+        if 'Cm' in self.extra_codes :
+            heading.append(bytes('Cosmic rays\n' ,'utf-8'))
+            for spec_idx in sorted(self.cr_repairs.keys()):
+                for first, last, values in self.cr_repairs[spec_idx] :
+                    values = ','.join([str(i) for i in asarray(values, dtype=float32)])
+                    heading.append(bytes('%s\t%s-%s\t%s\n' %(spec_idx, first, last, values), 'utf-8'))
+            heading.append(bytes('\n','utf-8'))
+        
+        if 'X' in self.codes :
+            heading.append(bytes('External data\n' ,'utf-8'))
+            for key in ('Path', 'Offset', 'Dtype', 'Shape', 'Checksum') :
+                value = self.external[key]
+                if key == 'Shape' :
+                    value = '%s,%s' %value
+                heading.append(bytes('%s\t%s\n' %(key, value), 'utf-8'))
+            heading.append(bytes('\n','utf-8'))
                 
-        line = bytes('Experiment infos\n','utf-8')
-        total_byte += len(line)
-        temp.write(line)
-        
+        heading.append(bytes('Experiment infos\n','utf-8'))
         for key in self.info.keys():
-            line = bytes('%s\t%s\n' %(key, str(self.info[key])),'utf-8')
-            total_byte += len(line)
-            temp.write(line)
+            heading.append(bytes('%s\t%s\n' %(key, str(self.info[key])),'utf-8'))
                 
-        line = bytes('\nAsgard parameters\n','utf-8')
-        total_byte += len(line)
-        temp.write(line)
-        
-
+        heading.append(bytes('\nAsgard parameters\n','utf-8'))
         for key in self.Asgard_param.keys():
             value = self*key
-            line = bytes('%s\t%s\n' %(key, value),'utf-8')
-            temp.write(line)
-            total_byte += len(line)
-        
-        line = bytes('\nGood\n','utf-8')
-        temp.write(line)
-        total_byte += len(line)
+            if key in ('Spec amount', 'Spec len') and type(value) is int :
+                #room for the value to be patched in place (see _patch_param)
+                value = '%-20s' %value
+            heading.append(bytes('%s\t%s\n' %(key, value),'utf-8'))
         
+        heading.append(bytes('\nGood\n','utf-8'))
         if 'G' in self.codes :
-            line = bytes(str(self.good) + '\n', 'utf-8')
-        else : line = bytes('\n','utf-8')
-        temp.write(line)
-        total_byte += len(line)
+            heading.append(bytes(str(self.good) + '\n', 'utf-8'))
+        else : 
+            heading.append(bytes('\n','utf-8'))
         
         if 'I' in self.codes :
-            for idx, ident in enumerate(self.identity) :
-                if idx == 0 :
-                    line = bytes(ident + '\t','utf-8')
-                    temp.write(line)
-                elif idx != len(self.identity)-1 :
-                    line = line + bytes(ident + '\t','utf-8')
-                    temp.write(bytes(ident + '\t','utf-8'))
-                else :
-                    line = line + bytes(ident,'utf-8')
-                    temp.write(bytes(ident,'utf-8'))
-            total_byte += len(line)
-
-        line = bytes('\n\n','utf-8')
-        temp.write(bytes('\n\n','utf-8'))
-        total_byte += len(line)
-        
-        line = bytes('Spectra\n','utf-8')
-        temp.write(line)
-        total_byte += len(line)
-
+            heading.append(bytes('\t'.join(self.identity), 'utf-8'))
+        heading.append(bytes('\n\n','utf-8'))
+        heading.append(bytes('Spectra\n','utf-8'))
         
-        total_byte = bytearray(pack('f',total_byte))
-            
-        with open(path,'wb') as f:
-            f.write(title)
-            f.write(total_byte + bytes('\n','utf-8'))
-            
-            temp.seek(0)
-            for line in temp.readlines():
-                f.write(line)
+        return b''.join(heading)
+    
+    def _patch_heading(self):
+        """
+        Writes the heading again in place when it still fits before the 
+        spectra (i.e. it got shorter), so the spectra are not copied, then 
+        what follows them.  Otherwise (or for a version 1 file), the file 
+        is saved.
+        """
+        heading = self._heading()
+        if self.version != 2 or aff.PREAMBLE_SIZE + len(heading) > self.spec_byte :
+            self.save()
+            return
+        start = aff.pack_heading(heading, data_size=self._data_size(), data_type=self.storage, 
+                                 generation=self.generation or 0, spec_byte=self.spec_byte)
+        with open(self.path, 'r+b') as f :
+            f.write(start)
+        self._write_footer()
 
     
     ## End of Asgard file creation function        
@@ -29,8 +29,9 @@ SOFTWARE.
 Package requirements
 ---------------------
 numpy
-pandas
-scipy
+pandas (ASCII and text files, imported when used)
+scipy (Matlab files, imported when used)
+h5py (optional, Matlab v7.3 files)
 
 
 Content
@@ -41,27 +42,326 @@ Conversion functions (takes a specific file type and extracts its data) :
     def convert_Asgard(file_path, dst=None, hold=False, axisf=False)
     def convert_Matlab(file_path, dst=None, orient='row', hold=False, axisf=False)
     def convert_numpy(file_path, dst=None, orient='row', hold=False, axisf=False)
-    def convert_SPA() --> Futur implementation
-    def convert_SPC() --> Futur implementation
+    def convert_SPA(file_path, dst=None, hold=False, axisf=False) --> Thermo OMNIC
+    def convert_SPC(file_path, dst=None, hold=False, axisf=False) --> Thermo Galactic, new format (0x4B)
     def convert_text(file_path, dst=None, hold=False, axisf=False)
     def convert_old_Thor(file_path, dst=None, hold=False, axisf=False) --> Discontinued
-    def convert_Witec(file_path, dst=None, spectrum_length=2000, hold=False) --> All spectra back to back as 1 column in csv
+    def convert_Witec(file_path, spectrum_length=None, dst=None, hold=False, axisf=False) --> All spectra back to back as 1 column in csv
+    
+class Converter
+    A type of file that can be converted, with its extensions, magic bytes
+    and capabilities (streaming, random access, zero copy)
+def register_converter(name, stream=None, convert=None, extensions=(), magic=(), ...)
+    Adds a converter (decorator), plugins may also use the 'othala.converters'
+    entry point group
+def get_converter(type_)
+def converters()
+    Names of the types of file that can be converted
     
 def type_sniff(file_path, dst=None)
     Automatically find out what type of file is given and call the appropriate
     conversion function
+def sniff_type(file_path)
+    Identifies the type of a file from its first bytes
+def stream(file_path, type_=None, axisf=False, **options)
+    Single pass conversion, yields the metadata then blocks of spectra
+def write_stream(spectra, dst, encoder=None)
+    Appends the spectra of a stream to a file
+def external_reference(file_path, type_=None, orient='row', axisf=False)
+    Describes where spectra are stored in a .sif or .npy so they can be read
+    without a copy
+def source_checksum(reference)
+    Quick fingerprint of referenced external data
+    
+Compressed sources (.gz, .bz2, .xz and 'archive.zip::member' paths are accepted by every converter) :
+    def open_source(file_path, mode='rb')
+    def is_compressed(file_path)
+    def source_name(file_path)
+    def source_size(file_path, minimum=0)
+    def archive_members(file_path)
 
 """
 
 from . import Exceptions as Exc   ###
+from . import AsgardFileFormat as aff
 
-from numpy import load, frombuffer, float32
-from pandas import read_csv
-from scipy.io import loadmat
+from numpy import load, frombuffer, fromstring, float32, float64, memmap, concatenate, dtype
+from numpy import sqrt, inf, median, linspace, stack, arange, argsort
+from numpy.fft import rfft, irfft
+from numpy.lib.format import read_magic, read_array_header_1_0, read_array_header_2_0
 
 from tempfile import TemporaryFile
-from struct import pack
-from os.path import getsize
+from os import remove
+from os.path import getsize, abspath, splitext
+from zlib import crc32
+from re import compile as compile_re
+from struct import unpack
+from math import isqrt
+from importlib import import_module
+from io import TextIOWrapper
+from zipfile import ZipFile, is_zipfile
+
+
+#%% Compressed sources
+_COMPRESSED = {'.gz' : 'gzip', '.bz2' : 'bz2', '.xz' : 'lzma'}
+ARCHIVE_SEPARATOR = '::'
+
+
+def open_source(file_path, mode='rb'):
+    """
+    Opens a file to be converted.  .gz, .bz2 and .xz files are decompressed
+    as they are read, and 'archive.zip::member' paths open a member of a zip
+    archive, so compressed files are never decompressed to disk.  Forward 
+    seeks are cheap, backward seeks restart the decompression.
+    
+    Parameters
+    ---------
+    file_path : path (str)
+        Full path to the file, or 'archive.zip::member'.
+    mode : 'rb' or 'r'
+        Binary or text.
+    
+    Return
+    ------
+    file : file object
+    """
+    if is_compressed(file_path) is False :
+        return open(file_path, mode)
+    
+    if ARCHIVE_SEPARATOR in file_path :
+        archive, member = file_path.split(ARCHIVE_SEPARATOR, 1)
+        with ZipFile(archive) as zip_file : #the member stays readable once closed
+            f = zip_file.open(member)
+    else :
+        module = import_module(_COMPRESSED[splitext(file_path)[1].lower()])
+        f = module.open(file_path, 'rb')
+    
+    if mode == 'r' :
+        return TextIOWrapper(f)
+    return f
+
+
+def is_compressed(file_path):
+    """Whether a file is compressed or a member of a zip archive"""
+    return ARCHIVE_SEPARATOR in file_path or splitext(file_path)[1].lower() in _COMPRESSED
+
+
+def source_name(file_path):
+    """
+    Name of a file once decompressed, i.e. 'spectra.spc.gz' --> 'spectra.spc'
+    and 'archive.zip::run/spectra.spc' --> 'run/spectra.spc'.
+    """
+    if ARCHIVE_SEPARATOR in file_path :
+        return file_path.split(ARCHIVE_SEPARATOR, 1)[1]
+    root, extension = splitext(file_path)
+    if extension.lower() in _COMPRESSED :
+        return root
+    return file_path
+
+
+def source_size(file_path, minimum=0):
+    """
+    Size of a file once decompressed, in bytes.  .gz files store it modulo 
+    2**32 in their last 4 bytes : the smallest size matching it that is not
+    under minimum is returned.  .bz2 and .xz files store no size, they are 
+    decompressed (not stored) to find it.
+    """
+    if is_compressed(file_path) is False :
+        return getsize(file_path)
+    if ARCHIVE_SEPARATOR in file_path :
+        archive, member = file_path.split(ARCHIVE_SEPARATOR, 1)
+        with ZipFile(archive) as zip_file :
+            return zip_file.getinfo(member).file_size
+    if splitext(file_path)[1].lower() == '.gz' :
+        with open(file_path, 'rb') as f :
+            f.seek(-4, 2)
+            size = unpack('<I', f.read(4))[0]
+        if size < minimum :
+            size += -((size - minimum) // 2**32) * 2**32
+        return size
+    with open_source(file_path) as f :
+        return f.seek(0, 2)
+
+
+def archive_members(file_path):
+    """
+    Lists the files of a zip archive as 'archive.zip::member' paths, each 
+    can be converted like any other file.  Returns [file_path] for other 
+    files.
+    """
+    if ARCHIVE_SEPARATOR in file_path or is_zipfile(file_path) is False :
+        return [file_path]
+    with ZipFile(file_path) as zip_file :
+        return [file_path + ARCHIVE_SEPARATOR + info.filename 
+                for info in zip_file.infolist() if info.is_dir() is False]
+
+
+#%% Converter registry
+class Converter :
+    """
+    A type of file that can be converted to an AsgardFile (see 
+    register_converter).
+    
+    Attributes
+    ---------
+    name : str
+        Type of the file, as shown to users and given as type_.
+    extensions : tuple of str
+        File extensions (lower case, with the dot) of this type.
+    magic : tuple of (int, bytes)
+        (offset, bytes) found at the start of files of this type.
+    sniff : function(head, file_path) or None
+        For types magic bytes can't tell apart.  Receives the first bytes of
+        the file and its path, returns True for files of this type.
+    streaming : bool
+        Spectra are read by blocks, the file is never loaded whole.
+    random_access : bool
+        Any spectrum can be read without reading those before it.
+    zero_copy : bool
+        Spectra can be read in place from the file (see external_reference
+        and AsgFile.link_data).
+    """
+    def __init__(self, name, stream, convert=None, extensions=(), magic=(), 
+                 sniff=None, streaming=True, random_access=False, zero_copy=False):
+        self.name = name
+        self._stream = stream
+        self._convert = convert
+        self.extensions = tuple([ext.lower() for ext in extensions])
+        self.magic = tuple(magic)
+        self.sniff = sniff
+        self.streaming = streaming
+        self.random_access = random_access
+        self.zero_copy = zero_copy
+    
+    def _resolve(self, fct):
+        """Imports 'module:function' paths on first use"""
+        if isinstance(fct, str) :
+            module, name = fct.split(':')
+            fct = getattr(import_module(module), name)
+        return fct
+    
+    def match(self, head, file_path):
+        """Whether a file is of this type, from its first bytes"""
+        for offset, magic in self.magic :
+            if head[offset:offset+len(magic)] == magic :
+                return True
+        if self.sniff is not None :
+            return self._resolve(self.sniff)(head, file_path) is True
+        return False
+    
+    def stream(self, file_path, axisf=False, **options):
+        """Opens a stream of the file (see stream)"""
+        self._stream = self._resolve(self._stream)
+        return self._stream(file_path, axisf=axisf, **options)
+    
+    def convert(self, file_path, dst=None, hold=False, axisf=False):
+        """Same as the convert_X functions (see convert_Andor)"""
+        if self._convert is None :
+            return _convert_stream(self.stream(file_path, axisf=axisf), dst, hold, axisf)
+        self._convert = self._resolve(self._convert)
+        return self._convert(file_path, dst=dst, hold=hold, axisf=axisf)
+
+
+_CONVERTERS = {}
+_PLUGINS_LOADED = False
+PLUGIN_GROUP = 'othala.converters'
+
+
+def register_converter(name, stream=None, convert=None, extensions=(), magic=(),
+                       sniff=None, streaming=True, random_access=False, zero_copy=False):
+    """
+    Adds a type of file to the converters known to Othala.  Used as a 
+    decorator on a stream function :
+        
+        @register_converter('Mine', extensions=('.mine',), magic=((0, b'MINE'),))
+        def stream_mine(file_path, axisf=False):
+            yield {'Spec len':..., 'Spec amount':...}, axis
+            yield spectra_as_rows
+    
+    or called with the stream function, or its 'module:function' path so the
+    module (and what it imports) is only loaded when a file is converted.
+    Packages can also declare their converters as entry points of the 
+    'othala.converters' group : a module registering them when imported, 
+    or a stream function registered under the entry point name.
+    
+    Parameters
+    ---------
+    name : str
+        Type of the file.  Registering an existing name replaces it.
+    stream : function or str
+        Generator yielding (Asgard_param, axis), then spectra as rows (see 
+        stream).  If None, returns a decorator.
+    convert : function or str
+        convert_X like function, if one faster than the stream exists.
+    extensions, magic, sniff, streaming, random_access, zero_copy :
+        see Converter
+    
+    Return
+    ------
+    converter : Converter
+        or the decorator if stream is None.
+    """
+    def decorator(fct):
+        _CONVERTERS[name] = Converter(name, fct, convert=convert, extensions=extensions, 
+                                      magic=magic, sniff=sniff, streaming=streaming,
+                                      random_access=random_access, zero_copy=zero_copy)
+        return fct
+    
+    if stream is None :
+        return decorator
+    decorator(stream)
+    return _CONVERTERS[name]
+
+
+def _load_plugins():
+    """Loads the converters declared as entry points, once"""
+    global _PLUGINS_LOADED
+    if _PLUGINS_LOADED is True :
+        return
+    _PLUGINS_LOADED = True
+    
+    try :
+        from importlib.metadata import entry_points
+    except ImportError : #python < 3.8
+        return
+    points = entry_points()
+    if hasattr(points, 'select') :
+        points = points.select(group=PLUGIN_GROUP)
+    else :
+        points = points.get(PLUGIN_GROUP, [])
+    
+    for point in points :
+        try :
+            plugin = point.load()
+        except Exception as e :
+            print('Converter plugin %s could not be loaded : %s' %(point.name, e))
+            continue
+        if isinstance(plugin, Converter) :
+            _CONVERTERS[plugin.name] = plugin
+        elif callable(plugin) and point.name not in _CONVERTERS :
+            register_converter(point.name, plugin)
+
+
+def get_converter(type_):
+    """
+    Returns the Converter of a type of file (see register_converter).
+    """
+    _load_plugins()
+    try :
+        return _CONVERTERS[type_]
+    except KeyError :
+        raise Exc.FileFormatError(('%s file type is not recognised.\n' + 
+                                   'Following are valid file types :\n' + 
+                                   '\n'.join(_CONVERTERS.keys()) )%type_)
+
+
+def converters():
+    """
+    Returns the names of the types of file that can be converted.
+    """
+    _load_plugins()
+    return list(_CONVERTERS.keys())
+
 
 def convert_Andor(file_path, dst=None, hold=False, axisf=False, *arg):
     """   
@@ -93,13 +393,48 @@ def convert_Andor(file_path, dst=None, hold=False, axisf=False, *arg):
         Full path to the file where data were writen, may it be temporary or user selected
         
     """
-    Asgard_param = {}
+    return _convert_stream(stream_Andor(file_path, axisf=axisf), dst, hold, axisf)
+
+
+def stream_Andor(file_path, axisf=False, block_size=2**26):
+    """
+    Streaming version of convert_Andor (see stream).  The axis is the 
+    calibration found in the heading.
+    """
+    Asgard_param, offset, data_size = _Andor_layout(file_path)
+    axis = None
+    if axisf is True :
+        axis = Asgard_param['Axis']
+    yield Asgard_param, axis
     
-    if dst is None and hold is False:
-        dst = TemporaryFile('wb',delete=False).name
+    width = Asgard_param['Spec len']
+    rows = max(1, block_size // (4*width))
+    left = data_size // (4*width)
+    with open_source(file_path) as file :
+        file.seek(offset)
+        while left > 0 :
+            amount = min(rows, left)
+            yield frombuffer(file.read(amount*width*4), dtype='<f4').reshape(amount, width)
+            left -= amount
+            
+
+def _Andor_layout(file_path):
+    """
+    Reads the heading of an Andor .sif file.
+    
+    Return
+    ------
+    Asgard_param : dict
+        Stores update to Asgard parameters (i.e. spec_amount, spec_len, Axis)
+    offset : int
+        Byte where the spectra (float32 rows) start in the file.
+    data_size : int
+        Size of the spectra in bytes.
+    """
+    Asgard_param = {}
     
     #Extract info from header
-    with open(file_path,'rb') as file :
+    with open_source(file_path) as file :
         header_lines = 32
         extra_line = 0
         i = 0 
@@ -143,46 +478,53 @@ def convert_Andor(file_path, dst=None, hold=False, axisf=False, *arg):
                 width_binning = int(parts[6])
                 
             i += 1
-
-        width = width_pixel_end - width_pixel_start + 1
-        rest = width % width_binning
-        width = int((width - rest) / width_binning)
-        height = height_pixel_end - height_pixel_start + 1
-        rest = height % height_binning
-        height = int((height - rest) / height_binning)
         
-        
-        #calculate size of spectra vs size of data
-        file_size = getsize(file_path)
-        data_size = width * height * 4 * spectra_amount
+        header_end = file.tell()
+        data_start = None
+        if splitext(file_path)[1].lower() in ('.bz2', '.xz') :
+            #no stored size, the spectra are looked for after the heading
+            data_start = _Andor_data_start(file, spectra_amount)
+
+    width = width_pixel_end - width_pixel_start + 1
+    rest = width % width_binning
+    width = int((width - rest) / width_binning)
+    height = height_pixel_end - height_pixel_start + 1
+    rest = height % height_binning
+    height = int((height - rest) / height_binning)
+    
+    
+    #calculate size of spectra vs size of data
+    data_size = width * height * 4 * spectra_amount
+    if data_start is not None :
+        offset = data_start
+    else :
+        #the spectra end 8 bytes before the end of the file
+        file_size = source_size(file_path, minimum=header_end + data_size + 8)
         offset = file_size - data_size - 8
-        file.seek(offset)
-             
-        #parameters usefull to Asgard
-        axis = [(coeff[0] + coeff[1]*x + coeff[2]*(x**2) + coeff[3]*(x**3)) for x in range(width) ]           
-        Asgard_param['Axis'] = axis
-        Asgard_param['Spec amount'] = spectra_amount
-        Asgard_param['Spec len'] = width
-
-        block_amount = data_size // int((2.5*(10**8)))  
-        extra_byte = int((data_size) % (2.5*(10**8))) 
-        if hold is True :
-            if axisf is True :
-                return Asgard_param, axis
-            else :
-                return Asgard_param
-        else :
-            with open(dst,'ab') as f:
-                for i in range(block_amount):
-                    spec = file.read(2.5*(10**8))
-                    f.write(spec)
-                spec = file.read(extra_byte)
-                f.write(spec)
-            if axisf is True :
-                return dst, Asgard_param, axis
-            else :
-                return dst, Asgard_param
-            
+         
+    #parameters usefull to Asgard
+    axis = [(coeff[0] + coeff[1]*x + coeff[2]*(x**2) + coeff[3]*(x**3)) for x in range(width) ]           
+    Asgard_param['Axis'] = axis
+    Asgard_param['Spec amount'] = spectra_amount
+    Asgard_param['Spec len'] = width
+    
+    return Asgard_param, offset, data_size
+
+
+def _Andor_data_start(file, amount):
+    """
+    Byte where the spectra of a .sif start, file being read just after its
+    heading : a timestamp line per spectrum, then maybe a '0' line.  None 
+    if the lines found are not those.
+    """
+    for i in range(amount) :
+        if file.readline().strip().isdigit() is False :
+            return None
+    start = file.tell()
+    if file.read(2) == b'0\n' :
+        start += 2
+    return start
+
 
 
 def convert_ASCII(file_path, dst=None, hold=False, axisf=False, *arg):
@@ -216,10 +558,63 @@ def convert_ASCII(file_path, dst=None, hold=False, axisf=False, *arg):
     if dst is None and hold is False:
         dst = TemporaryFile('wb', delete=False).name
         
+    layout = _ASCII_layout(file_path)
+    skipped_lines, nb_spec, spec_size, options = layout
+    
+    Asgard_param = {}
+    Asgard_param['Spec len'] = spec_size
+    Asgard_param['Spec amount'] = nb_spec
+    if axisf is True :
+        Asgard_param['Spec amount'] -= 1
+    
+    if hold is True :
+        if axisf is True:
+            from pandas import read_csv
+            with open_source(file_path, 'r') as f :
+                axis = read_csv(f, skiprows=skipped_lines, usecols=[0], 
+                                header=None, dtype=float32, **options).to_numpy().T
+            return Asgard_param, axis
+        else :
+            return Asgard_param
+    else :
+        #single pass : blocks of rows (pixels) are parsed and transposed 
+        #into their place in the spectra-as-rows output
+        start = getsize(dst)
+        with open(dst, 'ab') as f:
+            f.truncate(start + Asgard_param['Spec amount']*spec_size*4)
+        out = None
+        if Asgard_param['Spec amount'] > 0 :
+            out = memmap(dst, dtype='<f4', mode='r+', offset=start,
+                         shape=(Asgard_param['Spec amount'], spec_size))
+        axis = _ASCII_fill(file_path, layout, out, axisf=axisf)
+        
+        if axisf is True :
+            return dst, Asgard_param, axis
+        else :
+            return dst, Asgard_param
+            
+    
+
+def _ASCII_layout(file_path):
+    """
+    Reads the start of an ASCII/text array (spectra as columns) to find 
+    how it is written.
+    
+    Return
+    ------
+    skipped_lines : int
+        Amount of heading lines.
+    nb_spec : int
+        Amount of columns.
+    spec_size : int
+        Amount of rows (pixels), counted without parsing.
+    options : dict
+        Delimiter options for pandas.read_csv.
+    """
     #Basic header sniff
     data = False
     skipped_lines = 0
-    with open(file_path, 'r') as file:
+    with open_source(file_path, 'r') as file:
         line = file.readline().strip()
         while line :
             if line[0] not in '1234567890-+.,' :
@@ -273,44 +668,60 @@ def convert_ASCII(file_path, dst=None, hold=False, axisf=False, *arg):
         line = line[:last_digit+1].split(delimiter)
     nb_spec = len(line)
     
-    #Nb of row w/o header (nb of pixel in spectrum)
-    spec_size = read_csv(file_path, sep=delimiter, skiprows=skipped_lines, 
-                         engine='python', usecols=range(0,1), 
-                         header=None).to_numpy().shape[0]
+    #Nb of row w/o header (nb of pixel in spectrum), counted without parsing
+    spec_size = 0
+    with open_source(file_path) as file:
+        for idx, row in enumerate(file):
+            if idx >= skipped_lines and row.strip() :
+                spec_size += 1
     
-    Asgard_param = {}
-    Asgard_param['Spec len'] = spec_size
-    Asgard_param['Spec amount'] = nb_spec
-    
-    if hold is True :
-        if axisf is True:
-            axis = read_csv(file_path, sep=delimiter, skiprows=skipped_lines,
-                            engine='python', usecols=range(0,0+1), 
-                            header=None).to_numpy().T
-            Asgard_param['Spec amount'] -= 1
-            return Asgard_param, axis
-        else :
-            return Asgard_param
+    #fast C parser whenever the delimiter allows it
+    if len(delimiter) == 1 :
+        options = {'sep':delimiter, 'engine':'c'}
+    elif delimiter.strip() == '' :
+        options = {'sep':r'\s+', 'engine':'c'}
     else :
-        with open(dst,'ab') as f:
-            for spec in range(nb_spec):
-                if spec==0 and axisf is True :
-                    axis = read_csv(file_path, sep=delimiter, skiprows=skipped_lines,
-                                    engine='python', usecols=range(spec,spec+1), 
-                                    header=None).to_numpy().T
-                    Asgard_param['Spec amount'] -= 1
-                else :
-                    spectrum = read_csv(file_path, sep=delimiter, skiprows=skipped_lines,
-                                        engine='python', usecols=range(spec,spec+1), 
-                                        header=None).to_numpy().T
-                    for pix in list(spectrum[0,:]) :
-                        f.write(bytearray(pack('f',pix)))
-        if axisf is True :
-            return dst, Asgard_param, axis
-        else :
-            return dst, Asgard_param
-            
+        options = {'sep':delimiter, 'engine':'python'}
+    
+    return skipped_lines, nb_spec, spec_size, options
+
+
+def _ASCII_fill(file_path, layout, out, axisf=False):
+    """
+    Parses an ASCII/text array by blocks of rows (pixels) and transposes 
+    them into their place in out (spectra as rows, numpy array or memmap).
+    
+    Return
+    ------
+    axis : numpy 2D array (1, spec_size)
+        First column, if axisf is True, else None.
+    """
+    from pandas import read_csv
     
+    skipped_lines, nb_spec, spec_size, options = layout
+    axis = []
+    pixel = 0
+    block_rows = max(1, 2**23 // nb_spec) #bounded buffer of ~32 MB
+    with open_source(file_path, 'r') as f :
+        for block in read_csv(f, skiprows=skipped_lines, usecols=range(nb_spec),
+                              header=None, dtype=float32, chunksize=block_rows, **options):
+            block = block.to_numpy()
+            if axisf is True :
+                axis.append(block[:,0])
+                block = block[:,1:]
+            if out is not None :
+                out[:, pixel:pixel+block.shape[0]] = block.T
+            pixel += block.shape[0]
+    
+    if out is not None and hasattr(out, 'flush') :
+        out.flush()
+    
+    if axisf is True :
+        return concatenate(axis).reshape([1,-1])
+    else :
+        return None
+
+
 def convert_Asgard(file_path, dst=None, hold=False, axisf=False, *arg):
     """   
     Extract raw data from Asgard .asg files
@@ -334,28 +745,31 @@ def convert_Asgard(file_path, dst=None, hold=False, axisf=False, *arg):
     ------
     Asgard_param : dict
         Stores Asgard parameters from the source file (i.e. spec_amount, spec_len, Axis for sif)
+        and, for preprocessed files, their good spectra as 'Thor' (see convert_old_Thor)
     dst : path (str)
         Full path to the file where data were writen, may it be temporary or user selected
         
     """    
-        
-    if dst is None and hold is False:
-        dst = TemporaryFile('wb', delete=False).name
-    
-    with open(file_path, 'rb') as f:
-        
+    return _convert_stream(stream_Asgard(file_path, axisf=axisf), dst, hold, axisf)
+
 
-        line = f.readline()
-        spec_byte = f.read(4)
-        spec_byte = int(frombuffer(spec_byte, dtype=float32))
+def stream_Asgard(file_path, axisf=False, block_size=2**26):
+    """
+    Streaming version of convert_Asgard (see stream).  The good spectra of 
+    preprocessed files are carried as 'Thor', like stream_old_Thor.
+    """
+    with open_source(file_path) as f:
+        spec_byte, version, preamble = aff.open_heading(f, preamble=True)
+        codes = f.readline().strip().decode('utf-8')
 
+        line = codes
         while line != 'Asgard parameters':
             line = f.readline().strip().decode('utf-8')
         Asgard_param = {}
         line = f.readline()[:-1].split(b'\t')
         
         while line != [bytes('','utf-8')]:
-            value = line[1].decode('utf-8')
+            value = line[1].decode('utf-8').strip()
             if line[0].decode('utf-8') == 'Axis' :
                 if value == 'None' :
                     Asgard_param['Axis'] = None
@@ -374,32 +788,73 @@ def convert_Asgard(file_path, dst=None, hold=False, axisf=False, *arg):
                 
                 Asgard_param[line[0].decode('utf-8')] = value
             line = f.readline()[:-1].split(b'\t')
-        f.seek(spec_byte)
         
+        if 'G' in codes :
+            f.readline() #Good
+            line = f.readline().strip().decode('utf-8')[1:-1]
+            hits = [] if line == '' else [int(i) for i in line.split(', ')]
+            if axisf is True : #the first spectrum is the axis
+                hits = [i-1 for i in hits if i > 0]
+            Asgard_param['Thor'] = hits
+    
+    data_file = None
+    source = None
+    compression = None
+    if 'X' not in codes :
+        with open_source(file_path) as f :
+            compression = aff.read_chunks(f, preamble)[0]
+    if 'X' in codes or compression is not None :
+        #spectra are referenced by the file (not stored in it) or compressed in 
+        #chunks : AsgFile reads them (decompressing ahead, in threads)
+        if is_compressed(file_path) is True :
+            if compression is not None :
+                raise Exc.FileFormatError('%s holds compressed spectra and can not be read compressed again' %file_path)
+            raise Exc.FileFormatError('%s references spectra of another file and can not be read compressed' %file_path)
+        from .AsgardFile import AsgFile
+        source = AsgFile(file_path)
+        def read(first, last):
+            return source[first:last].reshape([-1, Asgard_param['Spec len']])
+    else :
+        #spectra are read in order, from a single handle, and decoded from their storage
+        with open_source(file_path) as f :
+            data_type, scales, per_spectrum = aff.read_storage(f, preamble)
+        size = dtype(data_type).itemsize
+        data_file = open_source(file_path)
+        data_file.seek(spec_byte)
+        def read(first, last):
+            data = data_file.read((last-first)*Asgard_param['Spec len']*size)
+            stored = frombuffer(data, dtype=data_type).reshape([-1, Asgard_param['Spec len']])
+            rows = None
+            if per_spectrum is True :
+                rows = slice(first, last)
+            return aff.decode(stored, scales, rows)
+    
+    try :
+        amount = Asgard_param['Spec amount']
+        start = 0
+        axis = None
         if axisf is True :
-            axis = frombuffer(f.read(Asgard_param['Spec len']*4), dtype=float32)        
-            Asgard_param['Spec amount']-=1
+            axis = read(0, 1)[0]
+            Asgard_param['Spec amount'] -= 1
+            start = 1
+        yield Asgard_param, axis
         
-        if hold is True :
-            if axisf is True :
-                return Asgard_param, axis
-            else :
-                return Asgard_param
+        rows = max(1, block_size // (4*max(1, Asgard_param['Spec len'])))
+        if source is not None :
+            for first, block in source.iter_blocks(rows, start, amount) :
+                yield block
         else :
-            with open(dst, 'ab') as f2 :
-                for spec in range(Asgard_param['Spec amount']):
-                    line = f.read(4*Asgard_param['Spec len'])
-                    f2.write(line)
-    
-            if axisf is True :
-                return dst, Asgard_param, axis
-            else :
-                return dst, Asgard_param
+            for first in range(start, amount, rows) :
+                yield read(first, min(first+rows, amount))
+    finally :
+        if data_file is not None :
+            data_file.close()
     
     
 def convert_Matlab(file_path, dst=None, orient='row', hold=False, axisf=False, *arg):
     """   
-    Extract raw data from Matlab .mat files
+    Extract raw data from Matlab .mat files.  Version 7.3 files (HDF5) are 
+    read in blocks of spectra (requires h5py) so memory use stays bounded.
             
     Parameters
     ---------
@@ -426,14 +881,22 @@ def convert_Matlab(file_path, dst=None, orient='row', hold=False, axisf=False, *
         Full path to the file where data were writen, may it be temporary or user selected
         
     """
+    return _convert_stream(stream_Matlab(file_path, orient=orient, axisf=axisf), dst, hold, axisf)
     
+
+def stream_Matlab(file_path, orient='row', axisf=False, block_size=2**26):
+    """
+    Streaming version of convert_Matlab (see stream).
+    """
+    #v7.3 files are HDF5 and can't be read by loadmat, they are streamed instead
+    if _is_Matlab_v73(file_path) is True :
+        yield from _stream_Matlab_v73(file_path, orient=orient, axisf=axisf, block_size=block_size)
+        return
     
-    if dst is None and hold is False:
-        dst = TemporaryFile('wb', delete=False).name
-    
-    
+    from scipy.io import loadmat
     
-    arr = loadmat(file_path)
+    with open_source(file_path) as f :
+        arr = loadmat(f)
     if len(arr.keys())>4 :
         raise Exc.FileFormatError('The selected Matlab .mat file contains more than a single matrix')
     else :
@@ -445,29 +908,66 @@ def convert_Matlab(file_path, dst=None, orient='row', hold=False, axisf=False, *
     if orient != 'row' :
         arr = arr.T
     
-    Asgard_param = {'Spec len':arr.shape[1], 'Spec amount':arr.shape[0]}
+    yield from _stream_rows(arr, axisf=axisf, block_size=block_size)
+        
     
-    if hold is True :
-        if axisf is True:
-            Asgard_param['Spec amount'] -= 1
-            axis = arr[0, :]
-            return Asgard_param, axis
-        else:
-            return Asgard_param
-    else :
-        with open(dst, 'ab') as f:
-            for spec in range(arr.shape[0]):
-                if spec==0 and axisf is True :
-                    Asgard_param['Spec amount'] -= 1
-                    axis = arr[0, :]
-                else :
-                    for pix in arr[spec,:]:
-                        f.write(bytearray(pack('f',pix)))
-        if axisf is True :
-            return dst, Asgard_param, axis
+def _is_Matlab_v73(file_path):
+    """Whether a .mat file is a version 7.3 (HDF5 based) file"""
+    with open_source(file_path) as f :
+        text = f.read(128)
+        f.seek(512)
+        signature = f.read(8)
+    return text.startswith(b'MATLAB 7.3') or signature == b'\x89HDF\r\n\x1a\n'
+
+
+def _stream_Matlab_v73(file_path, orient='row', axisf=False, block_size=2**26):
+    """
+    stream_Matlab for version 7.3 (HDF5 based) .mat files.  The matrix is 
+    read block_size bytes at a time and never loaded whole.
+    
+    Matlab stores matrices column by column, so the HDF5 dataset is the 
+    transpose of the Matlab matrix : rows of the matrix are columns of the 
+    dataset.
+    """
+    try :
+        from h5py import File, Dataset
+    except ImportError :
+        raise Exc.FileFormatError('Matlab v7.3 files are HDF5 files and require the h5py package to be read')
+    
+    source = file_path
+    if is_compressed(file_path) is True :
+        source = open_source(file_path)
+    with File(source, 'r') as h5 :
+        names = [key for key in h5.keys() if not key.startswith('#') and isinstance(h5[key], Dataset)]
+        if len(names) > 1 :
+            raise Exc.FileFormatError('The selected Matlab .mat file contains more than a single matrix')
+        elif len(names) == 0 or len(h5[names[0]].shape) != 2 :
+            raise Exc.FileFormatError('The selected Matlab .mat file does not contain a 2D matrix')
+        ds = h5[names[0]]
+        
+        if orient == 'row' :
+            spec_len, spec_amount = ds.shape
+            def read(first, last):
+                return ds[:, first:last].T
         else :
-            return dst, Asgard_param        
+            spec_amount, spec_len = ds.shape
+            def read(first, last):
+                return ds[first:last, :]
+        
+        Asgard_param = {'Spec len':spec_len, 'Spec amount':spec_amount}
         
+        start = 0
+        axis = None
+        if axisf is True :
+            Asgard_param['Spec amount'] -= 1
+            axis = read(0, 1)[0]
+            start = 1
+        yield Asgard_param, axis
+        
+        rows = max(1, block_size // (4*max(1, spec_len)))
+        for first in range(start, spec_amount, rows) :
+            yield read(first, min(first+rows, spec_amount))
+    
     
 def convert_numpy(file_path, dst=None, orient='row', hold=False, axisf=False, *arg):
     """
@@ -499,11 +999,20 @@ def convert_numpy(file_path, dst=None, orient='row', hold=False, axisf=False, *a
         Full path to the file where data were writen, may it be temporary or user selected
         
     """
-
+    return _convert_stream(stream_numpy(file_path, orient=orient, axisf=axisf), dst, hold, axisf)
     
-    if dst is None and hold is False:
-        dst = TemporaryFile('wb', delete=False).name
 
+def stream_numpy(file_path, orient='row', axisf=False, block_size=2**26):
+    """
+    Streaming version of convert_numpy (see stream).  The array is memory 
+    mapped, never loaded whole.  Compressed arrays are read by blocks (see 
+    _stream_npy).
+    """
+    if is_compressed(file_path) is True :
+        with open_source(file_path) as f :
+            yield from _stream_npy(f, orient=orient, axisf=axisf, block_size=block_size)
+        return
+    
     try :
         arr = load(file_path, allow_pickle=True, mmap_mode='r')
     except ValueError :
@@ -517,37 +1026,254 @@ def convert_numpy(file_path, dst=None, orient='row', hold=False, axisf=False, *a
     
     if len(arr.shape) != 2 :
         raise Exc.FileFormatError('Selected file contains an array with more than 2 dimensions')
+    
+    yield from _stream_rows(arr, axisf=axisf, block_size=block_size)
         
-    Asgard_param = {'Spec len':arr.shape[1], 'Spec amount':arr.shape[0]}
-    if hold is True :
-        if axisf is True :
-           Asgard_param['Spec amount'] -= 1
-           axis = arr[0,:] 
-           return Asgard_param, axis
-        else :
-            return Asgard_param
+
+def _stream_npy(f, orient='row', axisf=False, block_size=2**26):
+    """
+    stream_numpy for a .npy opened as a file object that can't be memory 
+    mapped (i.e. decompressed as it is read).  When spectra are not 
+    contiguous in the file (Fortran order for 'row' orient, C order for 
+    'col'), pixels are read by blocks and transposed to a temporary file.
+    """
+    try :
+        shape, fortran_order, data_type = _read_array_header(f, read_magic(f))
+    except ValueError :
+        raise Exc.FileFormatError('Selected file is not a valid numpy array')
+    if data_type.hasobject is True :
+        raise Exc.FileFormatError('Selected file is not a numeric numpy array')
+    
+    if len(shape) == 1 :
+        shape = (1, shape[0])
+        fortran_order = False
+    if len(shape) != 2 :
+        raise Exc.FileFormatError('Selected file contains an array with more than 2 dimensions')
+    
+    #the file is a serie of lines, of spectra or of pixels
+    if fortran_order is True :
+        lines, line_len = shape[1], shape[0]
     else :
-        with open(dst,'ab') as f :
-            for spec in range(arr.shape[0]):
-                if axisf is True :
-                    Asgard_param['Spec amount'] -= 1
-                    axis = arr[spec,:]
-                else :
-                    for pix in arr[spec,:]:
-                        f.write(bytearray(pack('f',pix)))
+        lines, line_len = shape
+    transposed = fortran_order is (orient == 'row')
+    
+    def read(amount):
+        data = f.read(amount*line_len*data_type.itemsize)
+        return frombuffer(data, dtype=data_type).reshape(amount, line_len)
+    rows = max(1, block_size // (data_type.itemsize*max(1, line_len)))
+    
+    if transposed is False :
+        Asgard_param = {'Spec len':line_len, 'Spec amount':lines}
+        axis = None
+        left = lines
         if axisf is True :
-            return dst, Asgard_param, axis
-        else :
-            return dst, Asgard_param        
+            axis = read(1)[0]
+            Asgard_param['Spec amount'] -= 1
+            left -= 1
+        yield Asgard_param, axis
+        
+        while left > 0 :
+            yield read(min(rows, left))
+            left -= min(rows, left)
+    
+    else :
+        temp = TemporaryFile('wb', delete=False).name
+        try :
+            with open(temp, 'ab') as out_file :
+                out_file.truncate(line_len*lines*4)
+            out = memmap(temp, dtype='<f4', mode='r+', shape=(line_len, lines))
+            for first in range(0, lines, rows) :
+                block = read(min(rows, lines-first))
+                out[:, first:first+block.shape[0]] = block.T
+            out.flush()
+            
+            yield from _stream_rows(out, axisf=axisf)
+            del out
+        finally :
+            remove(temp)
+
+
+def convert_SPA(file_path, dst=None, hold=False, axisf=False, *arg):
+    """
+    Extract the spectrum of a Thermo OMNIC .spa file
+    
+    Parameters
+    ---------
+    file_path : path (str)
+        Full path to the file to be extracted.
+        
+    dst : str
+        Full path to the file where data will be appended as bytes.
+        In the case of None value, a temporary file is created and the path is returned.
+    
+    hold : bool
+        If true, limits parts of the code to only get data type and parameters. (faster)
+        
+    axisf : bool
+        Returns the axis (wavenumbers) of the file as well.
+        
+    Return
+    ------
+    Asgard_param : dict
+        Stores update to Asgard parameters (i.e. spec_amount, spec_len, Axis)
+    dst : path (str)
+        Full path to the file where data were writen, may it be temporary or user selected
+        
+    """
+    return _convert_stream(stream_SPA(file_path, axisf=axisf), dst, hold, axisf)
+
+
+def stream_SPA(file_path, axisf=False):
+    """
+    Streaming version of convert_SPA (see stream).  
+    
+    The heading holds a directory of 16 bytes entries from byte 304 : the 
+    type of block (uint8), then its offset (uint32 at +2) and size (uint32 at
+    +6).  Block 2 is the spectrum heading (amount of points at +4, first 
+    and last x at +16 and +20), block 3 the intensities (float32).
+    """
+    header = None
+    intensities = None
+    with open_source(file_path) as f :
+        position = 304
+        while True :
+            f.seek(position)
+            entry = f.read(16)
+            if len(entry) < 16 or entry[0] in (0, 1) :
+                break
+            if entry[0] == 2 :
+                header = unpack('<I', entry[2:6])[0]
+            elif entry[0] == 3 :
+                intensities = unpack('<II', entry[2:10])
+            position += 16
+        
+        if header is None or intensities is None :
+            raise Exc.FileFormatError('%s is not a valid OMNIC .spa file' %file_path)
+        f.seek(header)
+        heading = f.read(24)
+        if len(heading) < 24 :
+            raise Exc.FileFormatError('%s is not a valid OMNIC .spa file' %file_path)
+        spec_len = unpack('<I', heading[4:8])[0]
+        first, last = unpack('<ff', heading[16:24])
         
+        offset, size = intensities
+        if size // 4 < spec_len :
+            raise Exc.FileFormatError('%s is missing part of its spectrum' %file_path)
+        f.seek(offset)
+        spectrum = frombuffer(f.read(spec_len*4), dtype='<f4')
+    
+    axis = [float(x) for x in linspace(first, last, spec_len)]
+    yield {'Spec len':spec_len, 'Spec amount':1, 'Axis':axis}, (axis if axisf is True else None)
+    yield spectrum.reshape(1, spec_len)
 
-def convert_SPA(*arg):
-    ###TO DO :
-    raise Exc.FutureImplementationError('Support for this file type is still in developement')
 
-def convert_SPC(*arg):
-    ###TO DO :
-    raise Exc.FutureImplementationError('Support for this file type is still in developement')
+def convert_SPC(file_path, dst=None, hold=False, axisf=False, *arg):
+    """
+    Extract the spectra of a Thermo Galactic .spc file (new format, single 
+    or multi-file)
+    
+    Parameters
+    ---------
+    file_path : path (str)
+        Full path to the file to be extracted.
+        
+    dst : str
+        Full path to the file where data will be appended as bytes.
+        In the case of None value, a temporary file is created and the path is returned.
+    
+    hold : bool
+        If true, limits parts of the code to only get data type and parameters. (faster)
+        
+    axisf : bool
+        Returns the axis (x values) of the file as well.
+        
+    Return
+    ------
+    Asgard_param : dict
+        Stores update to Asgard parameters (i.e. spec_amount, spec_len, Axis)
+    dst : path (str)
+        Full path to the file where data were writen, may it be temporary or user selected
+        
+    """
+    return _convert_stream(stream_SPC(file_path, axisf=axisf), dst, hold, axisf)
+
+
+_SPC_TSPREC = 0x01  #16 bits y values
+_SPC_TMULTI = 0x04  #multiple subfiles
+_SPC_TXYXYS = 0x40  #each subfile has its own x values
+_SPC_TXVALS = 0x80  #x values after the heading
+
+
+def stream_SPC(file_path, axisf=False, block_size=2**26):
+    """
+    Streaming version of convert_SPC (see stream).
+    
+    A 512 bytes heading (flags, version 0x4B, exponent, amount of points, 
+    first and last x, amount of subfiles), optionally followed by the x 
+    values, then every subfile : a 32 bytes subheading (exponent at +1, 
+    amount of points at +16), its own x values for XYXY files, and the y 
+    values.  An exponent of -128 means float32 y values, otherwise they are 
+    integers scaled by 2**(exponent-32) (or 2**(exponent-16) for 16 bits).
+    All subfiles must have the same amount of points.
+    """
+    with open_source(file_path) as f :
+        heading = f.read(512)
+        if len(heading) < 512 or heading[1] != 0x4B :
+            raise Exc.FileFormatError('%s is not a .spc file, or uses an old (unsupported) .spc format' %file_path)
+        flags = heading[0]
+        exponent = unpack('<b', heading[3:4])[0]
+        spec_len, first, last, amount = unpack('<iddi', heading[4:28])
+        if flags & _SPC_TMULTI == 0 :
+            amount = 1
+        
+        if flags & _SPC_TXVALS and not flags & _SPC_TXYXYS :
+            axis = frombuffer(f.read(4*spec_len), dtype='<f4')
+        else :
+            axis = linspace(first, last, spec_len)
+        
+        def read_subfile():
+            """Returns (x or None, y) of the next subfile"""
+            subheading = f.read(32)
+            if len(subheading) < 32 :
+                raise Exc.FileFormatError('%s is missing subfiles' %file_path)
+            sub_exponent = unpack('<b', subheading[1:2])[0]
+            length = spec_len
+            x = None
+            if flags & _SPC_TXYXYS :
+                length = unpack('<i', subheading[16:20])[0]
+                if length != spec_len and spec_len > 0 :
+                    raise Exc.FileFormatError('Subfiles of %s have spectra of different lengths' %file_path)
+                x = frombuffer(f.read(4*length), dtype='<f4')
+            if flags & _SPC_TMULTI == 0 :
+                sub_exponent = exponent
+            
+            if sub_exponent == -128 :
+                y = frombuffer(f.read(4*length), dtype='<f4')
+            elif flags & _SPC_TSPREC :
+                y = frombuffer(f.read(2*length), dtype='<i2')*(2.0**(sub_exponent-16))
+            else :
+                y = frombuffer(f.read(4*length), dtype='<i4')*(2.0**(sub_exponent-32))
+            if len(y) != length :
+                raise Exc.FileFormatError('%s is missing part of its spectra' %file_path)
+            return x, y.astype(float32, copy=False)
+        
+        #XYXY files hold their x values (and their length) in the subfiles
+        x, y = read_subfile()
+        if x is not None :
+            spec_len = len(y)
+            axis = x
+        
+        axis = [float(i) for i in axis]
+        yield {'Spec len':spec_len, 'Spec amount':amount, 'Axis':axis}, (axis if axisf is True else None)
+        
+        rows = max(1, block_size // (4*max(1, spec_len)))
+        block = [y]
+        for subfile in range(1, amount) :
+            if len(block) == rows :
+                yield stack(block)
+                block = []
+            block.append(read_subfile()[1])
+        yield stack(block)
 
 def convert_text(file_path, dst=None, hold=False, axisf=False, *arg):
     """
@@ -627,11 +1353,16 @@ def convert_old_Thor(file_path, dst=None, hold=False, axisf=False, *arg):
         list of hits found within the old Thor file
         
     """
+    return _convert_stream(stream_old_Thor(file_path, axisf=axisf), dst, hold, axisf)
 
-    if dst is None and hold is False:
-        dst = TemporaryFile('wb', delete=False).name  
-    
-    Thor = load(file_path, allow_pickle=True).item()
+
+def stream_old_Thor(file_path, axisf=False, block_size=2**26):
+    """
+    Streaming version of convert_old_Thor (see stream).  The axis is the 
+    one saved by Thor.
+    """
+    with open_source(file_path) as f :
+        Thor = load(f, allow_pickle=True).item()
     axis = list(Thor['Axis'])
     data = Thor['Datas']
     parameters = Thor['Parameters']
@@ -648,32 +1379,32 @@ def convert_old_Thor(file_path, dst=None, hold=False, axisf=False, *arg):
             
             Asgard_param[param_name] = value
     Asgard_param['Thor'] = hits
-    if hold is True :
-        if axisf is True :
-            return Asgard_param, axis
-        else :
-            return Asgard_param
-    else :
-        with open(dst, 'wb') as f :
-            for spec in range(data.shape[0]):
-                for pix in range(data.shape[1]):
-                    f.write(bytearray(pack('f',data[spec,pix])))
-                    
-        return dst, Asgard_param
+    if axisf is False :
+        axis = None
+    yield Asgard_param, axis
+    
+    rows = max(1, block_size // (4*max(1, data.shape[1])))
+    for first in range(0, data.shape[0], rows) :
+        yield data[first:first+rows]
 
 
-def convert_Witec(file_path, spectrum_length=2000, dst=None, hold=False,*arg):
+def convert_Witec(file_path, spectrum_length=None, dst=None, hold=False, axisf=False, *arg):
     """
     Extract a serie of spectrum organised as a single column.  
     Gr. Masson's Witec used to produce files like this...
     
+    The file is parsed by large blocks of text and written by blocks of 
+    values.  Reading stops at the first empty line.
+    
     Parameters
     ---------
     file_path : path (str)
         Full path to the file to be extracted.
     spectrum_length : int
         amount of pixel in a single spectrum --> after how many line should 
-        the program cut for next spectrum?
+        the program cut for next spectrum?  If None, it is found from the 
+        similarity of consecutive spectra (see _spectrum_period), or 2000 if 
+        there is none.
         
     dst : str
         Full path to the file where data will be appended as bytes.
@@ -693,29 +1424,532 @@ def convert_Witec(file_path, spectrum_length=2000, dst=None, hold=False,*arg):
         Full path to the file where data were writen, may it be temporary or user selected
         
     """
-    if dst is None and hold is False:
-        dst = TemporaryFile('wb', delete=False).name
+    return _convert_stream(stream_Witec(file_path, spectrum_length=spectrum_length, axisf=axisf), 
+                           dst, hold, axisf)
+
+
+def stream_Witec(file_path, spectrum_length=None, axisf=False):
+    """
+    Streaming version of convert_Witec (see stream).  The file is parsed 
+    once : when spectrum_length is None, it is found from the first block of
+    values only.  'Spec amount' is None.  An incomplete last spectrum is not 
+    yielded.
+    """
+    blocks = _Witec_blocks(file_path)
+    if spectrum_length is None :
+        first = next(blocks, None)
+        second = next(blocks, None)
+        if first is None : #empty file
+            spectrum_length = 2000
+        elif second is None : #the whole file, its amount of values is known
+            spectrum_length = _spectrum_period(first, len(first))
+            blocks = iter([first])
+        else :
+            spectrum_length = _spectrum_period(first)
+            blocks = _chain_blocks(first, _chain_blocks(second, blocks))
+    
+    rest = None
+    axis = None
+    if axisf is True :
+        #the axis is the first spectrum
+        rest = fromstring('', dtype=float64)
+        for values in blocks :
+            rest = concatenate([rest, values])
+            if len(rest) >= spectrum_length :
+                break
+        axis = rest[:spectrum_length]
+        rest = rest[spectrum_length:]
+    yield {'Spec len':spectrum_length, 'Spec amount':None}, axis
+    
+    if rest is not None and len(rest) > 0 :
+        blocks = _chain_blocks(rest, blocks)
+    rest = None
+    for values in blocks :
+        if rest is not None :
+            values = concatenate([rest, values])
+        kept = len(values) - len(values) % spectrum_length
+        rest = values[kept:]
+        if kept > 0 :
+            yield values[:kept].reshape(-1, spectrum_length)
+
+
+def _chain_blocks(first, blocks):
+    """Yields first, then the blocks"""
+    yield first
+    yield from blocks
+
+
+def _Witec_blocks(file_path, size=2**24):
+    """Yields the values of a single column file as 1D arrays, up to the first empty line"""
+    with open_source(file_path, 'r') as f :
+        rest = '\n' #so an empty first line is found as well
+        end = False
+        while end is False :
+            text = f.read(size)
+            end = text == ''
+            text = rest + text
+            blank = _BLANK_LINE.search(text)
+            if blank is not None :
+                text = text[:blank.start()]
+                end = True
+            if end is False :
+                #keep the last (maybe partial) line for the next block
+                cut = text.rfind('\n')
+                if cut <= 0 :
+                    rest = text
+                    continue
+                text, rest = text[:cut], text[cut:]
+            if text.strip() != '' :
+                yield fromstring(text, dtype=float64, sep=' ')
+
+
+_BLANK_LINE = compile_re(r'\n[ \t\r]*\n')
+
+
+def _spectrum_period(values, count=None, default=2000, minimum=16, sample=64, peaks=16):
+    """
+    Finds the length of the spectra in a serie of spectra put back to back.
+    
+    Every divisor of the amount of values is a possible length.  If that 
+    amount is unknown, the possible lengths are the shifts at which the 
+    start of the serie best matches itself (autocorrelation peaks) and 
+    their divisors.  For each, the start of the serie is cut in spectra and
+    consecutive spectra are compared (Pearson correlation, so intensity 
+    changes don't matter).  The best length is kept, unless one of its 
+    divisors does nearly as well (2 spectra side by side also look alike).
+    
+    Parameters
+    ---------
+    values : numpy 1D array
+        Start of the serie.
+    count : int or None
+        Amount of values in the whole serie, None if unknown.
+    default : int
+        Returned if no length makes consecutive spectra look alike.
+    minimum : int
+        Smallest spectrum length considered.
+    sample : int
+        Maximum amount of spectra compared for each length.
+    peaks : int
+        Amount of autocorrelation peaks tried when count is None.
         
-    floaty = 0
-    with open(file_path, 'r') as f :
-        with open(dst,'ab') as f2 :
-            line = f.readline().strip()
-            while line != '' :
-                f2.write(bytearray(pack('f',float(line))))
-                floaty +=1
-                line = f.readline().strip()
+    Return
+    ------
+    spectrum_length : int
+    """
+    if count is None :
+        lengths = set()
+        for peak in _autocorrelation_peaks(values, minimum, peaks) :
+            lengths.update(_divisors(peak))
+        limit = len(values)
+    else :
+        lengths = _divisors(count)
+        limit = count
+    
+    scores = {}
+    for length in lengths :
+        if length < minimum or length > limit//2 :
+            continue
+        amount = min(limit//length, sample, len(values)//length)
+        if amount < 2 :
+            continue
+        spectra = values[:amount*length].reshape(amount, length)
+        spectra = spectra - spectra.mean(axis=1)[:, None]
+        norm = sqrt((spectra**2).sum(axis=1))
+        norm[norm == 0] = inf
+        correlation = (spectra[1:]*spectra[:-1]).sum(axis=1)/(norm[1:]*norm[:-1])
+        scores[length] = median(correlation)
+    
+    if len(scores) == 0 :
+        return default
+    best = max(scores, key=scores.get)
+    if scores[best] < 0.5 :
+        return default
+    for length in sorted(scores.keys()) :
+        if best % length == 0 and scores[length] >= 0.85*scores[best] :
+            return length
+
+
+def _divisors(number):
+    """Divisors of a positive int, found up to its square root"""
+    divisors = set()
+    for i in range(1, isqrt(number) + 1) :
+        if number % i == 0 :
+            divisors.update((i, number//i))
+    return divisors
+
 
-    Asgard_param = {'Spec len':spectrum_length, 'Spec amount':floaty//spectrum_length}
+def _autocorrelation_peaks(values, minimum, amount):
+    """Shifts (minimum to half the values) of the highest local maxima of the autocorrelation"""
+    half = len(values)//2
+    if half <= minimum :
+        return []
+    centered = values - values.mean()
+    transform = rfft(centered, 2*len(values))
+    correlation = irfft(transform*transform.conj(), 2*len(values))[:half + 2]
+    correlation /= len(values) - arange(half + 2) #unbiased
+    shifts = arange(max(minimum, 1), half + 1)
+    local = shifts[(correlation[shifts] > correlation[shifts - 1]) & (correlation[shifts] >= correlation[shifts + 1])]
+    return [int(shift) for shift in local[argsort(correlation[local])[::-1][:amount]]]
+
+
+def external_reference(file_path, type_=None, orient='row', axisf=False):
+    """
+    For sources that already store spectra as rows of numbers at a known
+    offset (Andor .sif and numpy .npy/DATABLOCK), describes where the data 
+    is so an Asgard file can read it directly instead of copying it.
+    
+    Parameters
+    ---------
+    file_path : path (str)
+        Full path to the file to be referenced.
+    type_ : str
+        'Andor' or 'numpy'.  If None, found from the file extension.
+    orient : str
+        Orientation of the spectra in a numpy file.  Defaults to spectra as row.
+    axisf : bool
+        Uses the 1st spectrum as the axis and starts the reference after it.
+    
+    Return
+    ------
+    Asgard_param : dict
+        Stores update to Asgard parameters (i.e. spec_amount, spec_len, Axis for sif)
+    reference : dict
+        'Path', 'Offset' (byte), 'Dtype' (numpy str), 'Shape' (rows, columns)
+        and 'Checksum' (see source_checksum) of the referenced data.
+    axis : numpy 1D array
+        Only returned if axisf is True.
+    """
+    if is_compressed(file_path) is True :
+        raise Exc.FileFormatError('Spectra of compressed files can not be referenced in place')
+    if type_ is None :
+        if file_path.endswith('.sif') :
+            type_ = 'Andor'
+        elif file_path.endswith('.npy') or file_path.endswith('DATABLOCK') :
+            type_ = 'numpy'
+    
+    if type_ == 'Andor' :
+        Asgard_param, offset, data_size = _Andor_layout(file_path)
+        data_type = dtype('<f4')
+        shape = (Asgard_param['Spec amount'], Asgard_param['Spec len'])
+        
+    elif type_ == 'numpy' :
+        with open(file_path, 'rb') as f :
+            try :
+                version = read_magic(f)
+                shape, fortran_order, data_type = _read_array_header(f, version)
+            except ValueError :
+                raise Exc.FileFormatError('Selected file is not a valid numpy array')
+            offset = f.tell()
+        
+        if len(shape) == 1 :
+            shape = (1, shape[0])
+        if len(shape) != 2 :
+            raise Exc.FileFormatError('Selected file contains an array with more than 2 dimensions')
+        if data_type.kind not in 'fiu' :
+            raise Exc.FileFormatError('Only numerical numpy arrays can be referenced')
+        
+        #spectra must be contiguous rows on disk
+        if fortran_order is True :
+            shape = shape[::-1]
+        if (orient == 'row') == fortran_order and 1 not in shape :
+            raise Exc.FileFormatError('Spectra are not contiguous in this numpy file, '+
+                                      'it must be converted instead')
+        Asgard_param = {'Spec len':shape[1], 'Spec amount':shape[0]}
+    
+    else :
+        raise Exc.FileFormatError('%s files can not be referenced, ' %type_ +
+                                  'they must be converted.')
+    
+    if axisf is True :
+        with open(file_path, 'rb') as f :
+            f.seek(offset)
+            axis = frombuffer(f.read(shape[1]*data_type.itemsize), dtype=data_type)
+        offset += shape[1]*data_type.itemsize
+        shape = (shape[0]-1, shape[1])
+        Asgard_param['Spec amount'] -= 1
+    
+    reference = {'Path' : abspath(file_path).replace('\\','/'),
+                 'Offset' : offset,
+                 'Dtype' : data_type.str,
+                 'Shape' : shape}
+    reference['Checksum'] = source_checksum(reference)
+    
+    if axisf is True :
+        return Asgard_param, reference, axis
+    else :
+        return Asgard_param, reference
+
+
+def source_checksum(reference, sample=2**16):
+    """
+    Quick fingerprint of referenced external data : CRC32 of the data size 
+    and of its first and last bytes (not the whole data, so checking a 
+    reference stays near-instant).
+    
+    Parameters
+    ---------
+    reference : dict
+        Reference as made by external_reference.
+    sample : int
+        Amount of bytes read at the start and at the end of the data.
+    
+    Return
+    ------
+    checksum : str
+        Hexadecimal CRC32.
+    """
+    size = reference['Shape'][0]*reference['Shape'][1]*dtype(reference['Dtype']).itemsize
+    checksum = crc32(bytes(str(size), 'utf-8'))
+    with open(reference['Path'], 'rb') as f :
+        f.seek(reference['Offset'])
+        checksum = crc32(f.read(min(sample, size)), checksum)
+        f.seek(reference['Offset'] + max(0, size-sample))
+        checksum = crc32(f.read(min(sample, size)), checksum)
+    return '%08x' %checksum
+
+
+def _write_rows(dst, arr, start=0, block_size=2**26):
+    """
+    Appends the rows of a 2D array (numpy array or memmap) to dst as float32,
+    writing large blocks of rows at once instead of one value at a time.
+    
+    Parameters
+    ---------
+    dst : str
+        Full path to the file where data will be appended as bytes.
+    arr : 2D numpy array
+        Spectra as rows.
+    start : int
+        Index of the first row to write.
+    block_size : int
+        Approximative size of a block in bytes.
+    """
+    rows = max(1, block_size // (4*max(1, arr.shape[1])))
+    with open(dst, 'ab') as f :
+        for first in range(start, arr.shape[0], rows):
+            f.write(arr[first:first+rows].astype('<f4', copy=False).tobytes())
+
+
+def _stream_rows(arr, axisf=False, block_size=2**26):
+    """Streams a 2D array of spectra as rows (see stream)"""
+    Asgard_param = {'Spec len':arr.shape[1], 'Spec amount':arr.shape[0]}
+    start = 0
+    axis = None
+    if axisf is True :
+        Asgard_param['Spec amount'] -= 1
+        axis = arr[0, :]
+        start = 1
+    yield Asgard_param, axis
+    
+    rows = max(1, block_size // (4*max(1, arr.shape[1])))
+    for first in range(start, arr.shape[0], rows):
+        yield arr[first:first+rows]
+
+
+def stream_ASCII(file_path, axisf=False, block_size=2**26):
+    """
+    Streaming version of convert_ASCII (see stream).  Spectra are columns 
+    in the file, so they are parsed once to a temporary file (spectra as 
+    rows) which is then read by blocks.
+    """
+    layout = _ASCII_layout(file_path)
+    skipped_lines, nb_spec, spec_size, options = layout
+    amount = nb_spec
+    if axisf is True :
+        amount -= 1
+    
+    temp = TemporaryFile('wb', delete=False).name
+    try :
+        out = None
+        if amount > 0 :
+            with open(temp, 'ab') as f :
+                f.truncate(amount*spec_size*4)
+            out = memmap(temp, dtype='<f4', mode='r+', shape=(amount, spec_size))
+        axis = _ASCII_fill(file_path, layout, out, axisf=axisf)
+        if out is not None :
+            out.flush()
+            del out
+        if axis is not None :
+            axis = axis[0]
+        yield {'Spec len':spec_size, 'Spec amount':amount}, axis
+        
+        rows = max(1, block_size // (4*max(1, spec_size)))
+        with open(temp, 'rb') as f :
+            for first in range(0, amount, rows) :
+                data = f.read(min(rows, amount-first)*spec_size*4)
+                yield frombuffer(data, dtype='<f4').reshape(-1, spec_size)
+    finally :
+        remove(temp)
+
+
+def stream(file_path, type_=None, axisf=False, **options):
+    """
+    Single pass conversion : opens a file and returns a generator that first 
+    yields the metadata, then the spectra by blocks.  Unlike the convert_X 
+    functions with hold=True, the source is only parsed once.
+    
+    Parameters
+    ---------
+    file_path : path (str)
+        Full path to the file to be extracted.
+    type_ : str
+        Type of the file (see sniff_type), sniffed if None.
+    axisf : bool
+        The 1st spectrum is the axis and is not part of the data.
+    **options :
+        Passed to the stream function of the type of file, e.g. 
+        spectrum_length for Witec files (see stream_Witec).  Options left 
+        to None are not passed.
+        
+    Return
+    ------
+    type_ : str
+        Type of the file.
+    spectra : generator
+        First yields (Asgard_param, axis), axis being None if axisf is False.  
+        'Spec amount' in Asgard_param is None if it is only known once all 
+        the spectra are read.  Then yields 2D arrays (spectra as rows).
+    """
+    if type_ is None :
+        type_ = sniff_type(file_path)
+    
+    options = {key : value for key, value in options.items() if value is not None}
+    return type_, get_converter(type_).stream(file_path, axisf=axisf, **options)
+
+
+def write_stream(spectra, dst, encoder=None):
+    """
+    Appends the blocks of a stream (after its metadata) to dst as float32,
+    or as the storage (and chunks) of an AsgardFileFormat.Encoder.  Returns 
+    the amount of spectra written.
+    """
+    amount = 0
+    with open(dst, 'ab') as f :
+        for block in spectra :
+            if encoder is None :
+                f.write(block.astype('<f4', copy=False).tobytes())
+            else :
+                f.write(encoder.encode(block))
+            amount += block.shape[0]
+        if encoder is not None :
+            f.write(encoder.flush())
+    return amount
+
+
+def _convert_stream(spectra, dst, hold, axisf):
+    """convert_X behaviour (see convert_Andor) on top of a stream"""
+    Asgard_param, axis = next(spectra)
     if hold is True :
-        return Asgard_param
+        if Asgard_param['Spec amount'] is None :
+            Asgard_param['Spec amount'] = sum(block.shape[0] for block in spectra)
+        spectra.close()
+        if axisf is True :
+            return Asgard_param, axis
+        else :
+            return Asgard_param
+    
+    if dst is None :
+        dst = TemporaryFile('wb', delete=False).name
+    amount = write_stream(spectra, dst)
+    if Asgard_param['Spec amount'] is None :
+        Asgard_param['Spec amount'] = amount
+    if axisf is True :
+        return dst, Asgard_param, axis
     else :
         return dst, Asgard_param
 
+
+def sniff_type(file_path, prefix=2**16):
+    """
+    Identifies the type of a file from its first bytes only (magic bytes, 
+    format headings and a bounded text prefix), never from its data.
+    
+    Parameters
+    ---------
+    file_path : path (str)
+        Full path to the file to be identified.
+    prefix : int
+        Maximum amount of bytes read to identify a text file.
+    
+    Return
+    ------
+    type_ : str
+        Name of a registered converter (see register_converter), built-in 
+        ones being 'Andor', 'ASCII', 'Asgard', 'Matlab', 'numpy', 'old_Thor',
+        'text' or 'Witec'
+    """
+    with open_source(file_path) as f :
+        head = f.read(prefix)
+    name = source_name(file_path)
+    
+    _load_plugins()
+    for converter in _CONVERTERS.values() :
+        if converter.match(head, file_path) is True :
+            return converter.name
+    
+    #no heading (i.e. Matlab v4 files) : extension.  Text files are told apart by their content
+    extension = splitext(name)[1].lower()
+    for converter in _CONVERTERS.values() :
+        if extension in converter.extensions and converter.name not in _TEXT_TYPES :
+            return converter.name
+    
+    if b'\0' in head :
+        raise Exc.FileFormatError('file is of an unrecognised type.  '+
+                                  'It is neither a known binary format, nor a text file.')
+    
+    #Text : first line starting with a number, in the prefix only
+    lines = head.decode('utf-8', errors='replace').splitlines()
+    if len(head) == prefix and len(lines) > 1 :
+        lines = lines[:-1] #last line may be cut
+    line = None
+    for i in lines :
+        i = i.strip()
+        if i != '' and i[0] in '1234567890.,-+' :
+            line = i
+            break
+    if line is None :
+        raise Exc.FileFormatError("If numbers are present in this file, they are formated in a way that can't be read here.")
+    
+    #single column : Witec, else array
+    EXCEPTIONS = ['.', '+', '-', 'E','e'] 
+    for character in line :
+        if character.isdigit() == False and character not in EXCEPTIONS : 
+            if name.lower().endswith('.asc') :
+                return 'ASCII'
+            else :
+                return 'text'
+    return 'Witec'
+
+
+def _sniff_numpy(head, file_path, thor=False):
+    """Whether a file is a numpy array (or, if thor is True, an old Thor file)"""
+    if head.startswith(b'\x93NUMPY') is False :
+        return False
+    #old Thor files are pickled dictionnaries : a 0-d object array
+    with open_source(file_path) as f :
+        shape, fortran_order, data_type = _read_array_header(f, read_magic(f))
+    return (data_type.hasobject is True and shape == ()) is thor
+
+
+def _sniff_old_Thor(head, file_path):
+    """Whether a file is an old Thor file"""
+    return _sniff_numpy(head, file_path, thor=True)
+
+
+def _read_array_header(f, version):
+    """Reads a .npy heading (after the magic string), returns (shape, fortran_order, dtype)"""
+    if version == (1, 0) :
+        return read_array_header_1_0(f)
+    else :
+        return read_array_header_2_0(f)
+
+
 def type_sniff(file_path, dst=None, hold=False, axisf=False):
     """
-    For a given path, identify the type of file and use the appropriate fct
-    to load it.  Writes solely the data to dst file, as bytes, for further 
-    processing.
+    For a given path, identify the type of file (see sniff_type) and use the 
+    appropriate fct to load it.  Writes solely the data to dst file, as bytes,
+    for further processing.
     
     Parameters
     ---------
@@ -749,81 +1983,9 @@ def type_sniff(file_path, dst=None, hold=False, axisf=False):
     """
     if dst is None and hold is False:
         dst = TemporaryFile('wb', delete=False).name
-
-    if file_path.endswith('.sif'):
-        results = convert_Andor(file_path, dst=dst, hold=hold, axisf=axisf)
-        type_ = 'Andor'
     
-    elif file_path.endswith('.asc'):
-        results = convert_ASCII(file_path, dst=dst, hold=hold, axisf=axisf)
-        type_ = 'ASCII'
-    
-    elif file_path.endswith('.txt'):
-        
-        #Verify if Witec or array
-        with open(file_path,'r') as file :
-            line = file.readline().strip()
-            ok = False
-            while line :
-                if line[0] in '1234567890.,-+' :
-                    ok = True
-                    break
-                line = file.readline().strip()
-        
-        if ok is False :
-            raise Exc.FileFormatError("If numbers are present in this .txt, they are formated in a way that can't be read here.")
-
-        EXCEPTIONS = ['.', '+', '-', 'E','e'] 
-        for character in line :
-            if character.isdigit() == False and character not in EXCEPTIONS : 
-                delimiter = character
-                break 
-        try :
-            line = line.split(delimiter)
-        except (UnboundLocalError, NameError) :
-            #single column, Witec
-            pass
-        
-        #Use appropriate fct
-        if len(line) == 1 or type(line)==str:
-            results = convert_Witec(file_path, dst=dst, hold=hold)
-            type_ = 'Witec'
-            if axisf is True :
-                results.append(None)
-        
-        else :
-            results = convert_ASCII(file_path, dst=dst, hold=hold, axisf=axisf)
-            type_ = 'text'
-
-    elif file_path.endswith('.mat') :
-        results = convert_Matlab(file_path, dst=dst, hold=hold, axisf=axisf)
-        type_ = 'Matlab'
-        
-    
-    elif file_path.endswith('.npy') :
-        try :
-            dic = load(file_path, allow_pickle=True).item()
-            ###Only works if this is a dictionnary --> old_Thor
-            
-            results = convert_old_Thor(file_path, dst=dst, hold=hold, axisf=axisf)
-            type_= 'old_Thor'
-            
-        except ValueError : #Not a dictionnary => array
-            results = convert_numpy(file_path, dst=dst, hold=hold, axisf=axisf)
-            type_ = 'Numpy'
-            
-    elif file_path.endswith('DATABLOCK'):
-        results = convert_numpy(file_path, dst=dst, hold=hold, axisf=axisf)
-        type_ = 'Numpy'
-    
-    elif file_path.endswith('.asg'):
-        type_ = 'Asgard'
-        results = convert_Asgard(file_path, dst=dst, hold=hold, axisf=axisf)
-    else :
-        raise Exc.FileFormatError('file is of an unrecognised type.  '+
-                                  'Type sniffing is done using the file extension ' +
-                                  ': if you have manually changed or removed it, ' +
-                                  'it could be the source of this issue.')
+    type_ = sniff_type(file_path)
+    results = get_converter(type_).convert(file_path, dst=dst, hold=hold, axisf=axisf)
     
     #Yes i could just return results, type_...this is for clarity, 
     #for people to know what is in results by reading this code.  You're welcome.
@@ -845,3 +2007,28 @@ def type_sniff(file_path, dst=None, hold=False, axisf=False):
             return dst, Asgard_param, type_
     
 
+
+#%% Built-in converters
+_TEXT_TYPES = ('ASCII', 'text', 'Witec')
+_HDF5 = b'\x89HDF\r\n\x1a\n'
+
+register_converter('Asgard', stream_Asgard, convert=convert_Asgard, extensions=('.asg',),
+                   magic=((0, b'Asgard Data File'), (0, aff.MAGIC)), random_access=True)
+register_converter('Andor', stream_Andor, convert=convert_Andor, extensions=('.sif',),
+                   magic=((0, b'Andor Technology Multi-Channel File'),), 
+                   random_access=True, zero_copy=True)
+register_converter('numpy', stream_numpy, convert=convert_numpy, extensions=('.npy',),
+                   sniff=_sniff_numpy, random_access=True, zero_copy=True)
+register_converter('old_Thor', stream_old_Thor, convert=convert_old_Thor, 
+                   sniff=_sniff_old_Thor, streaming=False)
+register_converter('Matlab', stream_Matlab, convert=convert_Matlab, extensions=('.mat',),
+                   magic=((0, b'MATLAB'), (512, _HDF5)), streaming=False) #v7.3 files do stream
+register_converter('SPA', stream_SPA, convert=convert_SPA, extensions=('.spa',),
+                   magic=((0, b'Spectral Data File'),), random_access=True)
+register_converter('SPC', stream_SPC, convert=convert_SPC, extensions=('.spc',),
+                   random_access=True)
+register_converter('ASCII', stream_ASCII, convert=convert_ASCII, extensions=('.asc',), 
+                   streaming=False)
+register_converter('text', stream_ASCII, convert=convert_text, extensions=('.txt',),
+                   streaming=False)
+register_converter('Witec', stream_Witec, convert=convert_Witec, extensions=('.txt',))
@@ -0,0 +1,710 @@
+# -*- coding: utf-8 -*-
+
+"""
+Othala.Configs.AsgardFileExport.py
+Created : 2026-10-19
+Last update : 2026-10-19
+MIT License
+
+Copyright (c) 2022 Benjamin Charron (CharronB12), Jean-François Masson (SPRBiosensors), Université de Montréal
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+Package requirements
+---------------------
+numpy
+
+Optional
+---------------------
+openpyxl (XlsxWriter)
+h5py (HDF5Writer)
+pyarrow (ParquetWriter, FeatherWriter)
+
+
+Content
+------
+Writers (receive the spectra by blocks of rows and write them to a file) :
+    class Writer(path, orient='row', block_size=2**26) --> base class, handles orient='col'
+    class TxtWriter(path, orient='row', precision=9, delimiter=',')
+    class NpyWriter(path, orient='row')
+    class XlsxWriter(path, orient='row', sheets=16)
+    class HDF5Writer(path, compression=4, chunk_rows=None)
+    class ParquetWriter(path, compression=3, codec='zstd')
+    class FeatherWriter(path, compression=None, codec='zstd')
+    
+def export(asg, writers, indices=None, block_size=2**26, threads=None)
+    Reads an AsgardFile once, by blocks, and feeds every writer
+def read_blocks(asg, indices=None, block_size=2**26)
+    Reads the spectra of an AsgardFile (or a subset) by blocks of rows
+def spectra_info(asg, indices=None)
+    Index, label, good flag and identity of each spectrum exported
+
+"""
+
+from numpy import memmap, asarray, int64, stack, hstack, float32, arange, isin
+from numpy import full
+from numpy.lib.format import open_memmap
+
+from tempfile import TemporaryFile
+from os import remove
+from os.path import getsize, isfile
+from time import perf_counter
+from threading import Thread
+from queue import Queue
+
+
+class Writer :
+    """
+    Base of the exporters.  export() gives the spectra of an AsgardFile 
+    by blocks of rows to open(), write() and close(), which call the 
+    start(shape, axis), write_rows(rows) and finish() methods of subclasses.
+    
+    With orient='col', the rows given to write_rows are pixels : spectra
+    are first spooled to a temporary float32 file, transposed one block 
+    at a time, then read back by blocks, so memory use stays bounded.
+    Subclasses able to write columns directly set transposes to True.
+    Subclasses setting per_spectrum to True also receive, in self.info, the
+    index, label, good flag and identity of every spectrum (see spectra_info).
+    When an export fails, abort() calls stop(), which closes whatever the 
+    subclass left open, then deletes the files of outputs().
+    
+    Attributes
+    ---------
+    path : str
+        File written.
+    orient : str
+        'row' for spectra as rows, anything else for spectra as columns.
+    bytes : int
+        Amount of bytes written.
+    seconds : float
+        Time spent writing.
+    """
+    extension = ''
+    transposes = False
+    per_spectrum = False
+    
+    def __init__(self, path, orient='row', block_size=2**26):
+        if path.endswith(self.extension) is False :
+            path = path + self.extension
+        self.path = path
+        self.orient = orient
+        self.block_size = block_size
+        self.bytes = 0
+        self.seconds = 0.
+        self._spool = None
+    
+    def _rows(self, width):
+        """Amount of rows of width values in a block"""
+        return max(1, self.block_size // (4*max(1, width)))
+    
+    def open(self, shape, axis=None, info=None):
+        """
+        shape : (amount of spectra, spectrum length)
+        axis : list of float or None
+        info : dict of per spectrum columns or None (see spectra_info)
+        """
+        clock = perf_counter()
+        self.shape = shape
+        self.info = info
+        if self.orient == 'row' or self.transposes is True :
+            self.start(shape, axis)
+        else :
+            self._spool = TemporaryFile('wb', delete=False).name
+            with open(self._spool, 'ab') as f :
+                f.truncate(4*shape[0]*shape[1])
+            self._spooled = 0
+            if shape[0]*shape[1] > 0 :
+                self._transposed = memmap(self._spool, dtype='<f4', mode='r+', shape=(shape[1], shape[0]))
+            self.start((shape[1], shape[0]), axis)
+        self.seconds += perf_counter() - clock
+    
+    def write(self, block):
+        """block : spectra as rows (2D array)"""
+        clock = perf_counter()
+        if self._spool is None :
+            self.write_rows(block)
+        else :
+            self._transposed[:, self._spooled:self._spooled+block.shape[0]] = block.T
+            self._spooled += block.shape[0]
+        self.seconds += perf_counter() - clock
+    
+    def close(self):
+        """Writes what was spooled and completes the file"""
+        clock = perf_counter()
+        try :
+            if self._spool is not None and self.shape[0]*self.shape[1] > 0 :
+                rows = self._rows(self.shape[0])
+                for first in range(0, self.shape[1], rows) :
+                    self.write_rows(self._transposed[first:first+rows])
+            self.finish()
+        finally :
+            self.discard()
+        self.seconds += perf_counter() - clock
+    
+    def discard(self):
+        """Removes the temporary file of orient='col'"""
+        if self._spool is not None :
+            self._transposed = None
+            remove(self._spool)
+            self._spool = None
+    
+    def abort(self):
+        """
+        Ends a failed export : the files are closed and deleted (complete
+        or not), with the temporary file of orient='col'.
+        """
+        try :
+            self.stop()
+        finally :
+            self.discard()
+            for path in self.outputs() :
+                if isfile(path) is True :
+                    remove(path)
+    
+    def outputs(self):
+        """Files written"""
+        return [self.path]
+    
+    def report(self):
+        """Returns a dict with the path, bytes written, seconds and MB/s"""
+        speed = 0
+        if self.seconds > 0 :
+            speed = self.bytes / 2**20 / self.seconds
+        return {'Path' : self.path, 'Bytes' : self.bytes, 
+                'Seconds' : self.seconds, 'MB/s' : speed}
+    
+    def start(self, shape, axis):
+        pass
+    
+    def write_rows(self, rows):
+        raise NotImplementedError
+    
+    def finish(self):
+        pass
+    
+    def stop(self):
+        pass
+
+
+class TxtWriter(Writer) :
+    """
+    Text (.txt) export, one line per row.  Whole blocks are formatted at 
+    once, with a single format string.
+    
+    Inputs
+    ---------
+    precision : int
+        Significant digits of each value (9 keeps float32 values exact).
+    delimiter : str
+        Separates the values of a line.
+    """
+    extension = '.txt'
+    
+    def __init__(self, path, orient='row', precision=9, delimiter=',', block_size=2**24):
+        Writer.__init__(self, path, orient=orient, block_size=block_size)
+        self.precision = precision
+        self.delimiter = delimiter
+        self.file = None
+    
+    def start(self, shape, axis):
+        self.file = open(self.path, 'w', buffering=2**20)
+        self.line = self.delimiter.join(['%%.%sg' %self.precision]*shape[1]) + '\n'
+    
+    def write_rows(self, rows):
+        text = (self.line*rows.shape[0]) %tuple(rows.ravel().tolist())
+        self.file.write(text)
+        self.bytes += len(text)
+    
+    def finish(self):
+        self.file.close()
+    
+    def stop(self):
+        if self.file is not None :
+            self.file.close()
+
+
+class NpyWriter(Writer) :
+    """
+    numpy (.npy) export, written block by block to a memory mapped array
+    (numpy.lib.format.open_memmap).  Spectra as columns are stored in 
+    Fortran order : the file is the same as for rows, loaded transposed.
+    """
+    extension = '.npy'
+    transposes = True
+    
+    def start(self, shape, axis):
+        if self.orient == 'row' :
+            self.array = open_memmap(self.path, mode='w+', dtype='<f4', shape=shape)
+            self.rows = self.array
+        else :
+            self.array = open_memmap(self.path, mode='w+', dtype='<f4', shape=(shape[1], shape[0]),
+                                     fortran_order=True)
+            self.rows = self.array.T
+        self.done = 0
+    
+    def write_rows(self, rows):
+        self.rows[self.done:self.done+rows.shape[0]] = rows
+        self.done += rows.shape[0]
+        self.bytes += rows.shape[0]*rows.shape[1]*4
+    
+    def finish(self):
+        self.array.flush()
+        self.stop()
+    
+    def stop(self):
+        #the memory map is closed once no array uses it
+        self.rows = None
+        self.array = None
+
+
+class XlsxWriter(Writer) :
+    """
+    Excel (.xlsx) export, streamed with a write only openpyxl workbook.
+    The axis is the header row (spectra as rows) or the first column 
+    (spectra as columns).  Past Excel's limits (1,048,576 rows and 16,384
+    columns per sheet), the data continues on new sheets, and past 
+    sheets sheets, on new workbooks (path_2.xlsx, path_3.xlsx, ...).
+    
+    Inputs
+    ---------
+    sheets : int
+        Maximum amount of sheets in a workbook.
+    
+    Attributes
+    ---------
+    paths : list of str
+        Workbooks written.
+    """
+    extension = '.xlsx'
+    max_rows = 1048576
+    max_cols = 16384
+    
+    def __init__(self, path, orient='row', sheets=16, block_size=2**24):
+        Writer.__init__(self, path, orient=orient, block_size=block_size)
+        self.sheets = sheets
+        self.paths = []
+    
+    def start(self, shape, axis):
+        self.axis = None
+        self.header = None
+        if axis is not None and len(axis) > 0 :
+            if self.orient == 'row' :
+                self.header = list(axis)
+            else :
+                self.axis = asarray(axis, dtype=float32).reshape([-1, 1])
+        width = shape[1] + (self.axis is not None)
+        self.groups = [(first, min(first+self.max_cols, width)) for first in range(0, max(1, width), self.max_cols)]
+        self.rows_per_sheet = self.max_rows - (self.header is not None)
+        self.book = None
+        self.part = 0
+        self.done = 0
+        self._next_sheets()
+    
+    def _next_sheets(self):
+        """Starts a sheet per group of columns, in a new workbook if needed"""
+        if self.book is None or len(self.book.worksheets) + len(self.groups) > max(self.sheets, len(self.groups)) :
+            from openpyxl import Workbook
+            self._save()
+            self.book = Workbook(write_only=True)
+            if len(self.paths) == 0 :
+                self.paths.append(self.path)
+            else :
+                self.paths.append(self.path[:-5] + '_%s.xlsx' %(len(self.paths)+1))
+        self.part += 1
+        self.current = []
+        for index, (first, last) in enumerate(self.groups) :
+            title = 'Spectra %s' %self.part
+            if len(self.groups) > 1 :
+                title = title + '.%s' %(index+1)
+            sheet = self.book.create_sheet(title)
+            if self.header is not None :
+                sheet.append(self.header[first:last])
+            self.current.append(sheet)
+        self.in_sheet = 0
+    
+    def _save(self):
+        if self.book is not None :
+            self.book.save(self.paths[-1])
+            self.bytes += getsize(self.paths[-1])
+            self.book = None
+    
+    def write_rows(self, rows):
+        if self.axis is not None :
+            rows = hstack([self.axis[self.done:self.done+rows.shape[0]], rows])
+        self.done += rows.shape[0]
+        first = 0
+        while first < rows.shape[0] :
+            if self.in_sheet == self.rows_per_sheet :
+                self._next_sheets()
+            last = min(rows.shape[0], first + self.rows_per_sheet - self.in_sheet)
+            for sheet, (start, end) in zip(self.current, self.groups) :
+                for row in rows[first:last, start:end] :
+                    sheet.append(row.tolist())
+            self.in_sheet += last - first
+            first = last
+    
+    def finish(self):
+        self._save()
+    
+    def stop(self):
+        #saving is how a write only workbook closes its sheets (and their temporary files)
+        self._save()
+    
+    def outputs(self):
+        return list(self.paths)
+
+
+class HDF5Writer(Writer) :
+    """
+    HDF5 (.h5) export.  Spectra are rows of the chunked dataset 'Spectra',
+    compressed with gzip, next to the 'Axis', 'Index', 'Label', 'Good' 
+    and 'Identity' datasets.
+    
+    Inputs
+    ---------
+    compression : int or None
+        gzip level (0-9), None for no compression.
+    chunk_rows : int or None
+        Spectra per chunk, by default chunks of about 1 MB.
+    """
+    extension = '.h5'
+    transposes = True
+    per_spectrum = True
+    
+    def __init__(self, path, compression=4, chunk_rows=None, block_size=2**26):
+        Writer.__init__(self, path, orient='row', block_size=block_size)
+        self.compression = compression
+        self.chunk_rows = chunk_rows
+        self.file = None
+    
+    def start(self, shape, axis):
+        from h5py import File, string_dtype
+        
+        self.file = File(self.path, 'w')
+        options = {}
+        if shape[0]*shape[1] > 0 :
+            rows = self.chunk_rows
+            if rows is None :
+                rows = max(1, 2**18 // max(1, shape[1]))
+            options['chunks'] = (min(rows, shape[0]), shape[1])
+            if self.compression is not None :
+                options['compression'] = 'gzip'
+                options['compression_opts'] = self.compression
+                options['shuffle'] = True
+        self.spectra = self.file.create_dataset('Spectra', shape=shape, dtype='<f4', **options)
+        if axis is not None :
+            self.file.create_dataset('Axis', data=asarray(axis, dtype=float32))
+        self.file.create_dataset('Index', data=self.info['Index'])
+        self.file.create_dataset('Good', data=self.info['Good'])
+        text = string_dtype()
+        self.file.create_dataset('Label', data=self.info['Label'].astype(text), dtype=text)
+        self.file.create_dataset('Identity', data=self.info['Identity'].astype(text), dtype=text)
+        self.done = 0
+    
+    def write_rows(self, rows):
+        self.spectra[self.done:self.done+rows.shape[0]] = rows
+        self.done += rows.shape[0]
+    
+    def finish(self):
+        self.file.close()
+        self.bytes = getsize(self.path)
+    
+    def stop(self):
+        if self.file is not None :
+            self.file.close()
+
+
+class _ArrowWriter(Writer) :
+    """
+    Base of the pyarrow exports.  Every spectrum is a row with the 
+    'Index', 'Label', 'Good' and 'Identity' columns and a 'Spectrum' 
+    column (fixed size list of float32, one contiguous buffer).  The axis 
+    is kept in the schema metadata, as comma separated values.
+    """
+    transposes = True
+    per_spectrum = True
+    
+    def __init__(self, path, compression=None, codec='zstd', block_size=2**26):
+        Writer.__init__(self, path, orient='row', block_size=block_size)
+        self.compression = compression
+        self.codec = codec
+        self.file = None
+    
+    def start(self, shape, axis):
+        import pyarrow
+        
+        self.pa = pyarrow
+        metadata = {}
+        if axis is not None :
+            metadata['Axis'] = ','.join(['%r' %float(i) for i in axis])
+        self.schema = pyarrow.schema([('Index', pyarrow.int64()), 
+                                      ('Label', pyarrow.string()),
+                                      ('Good', pyarrow.bool_()),
+                                      ('Identity', pyarrow.string()),
+                                      ('Spectrum', pyarrow.list_(pyarrow.float32(), shape[1]))], 
+                                     metadata=metadata)
+        self.done = 0
+        self.file = self.new_file()
+    
+    def write_rows(self, rows):
+        pa = self.pa
+        part = slice(self.done, self.done + rows.shape[0])
+        values = pa.array(rows.astype(float32, copy=False).ravel())
+        spectra = pa.FixedSizeListArray.from_arrays(values, rows.shape[1])
+        table = pa.Table.from_arrays([pa.array(self.info['Index'][part]),
+                                      pa.array(self.info['Label'][part], type=pa.string()),
+                                      pa.array(self.info['Good'][part]),
+                                      pa.array(self.info['Identity'][part], type=pa.string()),
+                                      spectra], schema=self.schema)
+        self.file.write_table(table)
+        self.done += rows.shape[0]
+    
+    def finish(self):
+        self.stop()
+        self.bytes = getsize(self.path)
+    
+    def stop(self):
+        if self.file is not None :
+            self.file.close()
+            self.file = None
+    
+    def new_file(self):
+        raise NotImplementedError
+
+
+class ParquetWriter(_ArrowWriter) :
+    """
+    Parquet (.parquet) export, a row group per block of spectra.
+    
+    Inputs
+    ---------
+    compression : int or None
+        Compression level of the codec, None for its default.
+    codec : str
+        'zstd', 'gzip', 'brotli', 'lz4', 'snappy' or 'none'.
+    """
+    extension = '.parquet'
+    
+    def __init__(self, path, compression=3, codec='zstd', block_size=2**26):
+        _ArrowWriter.__init__(self, path, compression=compression, codec=codec, block_size=block_size)
+    
+    def new_file(self):
+        from pyarrow.parquet import ParquetWriter as Parquet
+        
+        return Parquet(self.path, self.schema, compression=self.codec, 
+                       compression_level=self.compression)
+
+
+class FeatherWriter(_ArrowWriter) :
+    """
+    Arrow IPC file / Feather v2 (.feather) export, a record batch per block
+    of spectra.  Uncompressed files (the default) can be memory mapped and 
+    loaded without copies (pyarrow.ipc.open_file(pyarrow.memory_map(path))).
+    
+    Inputs
+    ---------
+    compression : int or None
+        Compression level of the codec, None for no compression.
+    codec : str
+        'zstd' or 'lz4', used if compression is not None.
+    """
+    extension = '.feather'
+    
+    def new_file(self):
+        from pyarrow.ipc import new_file, IpcWriteOptions
+        
+        options = IpcWriteOptions()
+        if self.compression is not None :
+            options = IpcWriteOptions(compression=self.pa.Codec(self.codec, self.compression))
+        return new_file(self.path, self.schema, options=options)
+
+
+def spectra_info(asg, indices=None):
+    """
+    Describes the exported spectra, one value per spectrum.
+    
+    Parameters
+    ---------
+    asg : AsgFile
+        File exported.
+    indices : list of int or None
+        Spectra exported, in order.  All of them if None.
+    
+    Return
+    ------
+    info : dict
+        'Index' (int64), 'Label' (str, '' if unlabelled), 'Good' (bool) and
+        'Identity' (str, '' if not identified) numpy arrays.
+    """
+    if indices is None :
+        index = arange(asg*'Spec amount', dtype=int64)
+    else :
+        index = asarray(indices, dtype=int64).reshape(-1)
+    
+    label = full(len(index), '', dtype=object)
+    for key in asg.labels :
+        dash = key.index('-')
+        start = int(key[:dash])
+        end = int(key[dash+1:])
+        label[(index >= start) & (index < end)] = asg.labels[key]
+    
+    good = isin(index, asarray(asg.good, dtype=int64))
+    identity = full(len(index), '', dtype=object)
+    if len(asg.identity) == len(asg.good) and good.any() :
+        names = dict(zip(asg.good, asg.identity))
+        for position in good.nonzero()[0] :
+            identity[position] = names[int(index[position])]
+    
+    return {'Index' : index, 'Label' : label, 'Good' : good, 'Identity' : identity}
+
+
+def read_blocks(asg, indices=None, block_size=2**26):
+    """
+    Reads the spectra of an AsgardFile by blocks of block_size bytes.
+    
+    Parameters
+    ---------
+    asg : AsgFile
+        File to read.
+    indices : list of int or None
+        Spectra to read, in order (i.e. asg.good).  All of them if None.
+        Close indices are read together, far ones one by one.
+    block_size : int
+        Approximative size of the blocks, in bytes.
+    
+    Yields
+    ------
+    block : numpy 2D array
+        Spectra as rows.
+    """
+    spec_len = asg*'Spec len'
+    rows = max(1, block_size // (4*max(1, spec_len)))
+    if indices is None :
+        for first, block in asg.iter_blocks(size=rows) :
+            yield block
+        return
+    
+    indices = asarray(indices, dtype=int64)
+    for first in range(0, len(indices), rows) :
+        chunk = indices[first:first+rows]
+        low = chunk.min()
+        high = chunk.max() + 1
+        if high - low <= 4*len(chunk) :
+            yield asg[int(low):int(high)].reshape([-1, spec_len])[chunk-low]
+        else :
+            yield stack([asg[int(i)].reshape(-1) for i in chunk])
+
+
+def export(asg, writers, indices=None, block_size=2**26, threads=None):
+    """
+    Exports the spectra of an AsgardFile to one or many files : the 
+    spectra are read once, by blocks of block_size bytes, and every block 
+    is given to every writer.  With threads, each writer writes (and 
+    closes) its file on its own thread, from a short queue of the blocks 
+    read, so a slow format doesn't hold back the others.
+    
+    Parameters
+    ---------
+    asg : AsgFile
+        File to export.
+    writers : list of Writer
+        Writers of the files to create.
+    indices : list of int or None
+        Spectra to export, in order (i.e. asg.good).  All of them if None.
+    block_size : int
+        Approximative size of the blocks read, in bytes.
+    threads : bool or None
+        Whether each writer gets its own thread.  If None, only when there 
+        are many writers.
+    
+    Return
+    ------
+    reports : list of dict
+        Report of each writer (see Writer.report).
+    """
+    amount = asg*'Spec amount'
+    if indices is not None :
+        amount = len(indices)
+    shape = (amount, asg*'Spec len')
+    info = None
+    if any([writer.per_spectrum for writer in writers]) :
+        info = spectra_info(asg, indices)
+    if threads is None :
+        threads = len(writers) > 1
+    
+    try :
+        for writer in writers :
+            writer.open(shape, asg*'Axis', info)
+        
+        if threads is True :
+            errors = []
+            queues = [Queue(maxsize=2) for writer in writers]
+            workers = [Thread(target=_consume, args=(writer, queue, errors), daemon=True) 
+                       for writer, queue in zip(writers, queues)]
+            for worker in workers :
+                worker.start()
+            try :
+                for block in read_blocks(asg, indices=indices, block_size=block_size) :
+                    if len(errors) > 0 :
+                        break
+                    for queue in queues :
+                        queue.put(block)
+            finally :
+                for queue in queues :
+                    queue.put(None)
+                for worker in workers :
+                    worker.join()
+            if len(errors) > 0 :
+                raise errors[0]
+            
+        else :
+            for block in read_blocks(asg, indices=indices, block_size=block_size) :
+                for writer in writers :
+                    writer.write(block)
+            for writer in writers :
+                writer.close()
+    except :
+        for writer in writers :
+            try :
+                writer.abort()
+            except Exception :
+                pass #the others are still cleaned, the first error is raised
+        raise
+    return [writer.report() for writer in writers]
+
+
+def _consume(writer, queue, errors):
+    """
+    Thread of a writer in export() : writes the blocks of queue until None,
+    then closes the file.  After an error (its own or another writer's), 
+    the blocks are only taken off the queue so the reader never blocks, 
+    and export() aborts every writer.
+    """
+    try :
+        block = queue.get()
+        while block is not None :
+            if len(errors) == 0 :
+                writer.write(block)
+            block = queue.get()
+        if len(errors) == 0 :
+            writer.close()
+    except Exception as error :
+        errors.append(error)
+        while block is not None :
+            block = queue.get()
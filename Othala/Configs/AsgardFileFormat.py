@@ -0,0 +1,1089 @@
+# -*- coding: utf-8 -*-
+
+"""
+Othala.Configs.AsgardFileFormat.py
+Created : 2026-10-19
+Last update : 2026-10-19
+MIT License
+
+Copyright (c) 2022 Benjamin Charron (CharronB12), Jean-François Masson (SPRBiosensors), Université de Montréal
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+Package requirements
+---------------------
+numpy
+lz4 (optional, for lz4 compression)
+zstandard (optional, for zstd compression)
+
+
+Layout of a version 2 .asg file
+------
+preamble (256 bytes, little-endian)
+    magic       8 bytes     b'\x89ASG\r\n\x1a\n'
+    version     uint16      2
+    byte order  1 byte      b'<', byte order of the spectra
+    (padding)   1 byte
+    dtype       8 bytes     numpy dtype of the spectra, i.e. b'<f4'
+    sections    uint32      amount of sections in the table
+    crc         uint32      CRC32 of the preamble (crc as 0) and of the heading
+    table       20 bytes per section : name (4 bytes), uint64 offset, uint64 size
+    generation  uint64      last 8 bytes : odd while a writer modifies the file, 
+                            incremented again (even) once it is done (see WriteLock)
+heading ('HEAD' section)
+    Text heading, same as version 1 from the codes line to 'Spectra\n'
+spectra ('DATA' section)
+    Starts at a multiple of 64 bytes.  Stored as float32, float16, int16 or
+    uint16 (see STORAGES), integers are decoded as stored*scale + offset.
+scales ('SCAL' section, after the spectra, int16/uint16 only)
+    uint64 (0 : one scale for the file, 1 : one per spectrum), then the 
+    (scale, offset) pairs as float64.
+chunk index ('CIDX' section, compressed spectra only)
+    codec (8 bytes, i.e. b'zstd'), int64 level (-1 : default), uint64 
+    shuffle (0 or 1), uint64 rows per chunk, then a (first spectrum, offset 
+    in 'DATA') uint64 pair per chunk and a last pair (amount of spectra, 
+    size of 'DATA').  Each chunk holds at most rows per chunk spectra (all of
+    them, but the last and those followed by appended spectra), byte-shuffled
+    if shuffle is 1, compressed on its own.
+checksums ('CRCS' section, after the spectra)
+    uint64 rows per chunk (0 : the chunks of 'CIDX'), then the CRC32 of each
+    chunk of stored spectra as uint32.  Uncompressed spectra are cut in 
+    chunks of rows per chunk spectra (the last one may hold fewer), the crc
+    of compressed spectra is the one of the compressed chunk.
+
+Version 1 files start with the 'Asgard Data File\n' line and the offset
+of the spectra as a float32, which is not exact past 16,777,216 bytes.
+
+
+Content
+------
+def open_heading(f, preamble=False)
+    Reads the preamble of a .asg file (version 1 or 2), returns the offset of
+    the spectra and leaves f at the codes line of the heading.
+def read_preamble(f)
+    Reads and checks the preamble of a version 2 file
+def pack_heading(heading, data_size=0, data_type='<f4', generation=0, spec_byte=None)
+    Preamble and heading of a version 2 file, as bytes
+def reseal(f, data_size=None, generation=None)
+    Updates the crc (and size of the spectra) of a version 2 file after its
+    heading was modified in place
+def read_generation(f)
+    Generation of a .asg file, read without its heading
+def spec_byte(path)
+    Offset of the spectra in a .asg file
+def read_storage(f, preamble=None)
+    dtype and scales of the spectra of a .asg file
+def write_footer(path, data_size, sections)
+    Rewrites the sections that follow the spectra of a version 2 file
+def read_chunks(f, preamble=None)
+    Compression and chunk index of the spectra of a .asg file
+def read_checksums(f, preamble=None)
+    Checksums of the chunks of spectra of a .asg file
+def chunk_crcs(path, offset, ranges, workers=None)
+    CRC32 of ranges of bytes of a file, read in parallel
+
+def pack_scales(scales, per_spectrum)
+    Content of the 'SCAL' section
+def pack_chunks(compression, index)
+    Content of the 'CIDX' section
+def pack_checksums(crcs, rows)
+    Content of the 'CRCS' section
+def codec(name)
+    Compress and decompress functions of zlib, lz4 or zstd
+def shuffle(stored)
+    Byte-shuffles stored values
+def unshuffle(raw, data_type)
+    Reverse of shuffle
+class Encoder(data_type='<f4', scale=None, offset=0., table=None, compression=None, checksums=None)
+    Converts float32 spectra to a storage dtype, compressed in chunks if asked
+class Checksums(rows=None, row_size=0, crcs=None, amount=0)
+    CRC32 of chunks of stored spectra, computed as they are written
+def decode(stored, scales, rows=None)
+    Stored values to float32
+class ChunkReader(path, spec_byte, compression, index, data_type, spec_len, cache=8, crcs=None)
+    Reads the spectra of a compressed file, a chunk at a time
+class WriteLock(path)
+    Advisory lock of the single writer of a file
+
+"""
+
+from . import Exceptions as Exc
+
+from numpy import dtype, iinfo, float32, float64, asarray, rint, isinf, concatenate
+from numpy import frombuffer, zeros, stack, errstate, uint8, uint32, uint64, searchsorted
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from os import cpu_count, remove, stat, fstat
+from os import name as os_name
+from time import sleep, perf_counter
+
+from struct import pack, unpack, calcsize
+from zlib import crc32
+
+
+MAGIC = b'\x89ASG\r\n\x1a\n'
+VERSION = 2
+PREAMBLE_SIZE = 256
+ALIGNMENT = 64
+STORAGES = {'float32' : '<f4', 'float16' : '<f2', 'int16' : '<i2', 'uint16' : '<u2'}
+CODECS = ('zlib', 'lz4', 'zstd')
+CHUNK_SIZE = 2**20
+
+_FIXED = '<8sHcx8sII'
+_SECTION = '<4sQQ'
+_GENERATION = '<Q'
+_MAX_SECTIONS = (PREAMBLE_SIZE - calcsize(_FIXED) - calcsize(_GENERATION)) // calcsize(_SECTION)
+_CHUNKS = '<8sqQQ'
+
+
+def open_heading(f, preamble=False):
+    """
+    Reads the beginning of a .asg file, version 1 or 2.  f must be at the 
+    start of the file, it is left at the codes line of the text heading.
+    
+    Parameters
+    ---------
+    f : file object opened in 'rb'
+    preamble : bool
+        Whether to also return the preamble, so the sections can then be 
+        read without checking it again (see read_storage).
+    
+    Return
+    ------
+    spec_byte : int or None
+        Offset of the spectra in the file (None for an empty version 1 file).
+    version : int
+        1 or 2.
+    preamble : dict or None
+        Only if preamble is True, see read_preamble (None for version 1).
+    
+    Raises FileFormatError if f is not an Asgard file.
+    """
+    line = f.read(len(MAGIC))
+    if line == MAGIC :
+        f.seek(0)
+        found = read_preamble(f)
+        f.seek(found['Sections'][b'HEAD'][0])
+        result = (found['Sections'][b'DATA'][0], found['Version'])
+    else :
+        line += f.readline()
+        if line != b'Asgard Data File\n' :
+            raise Exc.FileFormatError('Not an Asgard file')
+        spec_byte = unpack('<f', f.read(4))[0]
+        f.readline()
+        found = None
+        result = (None if spec_byte == 0 else int(spec_byte), 1)
+    if preamble is True :
+        return result + (found,)
+    return result
+
+
+def read_preamble(f):
+    """
+    Reads the preamble of a version 2 file and checks its crc.  f must be 
+    at the start of the file, its position is then undefined.
+    
+    Return
+    ------
+    preamble : dict
+        'Version' (int), 'Byte order' (str), 'Dtype' (str), 'Crc' (int),
+        'Generation' (int) and 'Sections' ({name as bytes : (offset, size)}).
+    
+    Raises FileFormatError if the preamble is damaged or if the version is
+    more recent than this one.
+    """
+    raw = f.read(PREAMBLE_SIZE)
+    if len(raw) != PREAMBLE_SIZE :
+        raise Exc.FileFormatError('Truncated Asgard file')
+    magic, version, order, data_type, amount, crc = unpack(_FIXED, raw[:calcsize(_FIXED)])
+    if magic != MAGIC or amount > _MAX_SECTIONS :
+        raise Exc.FileFormatError('Not an Asgard file')
+    if version > VERSION :
+        raise Exc.FileFormatError('Asgard file version %s is not supported (latest %s)' %(version, VERSION))
+    
+    sections = {}
+    position = calcsize(_FIXED)
+    for i in range(amount) :
+        name, offset, size = unpack(_SECTION, raw[position:position+calcsize(_SECTION)])
+        sections[name] = (offset, size)
+        position += calcsize(_SECTION)
+    if b'HEAD' not in sections or b'DATA' not in sections :
+        raise Exc.FileFormatError('Asgard file without heading or spectra section')
+    
+    f.seek(sections[b'HEAD'][0])
+    heading = f.read(sections[b'HEAD'][1])
+    if _crc(raw, heading) != crc :
+        raise Exc.FileFormatError('The heading of this Asgard file is damaged (crc)')
+    
+    return {'Version' : version, 'Byte order' : order.decode('ascii'), 
+            'Dtype' : data_type.rstrip(b'\x00').decode('ascii'), 
+            'Crc' : crc, 'Generation' : _generation(raw), 'Sections' : sections}
+
+
+def pack_heading(heading, data_size=0, data_type='<f4', generation=0, spec_byte=None):
+    """
+    Builds the start of a version 2 file : preamble, heading, then padding 
+    so the spectra, which follow, start at a multiple of ALIGNMENT bytes.
+    
+    Parameters
+    ---------
+    heading : bytes
+        Text heading, from the codes line to 'Spectra\n'.
+    data_size : int
+        Size of the spectra, in bytes.
+    data_type : str
+        numpy dtype of the spectra.
+    generation : int
+        Generation of the file (see WriteLock).
+    spec_byte : int or None
+        Offset of spectra that stay where they are (the heading must end 
+        before it), None to put them right after the heading.
+    
+    Return
+    ------
+    start : bytes
+        Everything before the spectra (len(start) is the spectra offset).
+    """
+    head_end = PREAMBLE_SIZE + len(heading)
+    if spec_byte is None :
+        spec_byte = -(-head_end // ALIGNMENT) * ALIGNMENT
+    elif spec_byte < head_end :
+        raise ValueError('The heading does not fit before the spectra')
+    sections = {b'HEAD' : (PREAMBLE_SIZE, len(heading)), b'DATA' : (spec_byte, data_size)}
+    preamble = _pack_preamble(sections, data_type, 0, generation)
+    preamble = _pack_preamble(sections, data_type, _crc(preamble, heading), generation)
+    return preamble + heading + bytes(spec_byte - head_end)
+
+
+def reseal(f, data_size=None, generation=None):
+    """
+    Recomputes the crc of a version 2 file after its heading was modified
+    in place, and updates the size of the spectra if data_size is given.
+    The preamble is written at once.  Does nothing for version 1 files.
+    
+    Parameters
+    ---------
+    f : file object opened in 'r+b'
+    data_size : int or None
+        New size of the spectra, in bytes.
+    generation : int or None
+        New generation of the file (see WriteLock), kept if None.
+    """
+    f.seek(0)
+    raw = f.read(PREAMBLE_SIZE)
+    if raw[:len(MAGIC)] != MAGIC :
+        return
+    magic, version, order, data_type, amount, crc = unpack(_FIXED, raw[:calcsize(_FIXED)])
+    sections = {}
+    position = calcsize(_FIXED)
+    for i in range(amount) :
+        name, offset, size = unpack(_SECTION, raw[position:position+calcsize(_SECTION)])
+        sections[name] = (offset, size)
+        position += calcsize(_SECTION)
+    if data_size is not None :
+        sections[b'DATA'] = (sections[b'DATA'][0], data_size)
+    if generation is None :
+        generation = _generation(raw)
+    
+    f.seek(sections[b'HEAD'][0])
+    heading = f.read(sections[b'HEAD'][1])
+    data_type = data_type.rstrip(b'\x00').decode('ascii')
+    preamble = _pack_preamble(sections, data_type, 0, generation)
+    f.seek(0)
+    f.write(_pack_preamble(sections, data_type, _crc(preamble, heading), generation))
+    f.flush()
+
+
+def read_generation(f):
+    """
+    Generation of a .asg file : it changes every time a writer modifies the
+    file and is odd while it does (see WriteLock).  Only the preamble is 
+    read, so readers can poll it cheaply.  f must be at the start of the 
+    file, its position is then undefined.
+    
+    Return
+    ------
+    generation : int or None
+        None for version 1 files (and files being created).
+    """
+    raw = f.read(PREAMBLE_SIZE)
+    if len(raw) != PREAMBLE_SIZE or raw[:len(MAGIC)] != MAGIC :
+        return None
+    return _generation(raw)
+
+
+def spec_byte(path):
+    """Offset of the spectra in the .asg file at path (None if empty)"""
+    with open(path, 'rb') as f :
+        return open_heading(f)[0]
+
+
+def read_storage(f, preamble=None):
+    """
+    Reads how the spectra of a .asg file are stored.  f must be at the start
+    of the file, its position is then undefined.  preamble is the one of 
+    the file if already read (see open_heading), it is then not checked 
+    again.
+    
+    Return
+    ------
+    data_type : str
+        numpy dtype of the stored values ('<f4' for version 1 files).
+    scales : numpy 2D array or None
+        (scale, offset) pairs as rows, None for float storages.
+    per_spectrum : bool
+        Whether scales has a row per spectrum, or a single row for the file.
+    """
+    preamble = _checked_preamble(f, preamble)
+    if preamble is None :
+        return '<f4', None, False
+    if preamble['Byte order'] != '<' :
+        raise Exc.FileFormatError('Big-endian Asgard files are not supported')
+    if preamble['Dtype'] not in STORAGES.values() :
+        raise Exc.FileFormatError('Asgard files stored as %s are not supported' %preamble['Dtype'])
+    if b'SCAL' not in preamble['Sections'] :
+        if dtype(preamble['Dtype']).kind in 'iu' :
+            raise Exc.FileFormatError('The scales of this Asgard file are missing')
+        return preamble['Dtype'], None, False
+    
+    offset, size = preamble['Sections'][b'SCAL']
+    f.seek(offset)
+    raw = f.read(size)
+    if len(raw) != size :
+        raise Exc.FileFormatError('Truncated Asgard file')
+    per_spectrum = unpack('<Q', raw[:8])[0] == 1
+    scales = frombuffer(raw[8:], dtype='<f8').reshape([-1, 2])
+    return preamble['Dtype'], scales, per_spectrum
+
+
+def write_footer(path, data_size, sections):
+    """
+    Truncates a version 2 file after its spectra and writes the given 
+    sections after them, then updates the preamble (sizes, offsets, crc).
+    Version 1 files can't have sections : they are left as they are if 
+    there are none to write.
+    
+    Parameters
+    ---------
+    path : str
+        .asg file.
+    data_size : int
+        Size of the spectra, in bytes.
+    sections : dict
+        {name (4 bytes) : content (bytes)}
+    """
+    with open(path, 'r+b') as f :
+        if f.read(len(MAGIC)) != MAGIC :
+            if len(sections) > 0 :
+                raise Exc.FileFormatError('Version 1 Asgard files can not hold sections, save the file first')
+            return
+        f.seek(0)
+        preamble = read_preamble(f)
+        table = {b'HEAD' : preamble['Sections'][b'HEAD'],
+                 b'DATA' : (preamble['Sections'][b'DATA'][0], data_size)}
+        end = table[b'DATA'][0] + data_size
+        f.truncate(end)
+        f.seek(end)
+        for name in sections :
+            table[name] = (f.tell(), len(sections[name]))
+            f.write(sections[name])
+        
+        f.seek(table[b'HEAD'][0])
+        heading = f.read(table[b'HEAD'][1])
+        blank = _pack_preamble(table, preamble['Dtype'], 0, preamble['Generation'])
+        f.seek(0)
+        f.write(_pack_preamble(table, preamble['Dtype'], _crc(blank, heading), preamble['Generation']))
+
+
+def read_chunks(f, preamble=None):
+    """
+    Reads how the spectra of a .asg file are compressed.  f must be at the 
+    start of the file, its position is then undefined.  preamble : as 
+    read_storage.
+    
+    Return
+    ------
+    compression : dict or None
+        'Codec' (str), 'Level' (int or None), 'Shuffle' (bool) and 'Chunk 
+        rows' (int), None if the spectra are not compressed.
+    index : numpy 2D array or None
+        (first spectrum, offset) of each chunk as rows, plus a last row 
+        (amount of spectra, size of the spectra).
+    """
+    preamble = _checked_preamble(f, preamble)
+    if preamble is None or b'CIDX' not in preamble['Sections'] :
+        return None, None
+    
+    offset, size = preamble['Sections'][b'CIDX']
+    f.seek(offset)
+    raw = f.read(size)
+    if len(raw) != size or size < calcsize(_CHUNKS) + 16 :
+        raise Exc.FileFormatError('Truncated Asgard file')
+    codec, level, shuffle, chunk_rows = unpack(_CHUNKS, raw[:calcsize(_CHUNKS)])
+    codec = codec.rstrip(b'\x00').decode('ascii')
+    if codec not in CODECS :
+        raise Exc.FileFormatError('Asgard files compressed with %s are not supported' %codec)
+    compression = {'Codec' : codec, 'Level' : None if level < 0 else level, 
+                   'Shuffle' : shuffle == 1, 'Chunk rows' : chunk_rows or None}
+    index = frombuffer(raw[calcsize(_CHUNKS):], dtype='<u8').reshape([-1, 2]).astype(uint64)
+    return compression, index
+
+
+def read_checksums(f, preamble=None):
+    """
+    Reads the checksums of the spectra of a .asg file.  f must be at the 
+    start of the file, its position is then undefined.  preamble : as 
+    read_storage.
+    
+    Return
+    ------
+    crcs : numpy 1D array or None
+        CRC32 of each chunk of stored spectra, None if the file has none 
+        (version 1 files and files written before checksums).
+    rows : int or None
+        Spectra per chunk (None for the chunks of compressed spectra).
+    """
+    preamble = _checked_preamble(f, preamble)
+    if preamble is None or b'CRCS' not in preamble['Sections'] :
+        return None, None
+    
+    offset, size = preamble['Sections'][b'CRCS']
+    f.seek(offset)
+    raw = f.read(size)
+    if len(raw) != size or size < 8 :
+        raise Exc.FileFormatError('Truncated Asgard file')
+    rows = unpack('<Q', raw[:8])[0]
+    return frombuffer(raw[8:], dtype='<u4').astype(uint32), rows or None
+
+
+def _checked_preamble(f, preamble):
+    """The preamble given, else the one of f, read and checked (None for version 1 files)"""
+    if preamble is not None :
+        return preamble
+    if f.read(len(MAGIC)) != MAGIC :
+        return None
+    f.seek(0)
+    return read_preamble(f)
+
+
+def chunk_crcs(path, offset, ranges, workers=None):
+    """
+    CRC32 of ranges of bytes of a file, each read (in a pool of threads) 
+    and discarded once its crc is known.  Ranges past the end of the file 
+    get the crc of what could be read.
+    
+    Parameters
+    ---------
+    path : str
+    offset : int
+        Offset of the ranges in the file (i.e. of the spectra).
+    ranges : list of (start, end)
+        Byte ranges, relative to offset, end excluded.
+    workers : int or None
+        Threads reading the file (None : one per processor, up to 8).
+    
+    Return
+    ------
+    crcs : list of int
+    """
+    def checksum(byte_range):
+        with open(path, 'rb') as f :
+            f.seek(offset + byte_range[0])
+            return crc32(f.read(byte_range[1] - byte_range[0]))
+    
+    if workers is None :
+        workers = min(8, cpu_count() or 1)
+    if workers <= 1 or len(ranges) <= 1 :
+        return [checksum(byte_range) for byte_range in ranges]
+    with ThreadPoolExecutor(max_workers=workers) as pool :
+        return list(pool.map(checksum, ranges))
+
+
+def pack_scales(scales, per_spectrum):
+    """Content of the 'SCAL' section"""
+    return pack('<Q', int(per_spectrum)) + asarray(scales, dtype='<f8').tobytes()
+
+
+def pack_chunks(compression, index):
+    """Content of the 'CIDX' section"""
+    level = -1 if compression['Level'] is None else compression['Level']
+    return (pack(_CHUNKS, compression['Codec'].encode('ascii'), level, 
+                 int(compression['Shuffle']), compression['Chunk rows'] or 0) 
+            + asarray(index, dtype='<u8').tobytes())
+
+
+def pack_checksums(crcs, rows):
+    """Content of the 'CRCS' section"""
+    return pack('<Q', rows or 0) + asarray(crcs, dtype='<u4').tobytes()
+
+
+def codec(name):
+    """
+    Compression functions of a codec, lz4 and zstd being imported only when
+    used.
+    
+    Return
+    ------
+    compress : function(data, level)
+        level can be None (codec default).
+    decompress : function(data)
+    
+    Raises InputError for an unknown codec and FileFormatError when its 
+    package is missing.
+    """
+    if name == 'zlib' :
+        import zlib
+        def compress(data, level):
+            return zlib.compress(data, 6 if level is None else level)
+        return compress, zlib.decompress
+    
+    if name == 'lz4' :
+        try :
+            import lz4.block
+        except ImportError :
+            raise Exc.FileFormatError('lz4 compression requires the lz4 package (pip install lz4)')
+        def compress(data, level):
+            if level is None or level <= 0 :
+                return lz4.block.compress(data)
+            return lz4.block.compress(data, mode='high_compression', compression=level)
+        return compress, lz4.block.decompress
+    
+    if name == 'zstd' :
+        try :
+            import zstandard
+        except ImportError :
+            raise Exc.FileFormatError('zstd compression requires the zstandard package (pip install zstandard)')
+        def compress(data, level):
+            return zstandard.ZstdCompressor(level=3 if level is None else level).compress(data)
+        def decompress(data):
+            return zstandard.ZstdDecompressor().decompress(data)
+        return compress, decompress
+    
+    raise Exc.InputError('Unknown compression %s, choose from %s' %(name, ', '.join(CODECS)))
+
+
+def shuffle(stored):
+    """Bytes of stored values, grouped by position in the value (byte-shuffle)"""
+    raw = frombuffer(stored.tobytes(), dtype=uint8)
+    return raw.reshape([-1, stored.dtype.itemsize]).T.tobytes()
+
+
+def unshuffle(raw, data_type):
+    """Reverse of shuffle, returns the values as a 1D array"""
+    raw = frombuffer(raw, dtype=uint8)
+    return raw.reshape([dtype(data_type).itemsize, -1]).T.copy().view(data_type).ravel()
+
+
+class Encoder :
+    """
+    Converts float32 spectra to the bytes of a storage dtype.  float16 keeps
+    about 3 significant digits and values up to 65504.  int16 and uint16 
+    store (value - offset)/scale, rounded : with a scale, the same (scale, 
+    offset) is used for the whole file, without (None), every spectrum gets
+    its own, from its minimum and maximum, unless their table is given (to
+    rewrite the same spectra).
+    
+    With a compression, the stored spectra are grouped in chunks of 
+    'Chunk rows' spectra (CHUNK_SIZE bytes if None), compressed as each 
+    chunk is full : encode returns only the complete chunks, flush the last
+    one.  chunk_index then gives the 'CIDX' index of the chunks.
+    
+    The crc of the chunks written is kept (see Checksums and crc_table).
+    
+    Inputs
+    ---------
+    data_type : str
+        numpy dtype of the storage (see STORAGES).
+    scale, offset : float
+        For int16/uint16, scale and offset of the whole file.
+    table : numpy 2D array
+        For int16/uint16, (scale, offset) of each spectrum to encode, in order.
+    compression : dict or None
+        'Codec', 'Level', 'Shuffle' and 'Chunk rows' (see read_chunks).
+    checksums : Checksums or None
+        Checksums of the spectra already in the file, to append to it.
+    """
+    def __init__(self, data_type='<f4', scale=None, offset=0., table=None, compression=None, 
+                 checksums=None):
+        self.dtype = dtype(data_type)
+        self.scale = scale
+        self.offset = offset
+        self.table_ = table
+        self.per_spectrum = self.dtype.kind in 'iu' and scale is None
+        self.tables = []
+        self.done = 0
+        
+        self.compression = None if compression is None else dict(compression)
+        if self.compression is not None :
+            self.compress = codec(self.compression['Codec'])[0]
+        self.pending = []
+        self.index = [[0, 0]]
+        
+        self.checksums = checksums
+        if checksums is None and self.compression is not None :
+            self.checksums = Checksums(rows=0)
+    
+    def encode(self, block):
+        """block : spectra as rows (2D), returns the bytes to write"""
+        return self.pack(self.store(block))
+    
+    def pack(self, stored):
+        """Bytes to write for spectra already converted by store (2D)"""
+        if self.compression is None :
+            data = stored.tobytes()
+            if self.checksums is None and stored.shape[0] > 0 :
+                self.checksums = Checksums(row_size=stored.shape[1]*stored.dtype.itemsize)
+            if self.checksums is not None :
+                self.checksums.update(data)
+            return data
+        if self.compression['Chunk rows'] is None and stored.shape[0] > 0 :
+            row_size = max(stored.shape[1]*stored.dtype.itemsize, 1)
+            self.compression['Chunk rows'] = max(CHUNK_SIZE // row_size, 1)
+        
+        self.pending.append(stored)
+        rows = sum(part.shape[0] for part in self.pending)
+        chunks = []
+        while self.compression['Chunk rows'] is not None and rows >= self.compression['Chunk rows'] :
+            pending = concatenate(self.pending)
+            chunks.append(self._chunk(pending[:self.compression['Chunk rows']]))
+            self.pending = [pending[self.compression['Chunk rows']:]]
+            rows -= self.compression['Chunk rows']
+        return b''.join(chunks)
+    
+    def flush(self):
+        """Bytes of the last, incomplete chunk (b'' without compression)"""
+        if self.compression is None or sum(part.shape[0] for part in self.pending) == 0 :
+            return b''
+        chunk = self._chunk(concatenate(self.pending))
+        self.pending = []
+        return chunk
+    
+    def chunk_index(self):
+        """(first spectrum, offset) of the chunks written, None without compression"""
+        if self.compression is None :
+            return None
+        return asarray(self.index, dtype=uint64).reshape([-1, 2])
+    
+    def crc_table(self):
+        """(crcs, rows per chunk) of the spectra written, see read_checksums"""
+        if self.checksums is None :
+            return zeros(0, dtype=uint32), None
+        return self.checksums.table()
+    
+    def _chunk(self, stored):
+        """Compresses a chunk of stored spectra, updates the index"""
+        if self.compression['Shuffle'] is True :
+            raw = shuffle(stored)
+        else :
+            raw = stored.tobytes()
+        chunk = self.compress(raw, self.compression['Level'])
+        self.checksums.add(chunk)
+        self.index.append([self.index[-1][0] + stored.shape[0], self.index[-1][1] + len(chunk)])
+        return chunk
+    
+    def store(self, block):
+        """Spectra (2D) as stored values, not compressed"""
+        block = asarray(block, dtype=float32)
+        if self.dtype.kind == 'f' :
+            with errstate(over='ignore') :
+                stored = block.astype(self.dtype)
+            if self.dtype != dtype('<f4') and isinf(stored).any() and not isinf(block).any() :
+                raise Exc.InputError('Spectra exceed the range of %s, use another storage' %self.dtype.name)
+            return stored
+        
+        if block.shape[0] == 0 :
+            return block.astype(self.dtype)
+        limits = iinfo(self.dtype)
+        if self.per_spectrum is True :
+            if self.table_ is not None :
+                table = asarray(self.table_[self.done:self.done+block.shape[0]], dtype=float64)
+                scale = table[:, 0]
+                offset = table[:, 1]
+            else :
+                low = block.min(axis=1).astype(float64)
+                high = block.max(axis=1).astype(float64)
+                scale = (high - low) / (limits.max - limits.min)
+                scale[scale == 0] = 1.
+                offset = low - limits.min*scale
+            self.tables.append(stack([scale, offset], axis=1))
+            self.done += block.shape[0]
+            scale = scale.reshape([-1, 1])
+            offset = offset.reshape([-1, 1])
+        else :
+            scale = self.scale
+            offset = self.offset
+        stored = rint((block - offset) / scale)
+        if stored.min() < limits.min or stored.max() > limits.max :
+            raise Exc.InputError('Spectra exceed the range of %s with a scale of %s and an offset of %s' 
+                                 %(self.dtype.name, self.scale, self.offset))
+        return stored.astype(self.dtype)
+    
+    def table(self):
+        """(scale, offset) pairs of what was encoded, None for float storages"""
+        if self.dtype.kind == 'f' :
+            return None
+        if self.per_spectrum is True :
+            if len(self.tables) == 0 :
+                return zeros([0, 2])
+            return concatenate(self.tables)
+        return asarray([[self.scale, self.offset]], dtype=float64)
+
+
+def decode(stored, scales, rows=None):
+    """
+    Stored values to float32.
+    
+    Parameters
+    ---------
+    stored : numpy array
+        Values as stored : a spectrum (1D), a pixel of many spectra (1D, 
+        rows given) or spectra as rows (2D).
+    scales : numpy 2D array or None
+        (scale, offset) of the file (1 row) or of the spectra read.
+    rows : numpy 1D array, slice or None
+        Index of the spectra read, for scales given per spectrum.
+    """
+    result = stored.astype(float32, copy=False)
+    if scales is None :
+        return result
+    if rows is not None :
+        scales = scales[rows]
+    scale = scales[:, 0].astype(float32)
+    offset = scales[:, 1].astype(float32)
+    if result.ndim == 2 :
+        scale = scale.reshape([-1, 1])
+        offset = offset.reshape([-1, 1])
+    return result*scale + offset
+
+
+class Checksums :
+    """
+    CRC32 of the stored spectra of a file, chunk by chunk, computed as they
+    are written.  Uncompressed spectra are cut in chunks of rows spectra, 
+    each chunk of compressed spectra (rows of 0) gets its own crc.
+    
+    Inputs
+    ---------
+    rows : int or None
+        Spectra per chunk, 0 for compressed spectra.  If None, chunks hold
+        about CHUNK_SIZE bytes.
+    row_size : int
+        Size of a stored spectrum, in bytes.
+    crcs : list or numpy 1D array
+        Checksums of the spectra already in the file, to append to it.
+    amount : int
+        Amount of spectra already in the file.
+    """
+    def __init__(self, rows=None, row_size=0, crcs=None, amount=0):
+        if rows is None :
+            rows = max(CHUNK_SIZE // max(row_size, 1), 1)
+        self.rows = rows
+        self.row_size = row_size
+        self.crcs = [] if crcs is None else [int(crc) for crc in crcs]
+        self.filled = 0 #bytes in the last chunk
+        if rows > 0 :
+            self.filled = (amount % rows)*row_size
+    
+    def update(self, data):
+        """Uncompressed spectra : data are the bytes of the next spectra"""
+        size = self.rows*self.row_size
+        data = memoryview(data)
+        position = 0
+        while position < len(data) :
+            if self.filled == 0 :
+                self.crcs.append(0)
+            step = min(size - self.filled, len(data) - position)
+            self.crcs[-1] = crc32(data[position:position+step], self.crcs[-1])
+            self.filled = (self.filled + step) % size
+            position += step
+    
+    def add(self, chunk):
+        """Compressed spectra : chunk is the next compressed chunk"""
+        self.crcs.append(crc32(chunk))
+    
+    def table(self):
+        """(crcs, rows per chunk), see read_checksums"""
+        return asarray(self.crcs, dtype=uint32), self.rows or None
+
+
+class ChunkReader :
+    """
+    Reads the spectra of a compressed .asg file.  Reading a spectrum 
+    decompresses only its chunk, the last decompressed chunks are kept (LRU
+    cache) for the next ones.  blocks decompresses the chunks ahead in 
+    threads (zlib, lz4 and zstd release the GIL).  Chunks are checked 
+    against their crc when it is given.
+    
+    Inputs
+    ---------
+    path : str
+        .asg file.
+    spec_byte : int
+        Offset of the spectra.
+    compression : dict
+        See read_chunks.
+    index : numpy 2D array
+        Chunk index, see read_chunks.
+    data_type : str
+        numpy dtype of the stored values.
+    spec_len : int
+        Length of the spectra (stored values per row).
+    cache : int
+        Amount of decompressed chunks kept.
+    crcs : numpy 1D array or None
+        CRC32 of each compressed chunk (see read_checksums).
+    """
+    def __init__(self, path, spec_byte, compression, index, data_type, spec_len, cache=8, crcs=None):
+        self.path = path
+        self.spec_byte = spec_byte
+        self.compression = compression
+        self.index = asarray(index, dtype=uint64)
+        self.dtype = dtype(data_type)
+        self.spec_len = spec_len
+        self.cache = cache
+        self.crcs = crcs
+        self.decompress = codec(compression['Codec'])[1]
+        self.chunks = OrderedDict()
+        self.lock = Lock()
+    
+    def __len__(self):
+        """Amount of chunks"""
+        return self.index.shape[0] - 1
+    
+    def chunk_of(self, row):
+        """Number of the chunk holding spectrum row"""
+        return int(searchsorted(self.index[:-1, 0], uint64(row), side='right')) - 1
+    
+    def chunk(self, number):
+        """Stored spectra of a chunk (2D, read-only), through the cache"""
+        with self.lock :
+            if number in self.chunks :
+                self.chunks.move_to_end(number)
+                return self.chunks[number]
+        stored = self.load(number)
+        stored.flags.writeable = False #shared by every read of the chunk
+        with self.lock :
+            self.chunks[number] = stored
+            while len(self.chunks) > self.cache :
+                self.chunks.popitem(last=False)
+        return stored
+    
+    def load(self, number):
+        """Reads and decompresses a chunk, without the cache"""
+        start = int(self.index[number, 1])
+        size = int(self.index[number+1, 1]) - start
+        rows = int(self.index[number+1, 0] - self.index[number, 0])
+        with open(self.path, 'rb') as f :
+            f.seek(self.spec_byte + start)
+            raw = f.read(size)
+        if len(raw) != size :
+            raise Exc.FileFormatError('Truncated Asgard file')
+        if self.crcs is not None and crc32(raw) != self.crcs[number] :
+            raise Exc.FileFormatError('Chunk %s of this Asgard file is damaged (crc)' %number)
+        try :
+            raw = self.decompress(raw)
+        except Exception as e :
+            raise Exc.FileFormatError('Chunk %s of this Asgard file is damaged (%s)' %(number, e))
+        if len(raw) != rows*self.spec_len*self.dtype.itemsize :
+            raise Exc.FileFormatError('Chunk %s of this Asgard file is damaged (size)' %number)
+        if self.compression['Shuffle'] is True :
+            stored = unshuffle(raw, self.dtype)
+        else :
+            stored = frombuffer(raw, dtype=self.dtype)
+        return stored.reshape([rows, self.spec_len])
+    
+    def read(self, row):
+        """Stored values of a spectrum (1D)"""
+        number = self.chunk_of(row)
+        return self.chunk(number)[row - int(self.index[number, 0])]
+    
+    def rows(self, first, last):
+        """Stored spectra first to last (excluded) as rows (2D)"""
+        if last <= first :
+            return zeros([0, self.spec_len], dtype=self.dtype)
+        parts = []
+        for number in range(self.chunk_of(first), self.chunk_of(last - 1) + 1) :
+            start = int(self.index[number, 0])
+            stored = self.chunk(number)
+            parts.append(stored[max(first - start, 0):last - start])
+        if len(parts) == 1 :
+            return parts[0]
+        return concatenate(parts)
+    
+    def blocks(self, first=0, last=None, workers=4):
+        """
+        Generator of (first spectrum, stored spectra as rows) chunk by chunk,
+        from spectrum first to last (excluded).  With more than one worker,
+        the next chunks are decompressed in a thread pool while the current
+        one is used (2 per worker at most).  The cache is left as it is.
+        """
+        if last is None :
+            last = int(self.index[-1, 0])
+        if last <= first :
+            return
+        numbers = range(self.chunk_of(first), self.chunk_of(last - 1) + 1)
+        
+        def trimmed(number, stored):
+            start = int(self.index[number, 0])
+            low = max(first - start, 0)
+            high = min(last - start, stored.shape[0])
+            return start + low, stored[low:high]
+        
+        if workers is None or workers <= 1 or len(numbers) == 1 :
+            for number in numbers :
+                with self.lock :
+                    stored = self.chunks.get(number)
+                if stored is None :
+                    stored = self.load(number)
+                yield trimmed(number, stored)
+            return
+        
+        with ThreadPoolExecutor(max_workers=workers) as pool :
+            queue = []
+            numbers = iter(numbers)
+            for number in numbers :
+                queue.append((number, pool.submit(self.load, number)))
+                if len(queue) >= 2*workers :
+                    break
+            while len(queue) > 0 :
+                number, future = queue.pop(0)
+                stored = future.result()
+                following = next(numbers, None)
+                if following is not None :
+                    queue.append((following, pool.submit(self.load, following)))
+                yield trimmed(number, stored)
+
+
+class WriteLock :
+    """
+    Advisory lock of the single writer of a file : a lock file (path.lock)
+    locked with flock (fcntl) or, on Windows, msvcrt.locking.  Writers 
+    take it before modifying the file, readers never do : they see the 
+    generation of the file (see read_generation), odd while it is being 
+    written, and keep what they read until it is even again.
+    
+    The lock file is removed when the lock is released.  A lock file 
+    replaced while waiting for it is locked again.
+    
+    Inputs
+    ---------
+    path : str
+        File to write.
+    
+    Attributes
+    ---------
+    path : str
+        Lock file.
+    locked : bool
+        Whether this object holds the lock.
+    """
+    def __init__(self, path):
+        self.path = path + '.lock'
+        self._file = None
+    
+    @property
+    def locked(self):
+        return self._file is not None
+    
+    def acquire(self, timeout=0):
+        """
+        Takes the lock, waiting at most timeout seconds (None : forever) for
+        another writer to release it.  Raises FileLockedError otherwise.
+        """
+        if self._file is not None :
+            return
+        start = perf_counter()
+        while True :
+            f = open(self.path, 'a+b')
+            if self._lock(f) is True :
+                try :
+                    same = (stat(self.path).st_ino == fstat(f.fileno()).st_ino)
+                except FileNotFoundError :
+                    same = False
+                if same is True :
+                    self._file = f
+                    return
+                self._unlock(f)
+            f.close()
+            if timeout is not None and perf_counter() - start >= timeout :
+                raise Exc.FileLockedError('%s is being written by another program' %self.path[:-5])
+            sleep(0.05)
+    
+    def release(self):
+        """Releases the lock (does nothing if it is not held)"""
+        if self._file is None :
+            return
+        try :
+            remove(self.path)
+        except OSError : #opened by a waiting writer (Windows)
+            pass
+        self._unlock(self._file)
+        self._file.close()
+        self._file = None
+    
+    @staticmethod
+    def _lock(f):
+        """Locks an opened lock file without waiting, returns whether it worked"""
+        try :
+            if os_name == 'nt' :
+                import msvcrt
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            else :
+                import fcntl
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError :
+            return False
+        return True
+    
+    @staticmethod
+    def _unlock(f):
+        """Unlocks a lock file locked by _lock"""
+        if os_name == 'nt' :
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else :
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _pack_preamble(sections, data_type, crc, generation=0):
+    """Preamble as PREAMBLE_SIZE bytes"""
+    if len(sections) > _MAX_SECTIONS :
+        raise Exc.FileFormatError('Too many sections for an Asgard file')
+    preamble = pack(_FIXED, MAGIC, VERSION, b'<', data_type.encode('ascii'), len(sections), crc)
+    for name in sections :
+        preamble += pack(_SECTION, name, sections[name][0], sections[name][1])
+    end = PREAMBLE_SIZE - calcsize(_GENERATION)
+    return preamble + bytes(end - len(preamble)) + pack(_GENERATION, generation)
+
+
+def _generation(preamble):
+    """Generation written at the end of a preamble"""
+    return unpack(_GENERATION, preamble[PREAMBLE_SIZE-calcsize(_GENERATION):PREAMBLE_SIZE])[0]
+
+
+def _crc(preamble, heading):
+    """CRC32 of a preamble (its crc field counted as 0) and of the heading"""
+    fixed = calcsize(_FIXED)
+    crc = crc32(preamble[:fixed-4] + bytes(4) + preamble[fixed:])
+    return crc32(heading, crc)
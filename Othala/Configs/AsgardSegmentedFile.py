@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+
+"""
+Othala.Configs.AsgardSegmentedFile.py
+Created : 2026-10-19
+Last update : 2026-10-19
+MIT License
+
+Copyright (c) 2022 Benjamin Charron (CharronB12), Jean-François Masson (SPRBiosensors), Université de Montréal
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+
+Package requirements
+---------------------
+numpy
+
+
+Layout of a segmented dataset (folder)
+------
+manifest.asgv          virtual dataset (see AsgardVirtualFile) listing the segments,
+                       with the settings of the dataset before its members :
+                           Segment size\t<bytes of stored spectra per segment>
+                           Segment seconds\t<seconds per segment or None>
+                           Segment storage\t<storage of the segments>
+                           Segment compression\t<codec of the closed segments or None>
+                           Segment level\t<compression level or None>
+                           Opened\t<time the live segment was created, or None>
+segment_000000.asg     segments, in order.  Only the last one (live) is appended to,
+segment_000001.asg     the others (closed) never change unless compressed or archived.
+...
+
+The manifest is a valid .asgv file : the dataset can also be read with
+AsgVirtualFile (or moved with its folder).
+
+
+Content
+------
+class AsgSegmentedFile(folder, segment_size=None, segment_seconds=None, storage=None, compression=None,
+                       level=None, replace=False)
+    Dataset growing for days, written in fixed size .asg segments
+
+"""
+
+from . import Exceptions as Exc
+from .AsgardFile import AsgFile
+from .AsgardVirtualFile import AsgVirtualFile
+from . import AsgardFileFormat as aff
+
+from numpy import asarray, float32, dtype
+
+from os import makedirs
+from os.path import abspath, join, basename, isfile
+from shutil import move
+from time import time
+
+
+MANIFEST = 'manifest.asgv'
+SEGMENT = 'segment_%06d.asg'
+
+
+class AsgSegmentedFile(AsgVirtualFile) :
+    """
+    Segmented dataset : a single dataset that grows for days, written in a
+    folder of .asg segments listed by a manifest (see AsgardVirtualFile).
+    Spectra are appended to the last segment (live) until it holds
+    segment_size bytes of spectra, or has been open for segment_seconds,
+    then a new segment is started.  Appending patches the live segment and
+    replaces the manifest at once, so no file is ever rewritten and readers
+    never see a partial manifest.
+    
+    Readers see one contiguous index space ([rows, columns], iteration,
+    iter_blocks, labels, as AsgVirtualFile).  Closed segments can be
+    compressed or moved elsewhere (archived) without touching the live one.
+    Readers in other processes call refresh() to see new spectra.
+    
+    Inputs
+    ---------
+    folder : str
+        Folder of the dataset, created if needed.  An existing dataset is
+        loaded and appending continues in its live segment.
+    segment_size : int or None
+        Bytes of stored spectra per segment (1 GB if None for a new dataset).
+    segment_seconds : float or None
+        Seconds after which the live segment is closed at the next append.
+    storage : str or None
+        Storage of the segments ('float32', 'float16', 'int16' or 'uint16',
+        see AsgFile.convert_data), 'float32' if None for a new dataset.
+    compression : 'zlib', 'lz4', 'zstd' or None
+        If given, segments are compressed when they are closed.
+    level : int or None
+        Compression level of the closed segments.
+    replace : bool
+        Whether to start an empty dataset even if the folder holds one.
+    
+    Attributes
+    ---------
+    As AsgVirtualFile, and :
+    folder : str
+        Folder of the dataset.
+    segment_size, segment_seconds, storage, compression, level :
+        Settings of the dataset (saved in its manifest).
+    opened : float or None
+        Time (time.time()) at which the live segment was created, None if
+        every segment is closed.
+    
+    Methods
+    ---------
+    As AsgVirtualFile, and :
+    append(spectra, label=None)
+        Appends spectra to the live segment, rolling over when it is full.
+    roll()
+        Closes the live segment (next spectra start a new one).
+    compress_segment(number, compression='zstd', level=None)
+        Compresses a closed segment.
+    archive(number, folder)
+        Moves a closed segment to another folder.
+    refresh()
+        Reads the manifest again, to see the spectra appended by a writer.
+    """
+    def __init__(self, folder, segment_size=None, segment_seconds=None, storage=None, compression=None,
+                 level=None, replace=False):
+        self.folder = abspath(folder)
+        makedirs(self.folder, exist_ok=True)
+        self.segment_size = 2**30
+        self.segment_seconds = None
+        self.storage = 'float32'
+        self.compression = None
+        self.level = None
+        self.opened = None
+        super().__init__(join(self.folder, MANIFEST), replace=replace)
+        
+        #given settings replace the saved ones
+        if segment_size is not None :
+            self.segment_size = int(segment_size)
+        if segment_seconds is not None :
+            self.segment_seconds = float(segment_seconds)
+        if storage is not None :
+            AsgFile._storage_type(storage)
+            self.storage = storage
+        if compression is not None :
+            AsgFile._compression(compression)
+            self.compression = compression
+            self.level = level
+    
+    def append(self, spectra, label=None):
+        """
+        Appends spectra at the end of the dataset.  They go to the live
+        segment, split over new segments whenever it is full (or open for
+        too long), then the manifest is replaced.  Appending many spectra at
+        once is faster than one at a time.
+        
+        Inputs
+        --------
+        spectra : numpy array
+            Spectra as rows (or a single spectrum as 1D array).
+        label : str or None
+            Label of all the spectra appended.
+        
+        Raises FileLockedError if another program is appending to the dataset.
+        """
+        lock = aff.WriteLock(self.path)
+        lock.acquire(timeout=0)
+        try :
+            self._append(spectra, label)
+        finally :
+            lock.release()
+    
+    def _append(self, spectra, label):
+        """append, once the manifest is locked"""
+        block = asarray(spectra, dtype=float32)
+        if block.ndim == 1 :
+            block = block.reshape([1, -1])
+        if self*'Spec len' is None :
+            self.Asgard_param['Spec len'] = block.shape[1]
+        elif block.shape[1] != self*'Spec len' :
+            raise Exc.FileFormatError('Spectra to append have a different length of spectrum')
+        
+        if self.opened is not None :
+            self._live()
+            self._update()
+        start = self*'Spec amount'
+        capacity = self._capacity()
+        first = 0
+        while first < block.shape[0] :
+            if self.opened is not None and (self.members[-1]['Stop'] >= capacity or 
+                (self.segment_seconds is not None and time() - self.opened >= self.segment_seconds)) :
+                self.roll(save=False)
+            
+            if self.opened is None :
+                count = min(capacity, block.shape[0] - first)
+                self._new_segment(block[first:first+count])
+            else :
+                member = self._live()
+                count = min(capacity - member['Stop'], block.shape[0] - first)
+                self._open(len(self.members) - 1).append(block[first:first+count])
+                member['Stop'] += count
+            first += count
+            self._update()
+        if self.opened is not None and self.members[-1]['Stop'] >= capacity :
+            self.roll(save=False)
+        
+        if label is not None and block.shape[0] > 0 :
+            for key in list(self.labels) :
+                low, high = [int(i) for i in key.split('-')]
+                if high == start and self.labels[key] == label :
+                    del self.labels[key]
+                    start = low
+            self.labels['%s-%s' %(start, self*'Spec amount')] = label
+        self.save()
+    
+    def roll(self, save=True):
+        """
+        Closes the live segment : the next spectra appended start a new one.
+        The closed segment is compressed if the dataset has a compression.
+        Call it once an acquisition is done.
+        """
+        if self.opened is None :
+            return
+        self.opened = None
+        if self.compression is not None :
+            self._open(len(self.members) - 1).compress(self.compression, self.level)
+        if save is True :
+            self.save()
+    
+    def compress_segment(self, number, compression='zstd', level=None):
+        """
+        Compresses a closed segment (see AsgFile.compress).  Readers of the
+        dataset in other processes must refresh() afterwards.
+        
+        Inputs
+        --------
+        number : int
+            Position of the segment in the dataset (members).
+        compression : 'zlib', 'lz4' or 'zstd'
+        level : int or None
+            Compression level.
+        """
+        self._closed(number)
+        self._open(number).compress(compression, level)
+    
+    def archive(self, number, folder):
+        """
+        Moves a closed segment to another folder (i.e. slower storage) and
+        updates the manifest.  Readers of the dataset in other processes
+        must refresh() afterwards.
+        
+        Inputs
+        --------
+        number : int
+            Position of the segment in the dataset (members).
+        folder : str
+            Destination folder, created if needed.
+        """
+        self._closed(number)
+        makedirs(folder, exist_ok=True)
+        destination = abspath(join(folder, basename(self.members[number]['Path'])))
+        if isfile(destination) is True :
+            raise Exc.FileNameError('%s already exists' %destination)
+        move(self.members[number]['Path'], destination)
+        self.members[number]['Path'] = destination
+        self._files.pop(number, None)
+        self.save()
+    
+    def refresh(self):
+        """
+        Reads the manifest again : spectra appended (and segments compressed
+        or archived) by the writer of the dataset since it was loaded become
+        readable.  Segments are opened again when next read.
+        """
+        self.members = []
+        self.labels = {}
+        self._files = {}
+        self._load()
+    
+    def _capacity(self):
+        """Spectra per segment"""
+        itemsize = dtype(aff.STORAGES.get(self.storage, self.storage)).itemsize
+        return max(1, self.segment_size // (self*'Spec len'*itemsize))
+    
+    def _new_segment(self, block):
+        """Writes the first spectra of a new live segment and adds it to the members"""
+        path = join(self.folder, SEGMENT %len(self.members))
+        asg = AsgFile(path, replace=True)
+        asg.append(block, storage=self.storage)
+        self._files[len(self.members)] = asg
+        self.members.append({'Path' : asg.path, 'First' : 0, 'Stop' : asg*'Spec amount', 'Label' : None})
+        self.opened = time()
+    
+    def _live(self):
+        """
+        Member of the live segment.  Spectra it got after the manifest was
+        last saved (i.e. an interrupted writer) are added to the dataset.
+        """
+        member = self.members[-1]
+        asg = self._open(len(self.members) - 1)
+        asg.refresh()
+        member['Stop'] = asg*'Spec amount'
+        return member
+    
+    def _closed(self, number):
+        """Makes sure a segment exists and is closed"""
+        if number < 0 or number >= len(self.members) :
+            raise IndexError('segment %s is out of bound for %s segments' %(number, len(self.members)))
+        if self.opened is not None and number == len(self.members) - 1 :
+            raise Exc.WrongMethodError('The live segment can not be modified, roll() it first.')
+    
+    def _settings(self):
+        """Settings of the dataset, saved in the manifest"""
+        return {'Segment size' : self.segment_size, 'Segment seconds' : self.segment_seconds,
+                'Segment storage' : self.storage, 'Segment compression' : self.compression,
+                'Segment level' : self.level, 'Opened' : self.opened}
+    
+    def _read_settings(self, settings):
+        """Reads the settings of the dataset from the manifest"""
+        def value(key, kind):
+            text = settings.get(key, 'None')
+            return None if text == 'None' else kind(text)
+        self.segment_size = value('Segment size', int) or self.segment_size
+        self.segment_seconds = value('Segment seconds', float)
+        self.storage = value('Segment storage', str) or self.storage
+        self.compression = value('Segment compression', str)
+        self.level = value('Segment level', int)
+        self.opened = value('Opened', float)
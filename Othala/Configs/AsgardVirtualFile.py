@@ -0,0 +1,467 @@
+# -*- coding: utf-8 -*-
+
+"""
+Othala.Configs.AsgardVirtualFile.py
+Created : 2026-10-19
+Last update : 2026-10-19
+MIT License
+
+Copyright (c) 2022 Benjamin Charron (CharronB12), Jean-François Masson (SPRBiosensors), Université de Montréal
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+
+Package requirements
+---------------------
+numpy
+
+
+Layout of a .asgv file (text, utf-8)
+------
+Asgard Virtual Dataset
+Version\t1
+Spec len\t<length of the spectra>
+Axis\t<[values] or None>
+<key>\t<value>                                settings of subclasses (see AsgardSegmentedFile)
+Members
+<path>\t<first>\t<stop>\t<label or None>      one line per member, rows first to stop (excluded)
+Labels
+<start>-<end>\t<label>                        one line per labelled range, in global indexes
+
+Member paths are relative to the .asgv file when the member is in its 
+folder (or below), absolute otherwise.
+
+
+Content
+------
+class AsgVirtualFile(file_path, replace=False)
+    Rows of many .asg files read as a single dataset, without copying them
+
+"""
+
+from . import Exceptions as Exc
+from .AsgardFile import AsgFile
+
+from numpy import asarray, int64, concatenate, searchsorted, integer, zeros, float32
+
+from os.path import isfile, abspath, dirname, basename, join, relpath, isabs
+from os import replace as replace_file
+
+
+EXTENSION = '.asgv'
+VERSION = 1
+
+
+class AsgVirtualFile :
+    """
+    Virtual dataset : rows of many .asg files (members) read as a single 
+    AsgardFile, without copying their spectra.  A global index is mapped 
+    to its member through the prefix sum of the amount of spectra of the 
+    members (offsets), so building a dataset only reads the headings of
+    its members, and reading a spectrum only opens its member.
+    
+    Reads follow AsgFile : [rows, columns] (int or slice), iteration, 
+    iter_blocks, *'param', labels, good, identity and get_label, so a 
+    virtual dataset can be exported (see AsgardFileExport.export) or used
+    for training like a .asg file.  Its spectra can not be modified.
+    
+    Inputs
+    ---------
+    file_path : str
+        .asgv file, loaded if it exists (the extension is added if missing).
+    replace : bool
+        Whether to start an empty dataset even if file_path exists.
+    
+    Attributes
+    ---------
+    path : str
+        .asgv file.
+    name : str
+        Name of the .asgv file with extension.
+    members : list of dict
+        'Path' (absolute), 'First' and 'Stop' (rows of the member, stop 
+        excluded) and 'Label' (label of all its rows, or None).
+    offsets : numpy 1D array
+        Global index of the first spectrum of each member, then the amount
+        of spectra.
+    Asgard_param : dict
+        'Spec len', 'Spec amount' and 'Axis' (of the first member with one,
+        unless assigned).
+    labels : dict
+        Class ranges in global indexes as {'0-2000' : 'Dopamine'}, end 
+        excluded, from the labels of the members or given when added.
+    good : list of int
+        Good spectra of the members, in global indexes.
+    identity : list of str
+        Identity of the good spectra, if all the members have theirs.
+    shape : tuple
+        (Spec len, Spec amount), as AsgFile.
+    
+    Methods
+    ---------
+    add(file_path, first=0, stop=None, label=None)
+        Adds the rows first to stop of a .asg file to the dataset.
+    assign_axis(axis)
+        Assigns the axis of the dataset.
+    save(path=None)
+        Writes the .asgv file.
+    member(idx)
+        Member holding a spectrum, as (AsgFile, index in the member).
+    get_label(spectrum_idx)
+        Returns the class of a spectrum.
+    iter_blocks(size=1000, start=0, stop=None, workers=None)
+        Reads the spectra sequentially, by blocks of rows.
+    """
+    def __init__(self, file_path, replace=False):
+        if file_path.endswith(EXTENSION) is False :
+            file_path = file_path + EXTENSION
+        self.path = abspath(file_path)
+        self.name = basename(self.path)
+        self.members = []
+        self.offsets = zeros(1, dtype=int64)
+        self.Asgard_param = {'Spec len' : None, 'Spec amount' : 0, 'Axis' : None}
+        self.labels = {}
+        self.shape = (None, 0)
+        self._files = {} #opened members, {member number : AsgFile}
+        self._good = None #good and identity, gathered from the members when first used
+        self._identity = None
+        
+        if isfile(self.path) is True and replace is False :
+            self._load()
+    
+    def __mul__(self, param):
+        """AsgFile*'key' notation, for 'Spec len', 'Spec amount' and 'Axis' (or a list of them)"""
+        if type(param) is list or type(param) is tuple :
+            return [self.Asgard_param[i] for i in param]
+        elif type(param) is str :
+            return self.Asgard_param[param]
+        raise TypeError('expected Asgard_param key or list of key, not %s' %type(param))
+    
+    def __getitem__(self, idx):
+        """
+        [square bracket] overload, as AsgFile : [row], [row, column], rows 
+        and columns as int or slice.  Spectra spanning many members are 
+        read from each of them.
+        
+        Returns
+        --------
+        results : 1D or 2D numpy array
+            1D for a single row or a single column, spectra as rows otherwise.
+        """
+        if type(idx) is tuple :
+            if len(idx) != 2 :
+                raise TypeError('expected [rows] or [rows, columns]')
+            rows, cols = idx
+        else :
+            rows, cols = idx, slice(None)
+        row_start, row_end = self._bounds(rows, self*'Spec amount', 0)
+        col_start, col_end = self._bounds(cols, self*'Spec len', 1)
+        
+        parts = []
+        for asg, first, last, shift in self._pieces(row_start, row_end) :
+            part = asg[first:last, col_start:col_end]
+            parts.append(part.reshape([last - first, col_end - col_start]))
+        if len(parts) == 0 :
+            result = zeros([0, col_end - col_start], dtype=float32)
+        elif len(parts) == 1 :
+            result = parts[0]
+        else :
+            result = concatenate(parts)
+        
+        if row_end - row_start == 1 or col_end - col_start == 1 :
+            return result.ravel()
+        return result
+    
+    def __iter__(self):
+        """Iterates over the spectra, one 1D numpy array at a time (see iter_blocks)"""
+        for start, block in self.iter_blocks():
+            for spectrum in block :
+                yield spectrum
+    
+    def iter_blocks(self, size=1000, start=0, stop=None, workers=None):
+        """
+        Reads the spectra sequentially in blocks of at most size rows (blocks
+        end with their member), keeping at most one block in RAM.
+        
+        inputs
+        -------
+        size : int
+            Amount of spectra per block.
+        start, stop : int
+            Spectra to read, stop excluded.  If stop is None, reads to the end.
+        workers : int or None
+            Threads decompressing compressed members (see AsgFile.iter_blocks).
+            
+        Yields
+        -------
+        start : int
+            Global index of the first spectrum of the block.
+        block : numpy 2D array
+            Spectra as rows.
+        """
+        if stop is None :
+            stop = self*'Spec amount'
+        for asg, first, last, shift in self._pieces(start, stop) :
+            for local, block in asg.iter_blocks(size=size, start=first, stop=last, workers=workers) :
+                yield shift + local - first, block
+    
+    def member(self, idx):
+        """
+        Member holding spectrum idx.
+        
+        Returns
+        --------
+        asg : AsgFile
+            The member.
+        local : int
+            Index of the spectrum in the member.
+        """
+        if idx < 0 or idx >= self*'Spec amount' :
+            raise IndexError('index %s is out of bound for axis 0 with size %s' %(idx, self*'Spec amount'))
+        number = int(searchsorted(self.offsets, idx, side='right')) - 1
+        return self._open(number), self.members[number]['First'] + int(idx - self.offsets[number])
+    
+    def get_label(self, spectrum_idx):
+        """
+        Returns the class assigned to a spectrum (None if its range is not
+        labeled).
+        
+        inputs
+        -------
+        spectrum_idx : int
+            Global index of the spectrum.
+        """
+        if len(self.labels) == 0 :
+            raise Exc.FileFormatError('This dataset has not been labeled')
+        for key in self.labels :
+            start, end = [int(i) for i in key.split('-')]
+            if start <= spectrum_idx < end :
+                return self.labels[key]
+        return None
+    
+    @property
+    def good(self):
+        """Good spectra of the members, in global indexes"""
+        if self._good is None :
+            self._gather()
+        return self._good
+    
+    @property
+    def identity(self):
+        """Identity of the good spectra, empty unless every member has them"""
+        if self._identity is None :
+            self._gather()
+        return self._identity
+    
+    def add(self, file_path, first=0, stop=None, label=None):
+        """
+        Adds rows of a .asg file at the end of the dataset.  Only the heading
+        of the file is read.  The dataset must then be saved.
+        
+        Inputs
+        --------
+        file_path : str
+            .asg file (member).
+        first, stop : int
+            Rows of the member to add, stop excluded.  All of them by default.
+        label : str or None
+            Label of all the rows added.  If None, the labels of the member 
+            (within the rows added) are kept.
+        """
+        path = abspath(file_path)
+        asg = AsgFile(path)
+        if 'S' not in asg.codes :
+            raise Exc.FileFormatError('%s holds no spectra' %asg.name)
+        if stop is None :
+            stop = asg*'Spec amount'
+        if first < 0 or stop > asg*'Spec amount' or stop < first :
+            raise IndexError('rows %s to %s are out of bound for %s (%s spectra)' 
+                             %(first, stop, asg.name, asg*'Spec amount'))
+        if self*'Spec len' is None :
+            self.Asgard_param['Spec len'] = asg*'Spec len'
+        elif asg*'Spec len' != self*'Spec len' :
+            raise Exc.FileFormatError('%s has a different length of spectrum' %asg.name)
+        if self*'Axis' is None and asg*'Axis' is not None :
+            self.Asgard_param['Axis'] = [float(i) for i in asg*'Axis']
+        
+        start = self*'Spec amount'
+        if label is not None :
+            self.labels['%s-%s' %(start, start + stop - first)] = label
+        else :
+            for key in asg.labels :
+                low, high = [int(i) for i in key.split('-')]
+                low = max(low, first)
+                high = min(high, stop)
+                if low < high :
+                    self.labels['%s-%s' %(start + low - first, start + high - first)] = asg.labels[key]
+        
+        self._files[len(self.members)] = asg
+        self.members.append({'Path' : path, 'First' : first, 'Stop' : stop, 'Label' : label})
+        self._update()
+    
+    def assign_axis(self, axis):
+        """Assigns the axis of the dataset (the dataset must then be saved)"""
+        if axis is not None and len(axis) != self*'Spec len' :
+            raise Exc.InputError('axis must have %s values' %(self*'Spec len'))
+        self.Asgard_param['Axis'] = None if axis is None else [float(i) for i in axis]
+    
+    def save(self, path=None):
+        """
+        Writes the dataset to its .asgv file (or to path, which becomes the
+        file of the dataset).  The file is replaced at once, readers never 
+        see a partial file.
+        """
+        if path is not None :
+            if path.endswith(EXTENSION) is False :
+                path = path + EXTENSION
+            self.path = abspath(path)
+            self.name = basename(self.path)
+        
+        folder = dirname(self.path)
+        lines = ['Asgard Virtual Dataset', 'Version\t%s' %VERSION, 
+                 'Spec len\t%s' %(self*'Spec len'), 'Axis\t%s' %(self*'Axis')]
+        lines += ['%s\t%s' %(key, value) for key, value in self._settings().items()]
+        lines.append('Members')
+        for member in self.members :
+            location = member['Path']
+            if location.startswith(join(folder, '')) :
+                location = relpath(location, folder)
+            lines.append('%s\t%s\t%s\t%s' %(location, member['First'], member['Stop'], member['Label']))
+        lines.append('Labels')
+        for key in self.labels :
+            lines.append('%s\t%s' %(key, self.labels[key]))
+        
+        with open(self.path + '.tmp', 'w', encoding='utf-8', newline='\n') as f :
+            f.write('\n'.join(lines) + '\n')
+        replace_file(self.path + '.tmp', self.path)
+    
+    def _load(self):
+        """Reads the .asgv file (members are opened when first read)"""
+        with open(self.path, 'r', encoding='utf-8') as f :
+            lines = f.read().split('\n')
+        if lines[0] != 'Asgard Virtual Dataset' :
+            raise Exc.FileFormatError('%s is not an Asgard virtual dataset' %self.name)
+        try :
+            version = int(lines[1].split('\t')[1])
+            if version > VERSION :
+                raise Exc.FileFormatError('Asgard virtual dataset version %s is not supported (latest %s)' 
+                                          %(version, VERSION))
+            spec_len = lines[2].split('\t')[1]
+            self.Asgard_param['Spec len'] = None if spec_len == 'None' else int(spec_len)
+            axis = lines[3].split('\t', 1)[1]
+            self.Asgard_param['Axis'] = None if axis == 'None' else [float(i) for i in axis[1:-1].split(', ')]
+            
+            position = lines.index('Members') + 1
+            self._read_settings(dict(line.split('\t', 1) for line in lines[4:position-1]))
+            folder = dirname(self.path)
+            while lines[position] != 'Labels' :
+                location, first, stop, label = lines[position].split('\t')
+                if isabs(location) is False :
+                    location = abspath(join(folder, location))
+                self.members.append({'Path' : location, 'First' : int(first), 'Stop' : int(stop), 
+                                     'Label' : None if label == 'None' else label})
+                position += 1
+            for line in lines[position+1:] :
+                if line != '' :
+                    key, label = line.split('\t', 1)
+                    self.labels[key] = label
+        except (IndexError, ValueError) :
+            raise Exc.FileFormatError('%s is not an Asgard virtual dataset or has been tempered with.' %self.name)
+        self._update()
+    
+    def _settings(self):
+        """Extra 'key\tvalue' lines written before the members (none here, see AsgardSegmentedFile)"""
+        return {}
+    
+    def _read_settings(self, settings):
+        """Reads the extra lines written by _settings, as {key : value (str)}"""
+        pass
+    
+    def _update(self):
+        """Offsets, amount and shape from the members"""
+        counts = asarray([member['Stop'] - member['First'] for member in self.members], dtype=int64)
+        self.offsets = concatenate([zeros(1, dtype=int64), counts.cumsum()])
+        self.Asgard_param['Spec amount'] = int(self.offsets[-1])
+        self.shape = (self*'Spec len', self*'Spec amount')
+        self._good = None
+        self._identity = None
+    
+    def _open(self, number):
+        """AsgFile of a member, opened once"""
+        if number not in self._files :
+            member = self.members[number]
+            if isfile(member['Path']) is False :
+                raise Exc.FileNameError('%s reads spectra from %s, which can not be found.' %(self.name, member['Path']))
+            asg = AsgFile(member['Path'])
+            if 'S' not in asg.codes or asg*'Spec amount' < member['Stop'] or asg*'Spec len' != self*'Spec len' :
+                raise Exc.FileFormatError('%s reads spectra from %s, which has been modified since.' 
+                                          %(self.name, member['Path']))
+            self._files[number] = asg
+        return self._files[number]
+    
+    def _pieces(self, start, stop):
+        """
+        (AsgFile, first, last, start) of the members holding the spectra start
+        to stop (excluded) : rows first to last of the member are the spectra
+        from global index start.
+        """
+        if stop <= start :
+            return
+        number = int(searchsorted(self.offsets, start, side='right')) - 1
+        while number < len(self.members) and self.offsets[number] < stop :
+            low = max(start, int(self.offsets[number])) - int(self.offsets[number])
+            high = min(stop, int(self.offsets[number+1])) - int(self.offsets[number])
+            if high > low :
+                first = self.members[number]['First']
+                yield self._open(number), first + low, first + high, int(self.offsets[number]) + low
+            number += 1
+    
+    def _gather(self):
+        """Reads good and identity from the members"""
+        good = []
+        identity = []
+        complete = True
+        for number, member in enumerate(self.members) :
+            asg = self._open(number)
+            names = dict(zip(asg.good, asg.identity)) if len(asg.identity) == len(asg.good) else None
+            for idx in asg.good :
+                if member['First'] <= idx < member['Stop'] :
+                    good.append(int(self.offsets[number]) + idx - member['First'])
+                    if names is not None :
+                        identity.append(names[idx])
+            complete = complete and names is not None
+        self._good = good
+        self._identity = identity if complete is True else []
+    
+    @staticmethod
+    def _bounds(index, size, axis):
+        """(start, end) of an int or slice index along an axis of the given size"""
+        if isinstance(index, (int, integer)) :
+            index = int(index)
+            if index < 0 :
+                index += size
+            if index < 0 or index >= size :
+                raise IndexError('index %s is out of bound for axis %s with size %s' %(index, axis, size))
+            return index, index + 1
+        if type(index) is slice :
+            if index.step not in (None, 1) :
+                raise TypeError('slices with a step are not supported')
+            start, end, step = index.indices(size)
+            return start, max(start, end)
+        raise TypeError('accepts array indices as int or slice, not %s' %type(index))
@@ -116,6 +116,7 @@ ODIN_FIRST = True
 NARVI_FIRST = True
 NARVI_INPUT = PACK_STORAGE
 NARVI_OUTPUT = PACK_STORAGE + '/Narvi'
+NARVI_WORKERS = 0                       #Files converted in parallel (0 : one per CPU)
 DEFAULT_TYPE = 'Autodetect'
 
 #%% Etc
@@ -42,6 +42,7 @@ Content
 class AsgardError
 class AreYouSeriouserror
 class FileNameerror
+class FileLockedError
 class ConfigDBError
 class FutureImplementationError
 class InputError
@@ -74,6 +75,12 @@ class FileNameError(AsgardError):
     """
     pass
 
+class FileLockedError(AsgardError):
+    """
+    Used when a file can not be written because another program is writing it.
+    """
+    pass
+
 class ConfigDBError(AsgardError):
     """
     Used for errors related to SQLalchemy configuration database.  
@@ -48,6 +48,8 @@ __version__ = "1.0.0"
 __license__ = "MIT"
 
 from .AsgardFile import AsgFile
+from .AsgardVirtualFile import AsgVirtualFile
+from .AsgardSegmentedFile import AsgSegmentedFile
 from . import Exceptions
 
 from .AsgardFileConvert import convert_Andor
@@ -59,6 +61,21 @@ from .AsgardFileConvert import convert_text
 from .AsgardFileConvert import convert_old_Thor
 from .AsgardFileConvert import convert_Witec
 from .AsgardFileConvert import type_sniff
+from .AsgardFileConvert import sniff_type
+from .AsgardFileConvert import external_reference
+from .AsgardFileConvert import stream
+from .AsgardFileConvert import register_converter
+from .AsgardFileConvert import get_converter
+from .AsgardFileConvert import converters
+from .AsgardFileConvert import archive_members
+
+from .AsgardFileExport import export
+from .AsgardFileExport import TxtWriter
+from .AsgardFileExport import NpyWriter
+from .AsgardFileExport import XlsxWriter
+from .AsgardFileExport import HDF5Writer
+from .AsgardFileExport import ParquetWriter
+from .AsgardFileExport import FeatherWriter
 
 from .ConfigDbFct import create_config_DB
 from .ConfigDbFct import add_config
@@ -45,6 +45,8 @@ Content
 ------
 class Narvi(root, Source=None, TrackerObj=None)
     Interface to help user convert, label, and/or merge data files for use with Asgard.
+def convert_file(file, path, type_, axis_rmv=False, axis=None, link=False, label=None, spectrum_length=None)
+    Converts a single file to an .asg file (run in parallel by Narvi)
     
 """
 
@@ -59,10 +61,12 @@ from .EnhancedWidgets.StatusTracker import Tracker
 from .EnhancedWidgets.Sets import Sets
 from .Configs import Exceptions as Exc
 from .Configs.AsgardFile import AsgFile
-from .Configs.ConfigVariables import LARGE_FONT, NARVI_INPUT, NARVI_OUTPUT, SUPPORTED_INPUT_TYPES, DEFAULT_TYPE
+from .Configs.AsgardVirtualFile import AsgVirtualFile
+from .Configs.AsgardFileConvert import converters, get_converter, archive_members, is_compressed, source_name
+from .Configs.ConfigVariables import LARGE_FONT, NARVI_INPUT, NARVI_OUTPUT, NARVI_WORKERS, DEFAULT_TYPE
 
 
-from tkinter import Frame, Button, Entry, Checkbutton, Label, OptionMenu
+from tkinter import Frame, Button, Entry, Checkbutton, Label, OptionMenu, Listbox, Scrollbar
 from tkinter import StringVar, BooleanVar
 from tkinter.messagebox import showinfo
 from tkinter.filedialog import askdirectory, askopenfilename
@@ -70,12 +74,13 @@ from tkinter.simpledialog import askstring
 from tkinter.messagebox import askokcancel
 from tkinter import _setit
 
-from os import listdir
-from os.path import isfile, basename
+from os import listdir, cpu_count
+from os.path import isfile, basename, splitext, abspath
 from tempfile import TemporaryDirectory
 from shutil import copy
 
 from functools import partial 
+from concurrent.futures import ProcessPoolExecutor, Future
 
 from pandas import read_csv
 
@@ -107,6 +112,13 @@ class Narvi() :
             Whether the user knows what the given data represent (training set) or not.
         MergeVar : tkinter BooleanVar
             Whether the user selected to merge all files or not.
+        VirtualVar : tkinter BooleanVar
+            Whether merged files are listed in a virtual dataset (.asgv) 
+            instead of being copied to a single .asg.
+        LinkVar : tkinter BooleanVar
+            Whether .sif and numpy spectra should be read from the source files instead of copied.
+        WorkersVar : tkinter StringVar
+            Amount of files converted in parallel.
         files : list of str
             Path to all files imported.
         file_type : list of str
@@ -128,6 +140,10 @@ class Narvi() :
             Creates the window where the user can assign labels and convert files.
         convert()
             Create all the required .asg files according to previously given informations.
+        merge(td, name, shards)
+            Merges converted files into a single dataset.
+        virtual_merge(td, name, members)
+            Lists converted files in a virtual dataset (.asgv).
         final_touches(td)
             Copy the created files from temporary directory to output folder
     
@@ -172,7 +188,8 @@ class Narvi() :
                 file_list = []
                 for name in listdir(location):
                     if isfile(location + '/' + name) is True: 
-                        file_list.append(location + '/' + name)
+                        #every member of a zip archive is a file to import
+                        file_list.extend(archive_members(location + '/' + name))
                 if len(file_list)>0 :
                     #save important stuff and move to next step
                     self.import_type = 'folder'
@@ -194,13 +211,16 @@ class Narvi() :
             location = askopenfilename(initialdir = NARVI_INPUT, title = "Select the file to convert")
             if location != '':
                 #save important stuff and move to next step
-                self.import_type = 'file'
-                
-                #initialise to avoid attr error later
-                self.MergeVar = BooleanVar(value=False)
+                self.files = archive_members(location)
+                if len(self.files) > 1 : #zip archive, imported like a folder
+                    self.import_type = 'folder'
+                else :
+                    self.import_type = 'file'
+                    
+                    #initialise to avoid attr error later
+                    self.MergeVar = BooleanVar(value=False)
                 
                 SubFrame.destroy()
-                self.files = [location]
                 self.output_step(return_dict)
                 
         self.root.geometry('{}x{}'.format(640, 100))
@@ -267,7 +287,7 @@ class Narvi() :
             SubFrame.destroy()
             self.file_tag_step(return_dict)
         
-        self.root.geometry('{}x{}'.format(640, 180))
+        self.root.geometry('{}x{}'.format(640, 230))
 
         SubFrame = Frame(self.MainFrame)
         SubFrame.grid(column=0, row=1)
@@ -314,6 +334,27 @@ class Narvi() :
         UnknownButton = Button(SubFrame, text='Unknown data', width=15, font=LARGE_FONT, command=unknown_data)
         UnknownButton.grid(column=1, row=2, sticky='w')
         
+        self.LinkVar = BooleanVar(value=False)
+        LinkCB = Checkbutton(SubFrame, text = 'Reference raw data (no copy, .sif and numpy only)',
+                                           variable = self.LinkVar)
+        LinkCB.grid(column=0, row=3, columnspan=2)
+        
+        self.VirtualVar = BooleanVar(value=False)
+        if self.import_type == 'folder':
+            self.root.geometry('{}x{}'.format(640, 255))
+            VirtualCB = Checkbutton(SubFrame, text = 'Merge as a virtual dataset (.asgv, .asg files are not copied)',
+                                    variable = self.VirtualVar)
+            VirtualCB.grid(column=0, row=5, columnspan=2)
+        
+        workers = NARVI_WORKERS
+        if workers < 1 :
+            workers = cpu_count()
+        self.WorkersVar = StringVar(value=str(workers))
+        WorkersLabel = Label(SubFrame, text = 'Files converted in parallel : ')
+        WorkersLabel.grid(column=0, row=4, sticky='e')
+        WorkersEntry = Entry(SubFrame, textvar=self.WorkersVar, width=4)
+        WorkersEntry.grid(column=1, row=4, sticky='w')
+        
         
     
     def file_tag_step(self, return_dict):
@@ -521,7 +562,7 @@ class Narvi() :
                 self.file_axis.append(None)  
                 self.file_class.append('Unassigned')
 
-        types = list(SUPPORTED_INPUT_TYPES)
+        types = [i for i in converters() if i != 'Asgard'] #registered converters, plugins included
         types.append('Autodetect')
         types.append('Asgard')
         types.append('Skip this file')
@@ -629,65 +670,43 @@ class Narvi() :
         
     def convert(self, return_dict):
         """
-        Converts all files according to selected parameter.  If multiple axis
-        are found for a merged dataset, creates an axis selection menu.
+        Converts all files according to selected parameter, in parallel 
+        processes (see convert_file).  A progress view lists the state of 
+        every file while they are converted.
         
-        Once the user have made his choices, calls final_touches().
+        For a merged dataset, every file is converted to a shard in parallel,
+        then the shards are merged in order (see merge).  For a virtual 
+        dataset, files are converted as for separate files (.asg files are 
+        read where they are), then listed in order (see virtual_merge).
+        
+        Once all files are done, calls final_touches(), merge() or virtual_merge().
         
 
         """
-
-        temp = TemporaryDirectory()
-        td = temp.name
+        self.temp = TemporaryDirectory() #kept as attribute, it must outlive this method
+        td = self.temp.name
         for idx, type_ in enumerate(self.file_type) :
-            if type_ == 'Autodetect' and self.files[idx].endswith('.asg'):
+            if type_ == 'Autodetect' and self.files[idx].endswith('.asg') and is_compressed(self.files[idx]) is False :
                 self.file_type[idx] = 'Asgard'
         
-        #For individual files        
-        if self.MergeVar.get() is False:
-            
-            for idx, file in enumerate(self.files) :
-                print('starting file : %s' %file)
-                try :
-                    dot = 1+ basename(file)[::-1].index('.')
-                    name = basename(file)[:-dot]
-                except ValueError :
-                    name = basename(file)
-                    
-                path = td + '/' + name
-                
-                #make file
-                if self.file_type[idx] == 'Asgard' :
-                    copy(file, td)
-                    asg = AsgFile(file_path = path, root = self.root)
-                    
-                elif self.file_type[idx] == 'Autodetect' :
-                    asg = AsgFile(file_path=path, root=self.root)
-                    asg.convert_data(file_path=file)
-                    
-                elif self.file_type[idx] == 'Skip this file':
-                    pass
-                else :
-                    asg = AsgFile(file_path=path, root=self.root)
-                    asg.convert_data(file_path=file, type_=self.file_type[idx])
-                
-                if self.file_type[idx] != 'Skip this file' :
-    
-                    #set axis
-                    if self.file_axis_rmv[idx] is True :
-                        asg.axis_first()
-                    elif self.file_axis[idx] is not None :
-                        asg.assign_axis(self.file_axis[idx])
-
-                    #set label
-                    if self.labeled is True and self.file_class[idx] != 'Unassigned':
-                        asg.label(0, asg*'Spec amount', self.file_class[idx])
-
-                print('ending file : %s' %file)
-            self.final_touches(td, return_dict)
+        try :
+            workers = int(self.WorkersVar.get())
+        except ValueError :
+            workers = NARVI_WORKERS
+        if workers < 1 :
+            workers = cpu_count()
         
-        #for single dataset           
-        else :
+        merge = self.MergeVar.get()
+        virtual = merge is True and self.VirtualVar.get() is True
+        if virtual is True :
+            name = askstring('Dataset name','Please enter a name for the \n' +
+                             'virtual dataset file to create', initialvalue='Narvi dataset.asgv', parent=self.root)
+            if name is None :
+                name = 'Narvi dataset.asgv'
+            elif name.endswith('.asgv') is False:
+                name = name + '.asgv'
+            merge = False
+        elif merge is True :
             #*#
             name = askstring('Dataset name','Please enter a name for the \n' +
                              'dataset file to create', initialvalue='Narvi dataset.asg', parent=self.root)
@@ -695,106 +714,253 @@ class Narvi() :
                 name = 'Narvi dataset.asg'
             elif name.endswith('.asg') is False:
                 name = name + '.asg'
-                
-            dataset = AsgFile(td+'/'+name)
-            for idx, type_ in enumerate(self.file_type):
-                if type_ == 'Autodetect':
-                    self.file_type[idx] = None
-            
-            axis_choices = []
-            axis_choices_idx = []
-            axis_choices_name = []
-            for idx,file in enumerate(self.files):
-                print('starting file : %s' %file)
-                spec_amount = dataset*'Spec amount'
-                
-                if self.file_type[idx] != 'Skip this file' :
-                    try :
-                        axis = dataset.Narvi_merge(file, type_=self.file_type[idx],
-                                                   axis_rmv=self.file_axis_rmv[idx])
-
-                    except Exc.FutureImplementationError :
-                        print('file %s caused a FutureImplementationError\n skipping this file...' %file)
-                        
-                    if axis is not None :
-                        same = True
-                        for i in axis_choices:
-                            for idx2, j in enumerate(axis):
-                                if j != i[idx2] :
-                                    same = False
-                                    break
-                            if same is True :
-                                break
-                            
-                        if same is False :
-                            axis_choices.append(axis)
-                            axis_choices_idx.append(idx)
-                            axis_choices_name.append(basename(file))
-            
-                    if self.labeled is True and self.file_class[idx] != 'Unassigned':
-                        mini = spec_amount
-                        spec_amount = dataset*'Spec amount'
-                        maxi = spec_amount
-                        dataset.label(mini, maxi, self.file_class[idx], save=False) #will be saved with axis
-                print('ending file : %s' %file)
-
-            if len(axis_choices) > 1 :
-                #axis selection interface
-                def axis_info(*arg):
-                    """
-                    Upon new selection via the option menu, updates the displayed 
-                    file type associated with the selected file.
-                    
-                    """
-                    idx = axis_choices_name.index(ChoiceOMVar.get())
-                    TypeLabelVar.set(self.file_type[axis_choices_idx[idx]])
+            self.shard_temp = TemporaryDirectory()
+        
+        #Jobs : one per file
+        executor = ProcessPoolExecutor(max_workers=workers)
+        futures = {}
+        names = []
+        for idx, file in enumerate(self.files) :
+            if self.file_type[idx] == 'Skip this file':
+                continue
+            
+            #Witec spectra are back to back, the selected axis gives their length
+            length = None
+            if self.file_type[idx] == 'Witec' and self.file_axis[idx] is not None :
+                length = len(self.file_axis[idx])
+            
+            if merge is True :
+                path = self.shard_temp.name + '/shard %s' %idx
+                futures[idx] = executor.submit(convert_file, file, path, self.file_type[idx],
+                                               axis_rmv=self.file_axis_rmv[idx], spectrum_length=length)
+            elif virtual is True and self.file_type[idx] == 'Asgard' and is_compressed(file) is False :
+                #the virtual dataset reads the .asg file where it is
+                futures[idx] = Future()
+                futures[idx].set_result(file)
+            else :
+                base = basename(source_name(file)) #without .gz or archive
+                try :
+                    dot = 1+ base[::-1].index('.')
+                    name_ = base[:-dot]
+                except ValueError :
+                    name_ = base
+                while name_ in names : #same name, different extension
+                    name_ = name_ + ' (1)'
+                names.append(name_)
                     
-                def select():
-                    """
-                    Extracts the selected file's axis from internal variable 
-                    and assigns it to the merged dataset file.
-                    """
-                    idx = axis_choices_name.index(ChoiceOMVar.get())
-                    dataset.assign_axis(axis_choices[idx])
-                    self.final_touches(td,return_dict)
-                
-                SubFrame = Frame(self.root)
-                SubFrame.pack(anchor='center')
-                self.StatusVar.set('Multiple different axis were found while merging.\n' + 
-                                   'Please select which axis you would like to keep stored on the dataset.\n\n' +
-                                   'Note that if the same axis was found multiple time, only the first source is listed.' + 
-                                   '_______________________________')
-                
-                ChoiceOMVar = StringVar(value = axis_choices_name[0])
-                ChoiceOMVar.trace('w', axis_info)
-                
-                ChoiceOM = OptionMenu(SubFrame, ChoiceOMVar, *axis_choices_name)
-                ChoiceOM.grid(column=1, row=1)
-                
-                TypeLabelVar = StringVar(value = self.file_type[axis_choices_idx[0]])
-                TypeLabel = Label(SubFrame, textvar=TypeLabelVar)
-                TypeLabel.grid(column=0, row=0)
+                label = None
+                if self.labeled is True and self.file_class[idx] != 'Unassigned':
+                    label = self.file_class[idx]
+                futures[idx] = executor.submit(convert_file, file, td + '/' + name_, self.file_type[idx],
+                                               axis_rmv=self.file_axis_rmv[idx], axis=self.file_axis[idx],
+                                               link=self.LinkVar.get(), label=label, spectrum_length=length)
+        
+        #Progress view
+        self.root.geometry('{}x{}'.format(640, 400))
+        SubFrame = Frame(self.MainFrame)
+        SubFrame.grid(column=0, row=1)
+        
+        Progress = Listbox(SubFrame, width=90, height=15)
+        Progress.grid(column=0, row=0)
+        ProgressScroll = Scrollbar(SubFrame, command=Progress.yview)
+        ProgressScroll.grid(column=1, row=0, sticky='ns')
+        Progress.config(yscrollcommand=ProgressScroll.set)
+        
+        order = list(futures.keys())
+        for idx in order :
+            Progress.insert('end', '%s : waiting' %basename(self.files[idx]))
+        state = {idx : 'waiting' for idx in order}
+        
+        def poll():
+            """
+            Updates the progress view every 200 ms until every file is done,
+            then moves on to the next step.
+            
+            """
+            done = 0
+            for row, idx in enumerate(order) :
+                future = futures[idx]
+                if future.done() is True :
+                    done += 1
+                    if future.exception() is None :
+                        new_state = 'done'
+                    else :
+                        new_state = 'failed (%s)' %future.exception()
+                elif future.running() is True :
+                    new_state = 'converting'
+                else :
+                    new_state = 'waiting'
                 
-                SelectButton = Button(SubFrame, command = select)
-                SelectButton.grid(column=0, row=0)
-                                    
+                if new_state != state[idx] :
+                    if new_state.startswith('failed') :
+                        print('file %s could not be converted : %s' %(self.files[idx], future.exception()))
+                    state[idx] = new_state
+                    Progress.delete(row)
+                    Progress.insert(row, '%s : %s' %(basename(self.files[idx]), new_state))
+                    Progress.see(row)
+            
+            self.StatusVar.set('Converting files with %s parallel processes : %s/%s done\n' %(workers, done, len(order)) + 
+                               '_______________________________')
+            
+            if done < len(order) :
+                self.root.after(200, poll)
+            else :
+                executor.shutdown()
+                SubFrame.destroy()
+                if merge is True :
+                    shards = [(idx, futures[idx].result()) for idx in order if futures[idx].exception() is None]
+                    self.merge(td, name, shards, return_dict)
+                elif virtual is True :
+                    members = [(idx, futures[idx].result()) for idx in order if futures[idx].exception() is None]
+                    self.virtual_merge(td, name, members, return_dict)
+                else :
+                    self.final_touches(td, return_dict)
+        
+        poll()
+        
+    def merge(self, td, name, shards, return_dict):
+        """
+        Merges the converted shards, in order, into a single dataset.  If 
+        multiple axis are found, creates an axis selection menu.
+        
+        Once the user have made his choices, calls final_touches().
+        
+        Inputs :
+            td : str
+                Temporary directory where the dataset is created.
+            name : str
+                Name of the dataset file.
+            shards : list of tuple
+                (index of the source file, path to its converted .asg)
+        
+        """
+        dataset = AsgFile(td+'/'+name)
+        
+        axis_choices = []
+        axis_choices_idx = []
+        axis_choices_name = []
+        axis = None
+        for idx, shard in shards:
+            file = self.files[idx]
+            spec_amount = dataset*'Spec amount'
+            if spec_amount is None :
+                spec_amount = 0
+            
+            try :
+                dataset.Narvi_merge(shard, type_='Asgard')
+                axis = AsgFile(shard)*'Axis'
                 
+            except Exc.FutureImplementationError :
+                print('file %s caused a FutureImplementationError\n skipping this file...' %file)
+                continue
                 
+            if axis is not None :
+                same = False
+                for i in axis_choices:
+                    if len(i) == len(axis) and all([j == k for j, k in zip(i, axis)]) :
+                        same = True
+                        break
+                    
+                if same is False :
+                    axis_choices.append(axis)
+                    axis_choices_idx.append(idx)
+                    axis_choices_name.append(basename(file))
+    
+            if self.labeled is True and self.file_class[idx] != 'Unassigned':
+                mini = spec_amount
+                spec_amount = dataset*'Spec amount'
+                maxi = spec_amount
+                dataset.label(mini, maxi, self.file_class[idx], save=False) #will be saved with axis
+        
+        self.shard_temp.cleanup()
+
+        if len(axis_choices) > 1 :
+            #axis selection interface
+            def axis_info(*arg):
+                """
+                Upon new selection via the option menu, updates the displayed 
+                file type associated with the selected file.
                 
+                """
+                idx = axis_choices_name.index(ChoiceOMVar.get())
+                TypeLabelVar.set(self.file_type[axis_choices_idx[idx]])
                 
-            elif len(axis_choices) == 0:
-                dataset.save()
-                self.final_touches(td, return_dict)
-            else : #len ==1
-                dataset.assign_axis(axis)
-                self.final_touches(td, return_dict)
-        
+            def select():
+                """
+                Extracts the selected file's axis from internal variable 
+                and assigns it to the merged dataset file.
+                """
+                idx = axis_choices_name.index(ChoiceOMVar.get())
+                dataset.assign_axis(axis_choices[idx])
+                self.final_touches(td,return_dict)
+            
+            SubFrame = Frame(self.root)
+            SubFrame.pack(anchor='center')
+            self.StatusVar.set('Multiple different axis were found while merging.\n' + 
+                               'Please select which axis you would like to keep stored on the dataset.\n\n' +
+                               'Note that if the same axis was found multiple time, only the first source is listed.' + 
+                               '_______________________________')
+            
+            ChoiceOMVar = StringVar(value = axis_choices_name[0])
+            ChoiceOMVar.trace('w', axis_info)
+            
+            ChoiceOM = OptionMenu(SubFrame, ChoiceOMVar, *axis_choices_name)
+            ChoiceOM.grid(column=1, row=1)
+            
+            TypeLabelVar = StringVar(value = self.file_type[axis_choices_idx[0]])
+            TypeLabel = Label(SubFrame, textvar=TypeLabelVar)
+            TypeLabel.grid(column=0, row=0)
+            
+            SelectButton = Button(SubFrame, command = select)
+            SelectButton.grid(column=0, row=0)
+                                
+            
+            
+            
+            
+        elif len(axis_choices) == 0:
+            dataset.save()
+            self.final_touches(td, return_dict)
+        else : #len ==1
+            dataset.assign_axis(axis_choices[0])
+            self.final_touches(td, return_dict)
+    
+    
+    
+    
+    def virtual_merge(self, td, name, members, return_dict):
+        """
+        Lists the converted files, in order, in a virtual dataset (see 
+        AsgardVirtualFile) : no spectrum is copied.  The axis of the 
+        dataset is the one of the first file with an axis.
         
+        Once done, calls final_touches().
         
+        Inputs :
+            td : str
+                Temporary directory where the dataset is created.
+            name : str
+                Name of the .asgv file.
+            members : list of tuple
+                (index of the source file, path to its .asg)
         
+        """
+        dataset = AsgVirtualFile(td+'/'+name, replace=True)
+        for idx, path in members :
+            label = None
+            if self.labeled is True and self.file_class[idx] != 'Unassigned':
+                label = self.file_class[idx]
+            try :
+                dataset.add(path, label=label)
+            except (Exc.FileFormatError, IndexError) as error :
+                print('file %s could not be added to the dataset : %s\n skipping this file...' %(self.files[idx], error))
+        dataset.save()
+        self.final_touches(td, return_dict)
+    
     def final_touches(self, td,return_dict) :
         """
-        Copies the created files to the proper location.
+        Copies the created files to the proper location.  Virtual datasets
+        are copied last, pointing to the copies of their members.
         
         Temporary directory will erase itself at the end of this function.
         
@@ -805,25 +971,27 @@ class Narvi() :
         overwrite = listdir(location)
         leny=0
         paths = []
-        for file in listdir(td) :
+        moved = {} #{path in td : path in location}, for the members of virtual datasets
+        for file in sorted(listdir(td), key=lambda name : name.endswith('.asgv')) :
             leny+=1
             if file in overwrite:
                 ans = askokcancel('Warning','file %s already exist in the output location, do you want to overwrite it?' %(file))
                 if ans is True :
-                    copy(td + '/' + file,location)
+                    self._place(td + '/' + file, location + '/' + file, moved)
                     path = location + '/' + file
                 else :
                     new_name = askstring('Warning','Enter a new name for file %s' %(file), parent=self.root)
+                    base, ext = splitext(file) #.asg or .asgv
                     if new_name is None  or new_name == file:
-                        new_name = file[:-4] + ' (1)' + '.asg'
-                    elif new_name.endswith('.asg') is False :
-                        new_name += '.asg'
+                        new_name = base + ' (1)' + ext
+                    elif new_name.endswith(ext) is False :
+                        new_name += ext
                         if new_name == file :
-                            new_name = file[:-4] + ' (1)' + '.asg'
-                    copy(td + '/' + file, location + '/' + new_name)
+                            new_name = base + ' (1)' + ext
+                    self._place(td + '/' + file, location + '/' + new_name, moved)
                     path = location + '/' + new_name
             else :
-                copy(td + '/' + file, location)
+                self._place(td + '/' + file, location + '/' + file, moved)
                 path = location + '/' + file
             paths.append(path)
         
@@ -832,3 +1000,74 @@ class Narvi() :
                         
             
         self.root.destroy()
+    
+    @staticmethod
+    def _place(source, destination, moved):
+        """Copies a file of final_touches; virtual datasets are rewritten to point to the copied members"""
+        if source.endswith('.asgv') :
+            dataset = AsgVirtualFile(source)
+            for member in dataset.members :
+                member['Path'] = moved.get(member['Path'], member['Path'])
+            dataset.save(destination)
+        else :
+            copy(source, destination)
+            moved[abspath(source)] = abspath(destination)
+
+
+def convert_file(file, path, type_, axis_rmv=False, axis=None, link=False, label=None, spectrum_length=None):
+    """
+    Converts a single file to an .asg file.  Used by Narvi.convert, in a 
+    separate process for each file, hence outside of the Narvi class.
+    
+    Inputs :
+        file : str
+            Path to the file to convert.
+        path : str
+            Path of the .asg file to create.
+        type_ : str
+            Type of the file ('Asgard', 'Autodetect' or a converter type).
+        axis_rmv : bool
+            Whether the first spectrum is the axis.
+        axis : list or None
+            Axis to assign to the file.
+        link : bool
+            Whether .sif and numpy spectra should be referenced instead of copied.
+        label : str or None
+            Label given to all the spectra.
+        spectrum_length : int or None
+            Length of the spectra of Witec files, found from the values if None.
+    
+    Returns :
+        path : str
+            Path of the created .asg file
+    """
+    linked = False
+    if type_ == 'Asgard' and is_compressed(file) is False :
+        copy(file, path + '.asg')
+        asg = AsgFile(file_path = path)
+    
+    else :
+        asg = AsgFile(file_path=path)
+        if type_ == 'Autodetect' :
+            type_ = None
+        if link is True and (type_ is None or get_converter(type_).zero_copy is True) :
+            try :
+                asg.link_data(file_path=file, type_=type_, axis_rmv=axis_rmv)
+                linked = True
+            except Exc.FileFormatError :
+                #spectra can't be read in place, copy them instead
+                pass
+        if linked is False :
+            asg.convert_data(file_path=file, type_=type_, spectrum_length=spectrum_length)
+    
+    #set axis
+    if axis_rmv is True and linked is False :
+        asg.axis_first()
+    elif axis is not None :
+        asg.assign_axis(axis)
+
+    #set label
+    if label is not None :
+        asg.label(0, asg*'Spec amount', label)
+    
+    return asg.path
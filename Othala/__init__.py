@@ -54,11 +54,14 @@ from . import EnhancedWidgets
 from . import ThirdParty
 
 from .Configs.AsgardFile import AsgFile
+from .Configs.AsgardVirtualFile import AsgVirtualFile
+from .Configs.AsgardSegmentedFile import AsgSegmentedFile
 
 from .CRR import CR_finder
 from .CRR import CR_eraser
 from .CRR import CR_limits
 from .CRR import CR_search_and_destroy
+from .CRR import CR_temporal
 
 from .Narvi import Narvi
 from .Thor import Thor